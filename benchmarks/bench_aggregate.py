@@ -0,0 +1,53 @@
+"""Compare downsampling in an on_message callback against Subscriber.aggregate,
+incremental, vectorized, and vectorized on columnar batches, on already decoded records.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_aggregate
+"""
+import timeit
+
+from influx_line_mqtt.aggregate import Aggregator
+from influx_line_mqtt.parser import parse, parse_columnar
+
+from .bench_decode import make_payload
+
+WINDOW = 10 * 10**9
+
+
+def by_hand(points, buckets):
+    """What consumers write in on_message: a dict of lists per window and series"""
+    for point in points:
+        key = (point.timestamp - point.timestamp % WINDOW, point.measurement, tuple(sorted(point.tag_set.items())))
+        bucket = buckets.setdefault(key, {})
+        for field, value in point.field_set.items():
+            bucket.setdefault(field, []).append(value)
+    for fields in buckets.values():
+        for values in fields.values():
+            sum(values) / len(values), max(values), len(values)
+    buckets.clear()
+
+
+def main():
+    for size in (1000, 10000):
+        raw = [make_payload(size) for _ in range(20000 // size)]
+        payloads = [parse(payload) for payload in raw]
+        batches = [parse_columnar(payload) for payload in raw]
+        cases = [("on_message", lambda: [by_hand(points, {}) for points in payloads])]
+        for name, vectorized, data in (
+            ("aggregate", False, payloads),
+            ("vectorized", True, payloads),
+            ("columnar", True, batches),
+        ):
+            def run(vectorized=vectorized, data=data):
+                aggregator = Aggregator(lambda client, userdata, records: None, window="10s", vectorized=vectorized)
+                for points in data:
+                    aggregator(None, None, points)
+                aggregator.flush()
+            cases.append((name, run))
+        for name, func in cases:
+            seconds = min(timeit.repeat(func, number=3, repeat=5))
+            print(f"{name:10} lines={size:6} {seconds / (3 * 20000) * 1e9:8.0f} ns/point")
+
+if __name__ == "__main__":
+    main()
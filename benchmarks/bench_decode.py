@@ -0,0 +1,44 @@
+"""Compare the line protocol parser against the original Decode class.
+
+Needs pytest-benchmark, run from the repository root:
+
+    python -m pytest benchmarks/bench_decode.py --benchmark-group-by=param:lines
+
+Decode leaves every field value a string and breaks on escapes and quoted
+strings, parse and parse_columnar return typed values.
+"""
+import random
+
+import pytest
+
+from influx_line_mqtt.parser import parse, parse_columnar
+from influx_line_mqtt.subscriber import Decode
+
+pytest.importorskip("pytest_benchmark")
+
+
+def make_payload(lines: int) -> bytes:
+    """Build a payload that looks like what our sensor gateways send"""
+    rooms = ["bed", "kitchen", "living", "bath", "garage"]
+    out = []
+    ts = 1656086785126144000
+    for i in range(lines):
+        out.append(
+            f"temp,measurement_type=temp,room={rooms[i % len(rooms)]},sensor=s{i % 64} "
+            f"temp={random.uniform(15, 30):.3f},humidity={random.uniform(20, 80):.2f},"
+            f"battery={random.randint(0, 100)}i {ts + i * 1000000}"
+        )
+    return "\n".join(out).encode("utf-8")
+
+
+def decode_original(payload: bytes):
+    return [Decode(line).decode() for line in payload.decode("utf-8").split("\n")]
+
+
+@pytest.mark.parametrize("decoder", [decode_original, parse, parse_columnar], ids=["Decode", "parse", "columnar"])
+@pytest.mark.parametrize("lines", [1, 100, 1000, 10000])
+def test_decode(benchmark, decoder, lines):
+    payload = make_payload(lines)
+    benchmark.extra_info["lines"] = lines
+    records = benchmark(decoder, payload)
+    assert len(records) == lines
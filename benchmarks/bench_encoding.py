@@ -0,0 +1,32 @@
+"""Compare the wire encodings: bytes on the wire and encode/decode CPU per point.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_encoding
+"""
+import timeit
+
+from influx_line_mqtt.encoding import ENCODINGS, decode_payload, encode_payload, zstandard
+
+from .bench_decode import make_payload
+
+
+def main():
+    encodings = [encoding for encoding in ENCODINGS if encoding != "zstd" or zstandard is not None]
+    for lines in (1, 100, 1000):
+        payload = make_payload(lines)
+        number = max(1, 20000 // lines)
+        for encoding in encodings:
+            encoded = encode_payload(payload, encoding)
+            assert decode_payload(encoded) == payload
+            encode = min(timeit.repeat(lambda: encode_payload(payload, encoding), number=number, repeat=5))
+            decode = min(timeit.repeat(lambda: decode_payload(encoded), number=number, repeat=5))
+            print(
+                f"{encoding:8} lines={lines:5} {len(encoded) / lines:7.1f} bytes/point"
+                f" encode {encode / (number * lines) * 1e9:7.0f} ns/point"
+                f" decode {decode / (number * lines) * 1e9:7.0f} ns/point"
+            )
+
+
+if __name__ == "__main__":
+    main()
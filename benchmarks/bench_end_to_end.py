@@ -0,0 +1,124 @@
+"""Drive Client -> stand-in broker -> Subscriber end to end and report
+throughput and publish to callback latency for every QoS, batch size and payload shape.
+
+Every point carries its send time as timestamp, the subscriber compares it
+with the time it is handed to the callback. Run from the repository root:
+
+    python -m benchmarks.bench_end_to_end
+    python -m benchmarks.bench_end_to_end --points 2000 --qos 1 --json results.json
+"""
+import argparse
+import json
+import threading
+import time
+from typing import Any, Dict, List
+
+from influx_line_mqtt import Client, Subscriber
+
+from .broker import StandInBroker
+
+SHAPES = {
+    "small": ({"room": "bed"}, {"temp": 21.5}),
+    "wide": (
+        {"room": "bed", "floor": "1", "building": "north", "sensor": "s12", "vendor": "acme"},
+        {f"f{i}": i * 1.5 for i in range(20)},
+    ),
+}
+
+
+def percentile(values: List[int], q: float) -> float:
+    """Exact percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(port: int, qos: int, batch: int, shape: str, points: int, timeout: float) -> Dict[str, Any]:
+    """Send points through the broker and wait until the subscriber has them all or timeout passes"""
+    tags, values = SHAPES[shape]
+    latencies: List[int] = []
+    done = threading.Event()
+
+    def on_points(client, userdata, data):
+        now = time.time_ns()
+        latencies.extend(now - point.timestamp for point in data)
+        if len(latencies) >= points:
+            done.set()
+
+    subscriber = Subscriber("127.0.0.1", port=port, client_id=f"bench-sub-{qos}-{batch}-{shape}", batch_callback=True)
+    subscriber.route("bench/#", on_points, qos=qos)
+    thread = threading.Thread(target=subscriber.start, daemon=True)
+    thread.start()
+    while not subscriber.client.is_connected():
+        time.sleep(0.01)
+    time.sleep(0.1)
+
+    client = Client(
+        "127.0.0.1", port, client_id=f"bench-pub-{qos}-{batch}-{shape}", qos=qos,
+        batch=batch > 1, max_lines=batch,
+    )
+    started = time.perf_counter()
+    for _ in range(points):
+        client.make_send("bench/e2e", tags, values, time.time_ns(), "bench")
+    client.flush()
+    done.wait(timeout)
+    elapsed = time.perf_counter() - started
+    client_stats = client.stats()
+    client.close()
+    # paho acknowledges a message after its callback returned, let that finish before disconnecting
+    time.sleep(0.1)
+    subscriber.stop()
+    thread.join(timeout)
+    subscriber_stats = subscriber.stats()
+
+    latencies.sort()
+    return {
+        "qos": qos,
+        "batch": batch,
+        "shape": shape,
+        "points": points,
+        "received": len(latencies),
+        "points_per_second": len(latencies) / elapsed,
+        "latency_p50_ms": percentile(latencies, 0.5) / 1e6,
+        "latency_p99_ms": percentile(latencies, 0.99) / 1e6,
+        "encode_p50_us": client_stats.get("encode_seconds_p50", 0.0) * 1e6,
+        "publish_ack_p99_ms": client_stats.get("publish_ack_seconds_p99", 0.0) * 1e3,
+        "decode_p50_us": subscriber_stats.get("decode_seconds_p50", 0.0) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--points", type=int, default=10000, help="points sent per case")
+    parser.add_argument("--qos", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("--batch", type=int, nargs="+", default=[1, 100, 1000], help="lines per payload")
+    parser.add_argument("--shape", nargs="+", default=list(SHAPES), choices=list(SHAPES))
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for one case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    broker = StandInBroker()
+    port = broker.start()
+    results = []
+    try:
+        for qos in args.qos:
+            for batch in args.batch:
+                for shape in args.shape:
+                    result = run(port, qos, batch, shape, args.points, args.timeout)
+                    results.append(result)
+                    lost = result["points"] - result["received"]
+                    print(
+                        f"qos={qos} batch={batch:5} shape={shape:5} {result['points_per_second']:9.0f} points/s"
+                        f" p50 {result['latency_p50_ms']:8.2f} ms p99 {result['latency_p99_ms']:8.2f} ms"
+                        f" encode p50 {result['encode_p50_us']:6.1f} us decode p50 {result['decode_p50_us']:8.1f} us"
+                        + (f" lost {lost}" if lost else "")
+                    )
+    finally:
+        broker.stop()
+    if args.json:
+        with open(args.json, "w") as out:
+            json.dump(results, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare publish throughput of one Client against PooledClient sessions,
+counting a point once the broker has acknowledged it.
+
+The stand-in broker runs in this interpreter without network delay, so against
+it this mostly shows the overhead of the pool. The in-flight window only limits
+a single session when acknowledgements take a round trip, point --broker at a
+remote broker to see that. Run from the repository root:
+
+    python -m benchmarks.bench_pool
+    python -m benchmarks.bench_pool --broker mqtt.example.net --port 1883
+"""
+import argparse
+import time
+
+from influx_line_mqtt import Client, PooledClient
+
+from .broker import StandInBroker
+
+POINTS = 5000
+
+
+def wait_acked(clients, timeout: float = 60.0):
+    """Wait until no session has messages in flight"""
+    deadline = time.perf_counter() + timeout
+    while any(client._inflight() for client in clients) and time.perf_counter() < deadline:
+        time.sleep(0.001)
+
+
+def points(count: int):
+    for i in range(count):
+        yield f"bench/{i % 8}", {"sensor": f"s{i % 64}"}, {"temp": 21.5, "n": i}, None, "temp"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--broker", help="use this broker instead of the stand-in one")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    broker = None
+    host, port = args.broker, args.port
+    if host is None:
+        broker = StandInBroker()
+        host, port = "127.0.0.1", broker.start()
+    try:
+        for qos in (1, 2):
+            client = Client(host, port, client_id=f"bench-single-{qos}", qos=qos)
+            started = time.perf_counter()
+            for topic, tags, values, timestamp, dest_table in points(POINTS):
+                client.make_send(topic, tags, values, timestamp, dest_table)
+            wait_acked([client])
+            print(f"qos={qos} Client              {POINTS / (time.perf_counter() - started):9.0f} points/s")
+            client.close()
+            for sessions in (2, 4, 8):
+                for many in (False, True):
+                    pool = PooledClient(host, port, client_id=f"bench-pool-{qos}", qos=qos, sessions=sessions)
+                    started = time.perf_counter()
+                    if many:
+                        pool.make_send_many(points(POINTS))
+                    else:
+                        for topic, tags, values, timestamp, dest_table in points(POINTS):
+                            pool.make_send(topic, tags, values, timestamp, dest_table)
+                    wait_acked(pool.clients)
+                    name = f"PooledClient x{sessions}" + (" many" if many else "")
+                    print(f"qos={qos} {name:19} {POINTS / (time.perf_counter() - started):9.0f} points/s")
+                    pool.close()
+    finally:
+        if broker is not None:
+            broker.stop()
+
+
+if __name__ == "__main__":
+    main()
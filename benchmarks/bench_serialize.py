@@ -0,0 +1,50 @@
+"""Compare the per point cost of Client.series against the Metric based make_send path.
+
+Nothing is published, the paho client is replaced by a stub that drops payloads.
+Run from the repository root:
+
+    python -m benchmarks.bench_serialize
+"""
+import timeit
+
+from influx_line_mqtt.client import Client
+
+
+class _NullInfo:
+    rc = 0
+    mid = 0
+
+
+class _NullMqtt:
+    def publish(self, topic, payload, qos, properties=None):
+        return _NullInfo
+
+
+class _OfflineClient(Client):
+    def _connect(self, broker="localhost", port=1883):
+        self.client = _NullMqtt()
+
+
+def make_client() -> Client:
+    return _OfflineClient("localhost", 1883, qos=0)
+
+
+def main():
+    client = make_client()
+    tags = {"measurement_type": "temp", "room": "bed", "sensor": "s12"}
+    values = {"temp": 21.375, "humidity": 48.5, "battery": 87}
+    timestamp = 1656086785.126144
+    series = client.series("temp", tags, topic="home")
+    number = 50000
+    cases = (
+        ("Metric", lambda: client.make_send("home", tags, values, timestamp, "temp")),
+        ("series.encode", lambda: series.encode(values, timestamp)),
+        ("series.send", lambda: series.send(values, timestamp)),
+    )
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        print(f"{name:14} {seconds / number * 1e9:8.0f} ns/point")
+
+
+if __name__ == "__main__":
+    main()
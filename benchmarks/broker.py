@@ -0,0 +1,227 @@
+"""A minimal in-process MQTT 3.1.1 and 5 broker standing in for a real one in benchmarks and tests.
+
+It supports what the benchmarks need: CONNECT, SUBSCRIBE with + and #
+wildcards, PUBLISH at QoS 0, 1 and 2 in both directions, PINGREQ and
+DISCONNECT. PUBLISH properties, like the content type, are passed on to
+MQTT 5 subscribers, other properties are ignored. There is no persistence,
+no retained messages and no will.
+"""
+import asyncio
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """Check an MQTT topic against a subscription filter"""
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[i]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        out.append(byte)
+        if not length:
+            return bytes(out)
+
+
+def _decode_length(data: bytes, offset: int) -> Tuple[int, int]:
+    """Read a variable byte integer, returning it and the offset after it"""
+    value, multiplier = 0, 1
+    while True:
+        byte = data[offset]
+        offset += 1
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value, offset
+
+
+def _packet(kind: int, flags: int, body: bytes) -> bytes:
+    return bytes([(kind << 4) | flags]) + _encode_length(len(body)) + body
+
+
+class _Session:
+    def __init__(self, broker: "StandInBroker", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.subscriptions: List[Tuple[str, int]] = []
+        self.next_id = 0
+        self.version = 4
+        self.incoming_qos2: Dict[int, Tuple[str, bytes, int, bytes]] = {}
+
+    def send(self, data: bytes):
+        self.writer.write(data)
+
+    def deliver(self, topic: str, payload: bytes, qos: int, properties: bytes = b""):
+        body = struct.pack("!H", len(topic)) + topic.encode("utf-8")
+        if qos:
+            self.next_id = self.next_id % 65535 + 1
+            body += struct.pack("!H", self.next_id)
+        if self.version == 5:
+            body += _encode_length(len(properties)) + properties
+        self.send(_packet(PUBLISH, qos << 1, body + payload))
+
+    async def read_packet(self) -> Tuple[int, int, bytes]:
+        header = await self.reader.readexactly(1)
+        length, multiplier = 0, 1
+        while True:
+            byte = (await self.reader.readexactly(1))[0]
+            length += (byte & 0x7F) * multiplier
+            multiplier *= 128
+            if not byte & 0x80:
+                break
+        body = await self.reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    async def run(self):
+        try:
+            while True:
+                kind, flags, body = await self.read_packet()
+                if kind == CONNECT:
+                    (name_length,) = struct.unpack("!H", body[:2])
+                    self.version = body[2 + name_length]
+                    self.send(_packet(CONNACK, 0, b"\x00\x00\x00" if self.version == 5 else b"\x00\x00"))
+                elif kind == PUBLISH:
+                    self.on_publish(flags, body)
+                elif kind == PUBREL:
+                    (packet_id,) = struct.unpack("!H", body[:2])
+                    message = self.incoming_qos2.pop(packet_id, None)
+                    if message is not None:
+                        self.broker.route(*message)
+                    self.send(_packet(PUBCOMP, 0, body[:2]))
+                elif kind == PUBREC:
+                    self.send(_packet(PUBREL, 2, body[:2]))
+                elif kind in (PUBACK, PUBCOMP):
+                    pass
+                elif kind == SUBSCRIBE:
+                    self.on_subscribe(body)
+                elif kind == UNSUBSCRIBE:
+                    self.on_unsubscribe(body)
+                elif kind == PINGREQ:
+                    self.send(_packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    break
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.sessions.discard(self)
+            self.writer.close()
+
+    def on_publish(self, flags: int, body: bytes):
+        qos = (flags >> 1) & 0x03
+        (topic_length,) = struct.unpack("!H", body[:2])
+        topic = body[2:2 + topic_length].decode("utf-8")
+        offset = 2 + topic_length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+        properties = b""
+        if self.version == 5:
+            length, offset = _decode_length(body, offset)
+            properties = body[offset:offset + length]
+            offset += length
+        payload = body[offset:]
+        if qos == 2:
+            self.incoming_qos2[struct.unpack("!H", packet_id)[0]] = (topic, payload, qos, properties)
+            self.send(_packet(PUBREC, 0, packet_id))
+            return
+        if qos == 1:
+            self.send(_packet(PUBACK, 0, packet_id))
+        self.broker.route(topic, payload, qos, properties)
+
+    def on_subscribe(self, body: bytes):
+        packet_id, offset, granted = body[:2], 2, bytearray()
+        if self.version == 5:
+            length, offset = _decode_length(body, offset)
+            offset += length
+            granted.append(0)
+        while offset < len(body):
+            (length,) = struct.unpack("!H", body[offset:offset + 2])
+            topic_filter = body[offset + 2:offset + 2 + length].decode("utf-8")
+            qos = body[offset + 2 + length] & 0x03
+            offset += 3 + length
+            self.subscriptions.append((topic_filter, qos))
+            granted.append(qos)
+        self.send(_packet(SUBACK, 0, packet_id + bytes(granted)))
+
+    def on_unsubscribe(self, body: bytes):
+        packet_id, offset, reasons = body[:2], 2, b""
+        if self.version == 5:
+            length, offset = _decode_length(body, offset)
+            offset += length
+            reasons = b"\x00"
+        while offset < len(body):
+            (length,) = struct.unpack("!H", body[offset:offset + 2])
+            topic_filter = body[offset + 2:offset + 2 + length].decode("utf-8")
+            offset += 2 + length
+            self.subscriptions = [s for s in self.subscriptions if s[0] != topic_filter]
+            if self.version == 5:
+                reasons += b"\x00"
+        self.send(_packet(UNSUBACK, 0, packet_id + reasons))
+
+
+class StandInBroker:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        """An MQTT broker running on its own thread and event loop.
+
+        Args:
+            host (str, optional): address to listen on. Defaults to "127.0.0.1".
+            port (int, optional): port to listen on, 0 picks a free one. Defaults to 0.
+        """
+        self.host = host
+        self.port = port
+        self.sessions = set()
+        self.loop = asyncio.new_event_loop()
+        self._server = None
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def start(self) -> int:
+        """Start listening and return the port"""
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._serve(), self.loop).result()
+        return self.port
+
+    def stop(self):
+        """Close every session and stop the loop"""
+        async def shutdown():
+            self._server.close()
+            for session in list(self.sessions):
+                session.writer.close()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    async def _serve(self):
+        self._server = await asyncio.start_server(self._accept, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _accept(self, reader, writer):
+        session = _Session(self, reader, writer)
+        self.sessions.add(session)
+        await session.run()
+
+    def route(self, topic: str, payload: bytes, qos: int, properties: bytes = b""):
+        for session in list(self.sessions):
+            for topic_filter, granted in session.subscriptions:
+                if topic_matches(topic_filter, topic):
+                    session.deliver(topic, payload, min(qos, granted), properties)
+                    break
@@ -1,2 +1,6 @@
 from .client import Client
-from .subscriber import Subscriber
\ No newline at end of file
+from .columnar import InfluxBatch
+from .data import Influx_Data
+from .pool import PooledClient
+from .subscriber import Subscriber
+from .timestamps import InvalidTimestamp
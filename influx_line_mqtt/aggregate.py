@@ -0,0 +1,421 @@
+import math
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from .columnar import NO_TIMESTAMP, InfluxBatch
+from .data import Influx_Data
+from .metrics import Metrics
+from .timestamps import PRECISIONS
+
+FUNCS = ("mean", "min", "max", "sum", "count", "first", "last")
+
+_UNITS = {"ns": 1, "us": 10**3, "ms": 10**6, "s": 10**9, "m": 60 * 10**9, "h": 3600 * 10**9, "d": 86400 * 10**9}
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d*)?)\s*(ns|us|ms|s|m|h|d)\s*$")
+
+# slots of an incremental accumulator
+_COUNT, _SUM, _MIN, _MAX, _FIRST, _LAST = range(6)
+_SLOTS = {"count": _COUNT, "sum": _SUM, "min": _MIN, "max": _MAX, "first": _FIRST, "last": _LAST}
+
+_NUMERIC = (int, float)
+"""Field types that are aggregated, booleans and strings are skipped"""
+
+SeriesKey = Tuple[str, Tuple]
+
+
+def parse_duration(value: Union[str, int, float]) -> int:
+    """Convert a duration like "10s", "500ms" or "1m" to nanoseconds
+
+    Args:
+        value (str | int | float): duration with a unit of ns, us, ms, s, m, h or d,
+            or a number of seconds
+
+    Raises:
+        ValueError: when the duration can not be read
+
+    Returns:
+        int: the duration in nanoseconds
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(value * 10**9)
+    match = _DURATION.match(value) if isinstance(value, str) else None
+    if match is None:
+        raise ValueError(f"{value!r} is not a valid duration, use a number and one of {list(_UNITS)}")
+    return round(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+class Aggregator:
+    def __init__(
+        self,
+        emit: Callable[[Any, Any, List[Influx_Data]], None],
+        window: Union[str, int, float] = "10s",
+        fields: Optional[Iterable[str]] = None,
+        funcs: Sequence[str] = ("mean", "max", "count"),
+        group_by: Optional[Iterable[str]] = None,
+        watermark: Union[str, int, float] = 0,
+        precision: str = "ns",
+        vectorized: bool = False,
+        metrics: Metrics = None,
+    ):
+        """Downsamples records into fixed windows per series, see Subscriber.aggregate.
+
+        A series is a measurement and the values of the group_by tags, it gets a
+        small integer id the first time it is seen. Windows follow the record
+        timestamps: a window is emitted once a record more than watermark past
+        its end arrived, records for a window that was already emitted are
+        counted as points_late and dropped. Records without timestamp use the
+        arrival time. flush emits every open window.
+
+        Args:
+            emit (Callable[[Any, Any, List[Influx_Data]], None]): called with the client,
+                the userdata and the aggregated records of one window, one record per series
+            window (str | int | float, optional): window length like "10s". Defaults to "10s".
+            fields (Iterable[str], optional): fields to aggregate. Defaults to None, every numeric field.
+            funcs (Sequence[str], optional): any of mean, min, max, sum, count, first and last.
+                Defaults to ("mean", "max", "count").
+            group_by (Iterable[str], optional): tags that identify a series and are kept.
+                Defaults to None, all tags.
+            watermark (str | int | float, optional): how long to wait for late records. Defaults to 0.
+            precision (str, optional): precision of the received timestamps. Defaults to "ns".
+            vectorized (bool, optional): keep the values of a window as columns and reduce them
+                with NumPy when it is emitted, instead of updating accumulators per record.
+                An InfluxBatch is then added column by column. Defaults to False.
+            metrics (Metrics, optional): counts points_aggregated, points_late and aggregates_emitted.
+                Defaults to None.
+        """
+        unknown = [func for func in funcs if func not in FUNCS]
+        if unknown or not funcs:
+            raise ValueError(f"{unknown} are not valid aggregate functions, use some of {FUNCS}")
+        if precision not in PRECISIONS:
+            raise ValueError(f"{precision!r} is not a valid precision, use one of {list(PRECISIONS)}")
+        if vectorized:
+            try:
+                import numpy
+            except ImportError as error:
+                raise ImportError(
+                    "vectorized aggregation requires numpy, install it with pip install numpy"
+                ) from error
+            self._np = numpy
+        self.emit = emit
+        self.unit = PRECISIONS[precision]
+        self.window = max(1, parse_duration(window) // self.unit)
+        self.watermark = parse_duration(watermark) // self.unit
+        self.fields = frozenset(fields) if fields is not None else None
+        self.funcs = tuple(funcs)
+        self.group_by = tuple(group_by) if group_by is not None else None
+        self.vectorized = vectorized
+        self.metrics = metrics if metrics is not None else Metrics()
+        self._lock = threading.Lock()
+        self._series_ids: Dict[SeriesKey, int] = {}
+        # series keys are sorted by tag name, the ids also hold the unsorted keys as received
+        self._series: List[SeriesKey] = []
+        # window start -> series id -> field -> accumulator, or with vectorized
+        # window start -> (series ids, field -> values with nan for gaps)
+        self._windows: Dict[int, Any] = {}
+        self._max_timestamp: Optional[int] = None
+        self._emitted_until: Optional[int] = None
+        self._client = None
+        self._userdata = None
+        # closed windows with the client and userdata they are emitted with, oldest first,
+        # drained under _emit_lock so concurrent handlers emit them in order
+        self._pending: Deque[Tuple[Any, Any, List[Tuple[int, Any]]]] = deque()
+        self._emit_lock = threading.Lock()
+
+    def __call__(self, client, userdata, data: Union[Influx_Data, List[Influx_Data], InfluxBatch]):
+        """Route handler taking one record, a list of records or an InfluxBatch"""
+        points = (data,) if isinstance(data, Influx_Data) else data
+        with self._lock:
+            self._client, self._userdata = client, userdata
+            if self.vectorized and isinstance(data, InfluxBatch):
+                added, late = self._add_batch(data)
+            else:
+                added, late = self._add_points(points)
+            ready = self._take_closed()
+            if ready:
+                self._pending.append((client, userdata, ready))
+        self.metrics.add(points_aggregated=added, points_late=late)
+        if ready:
+            self._emit()
+
+    def _intern_series(self, key: SeriesKey) -> int:
+        """Private method returning the id of a series key, creating it when new"""
+        series_id = self._series_ids.get(key)
+        if series_id is None:
+            series_id = self._series_ids[key] = len(self._series)
+            self._series.append(key)
+        return series_id
+
+    def _add_points(self, points: Iterable[Influx_Data]) -> Tuple[int, int]:
+        """Private method adding records to their windows, must be called with the lock held.
+        Attributes are read into locals once, this loop runs for every record.
+
+        Returns:
+            Tuple[int, int]: records added and records dropped as late
+        """
+        window, unit, group_by, fields = self.window, self.unit, self.group_by, self.fields
+        emitted_until, newest = self._emitted_until, self._max_timestamp
+        series_ids, windows, vectorized = self._series_ids, self._windows, self.vectorized
+        current_start = current = None
+        added = late = 0
+        for point in points:
+            timestamp = point.timestamp
+            if timestamp is None:
+                timestamp = time.time_ns() // unit
+            start = timestamp - timestamp % window
+            if emitted_until is not None and start < emitted_until:
+                late += 1
+                continue
+            if newest is None or timestamp > newest:
+                newest = timestamp
+            tag_set = point.tag_set
+            if group_by is None:
+                # tags as sent, mapped to the sorted series key once per distinct order
+                key = (point.measurement, tuple(tag_set.items()))
+                series_id = series_ids.get(key)
+                if series_id is None:
+                    series_id = series_ids[key] = self._intern_series((key[0], tuple(sorted(key[1]))))
+            else:
+                key = (point.measurement, tuple(map(tag_set.get, group_by)))
+                series_id = series_ids.get(key)
+                if series_id is None:
+                    series_id = self._intern_series(key)
+            added += 1
+            if vectorized:
+                self._add_columns(start, series_id, point.field_set)
+                continue
+            if start != current_start:
+                current_start = start
+                current = windows.get(start)
+                if current is None:
+                    current = windows[start] = {}
+            series = current.get(series_id)
+            if series is None:
+                series = current[series_id] = {}
+            for name, value in point.field_set.items():
+                if type(value) not in _NUMERIC or (fields is not None and name not in fields):
+                    continue
+                accumulator = series.get(name)
+                if accumulator is None:
+                    series[name] = [1, value, value, value, value, value]
+                    continue
+                accumulator[_COUNT] += 1
+                accumulator[_SUM] += value
+                if value < accumulator[_MIN]:
+                    accumulator[_MIN] = value
+                elif value > accumulator[_MAX]:
+                    accumulator[_MAX] = value
+                accumulator[_LAST] = value
+        self._max_timestamp = newest
+        return added, late
+
+    def _add_columns(self, start: int, series_id: int, field_set: Dict[str, Any]):
+        """Private method appending a record to the columns of its window"""
+        columns = self._windows.get(start)
+        if columns is None:
+            columns = self._windows[start] = (array("q"), {})
+        series_ids, values = columns
+        row = len(series_ids)
+        series_ids.append(series_id)
+        for key, value in field_set.items():
+            if (self.fields is not None and key not in self.fields) or type(value) not in _NUMERIC:
+                continue
+            column = values.get(key)
+            if column is None:
+                column = values[key] = array("d", [math.nan]) * row
+            column.append(value)
+        for column in values.values():
+            if len(column) == row:
+                column.append(math.nan)
+
+    def _add_batch(self, batch: InfluxBatch) -> Tuple[int, int]:
+        """Private method adding the columns of an InfluxBatch to their windows with NumPy,
+        only the distinct series of the batch are looked at in Python.
+        Must be called with the lock held.
+
+        Returns:
+            Tuple[int, int]: records added and records dropped as late
+        """
+        np = self._np
+        columns = batch.to_numpy()
+        timestamps = columns["timestamp"]
+        missing = timestamps == NO_TIMESTAMP
+        if missing.any():
+            timestamps = timestamps.copy()
+            timestamps[missing] = time.time_ns() // self.unit
+        starts = timestamps - timestamps % self.window
+        keep = np.ones(len(starts), dtype=bool)
+        if self._emitted_until is not None:
+            keep = starts >= self._emitted_until
+        late = len(starts) - int(keep.sum())
+        if not keep.any():
+            return 0, late
+        starts = starts[keep]
+        newest = int(timestamps[keep].max())
+        if self._max_timestamp is None or newest > self._max_timestamp:
+            self._max_timestamp = newest
+
+        tag_names = self.group_by if self.group_by is not None else sorted(columns["tags"])
+        missing_tag = np.full(len(batch), -1, dtype=np.intc)
+        tag_codes = [columns["tags"].get(name, missing_tag) for name in tag_names]
+        # pack measurement and tag ids into one integer per row, with tag ids shifted
+        # by one for missing tags, so the distinct series are found with a 1-d unique
+        radix = len(batch.tag_values) + 1
+        if len(batch.measurements) * radix ** len(tag_names) < 2**62:
+            combined = columns["measurement"].astype(np.int64)
+            for codes in tag_codes:
+                combined = combined * radix + codes + 1
+            keys, inverse = np.unique(combined[keep], return_inverse=True)
+            distinct = []
+            for key in keys.tolist():
+                row = []
+                for _ in tag_names:
+                    key, code = divmod(key, radix)
+                    row.append(code - 1)
+                distinct.append([key] + row[::-1])
+        else:
+            stacked = np.column_stack([columns["measurement"]] + tag_codes)[keep]
+            distinct, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            distinct = distinct.tolist()
+        lookup = np.empty(len(distinct), dtype=np.int64)
+        for i, row in enumerate(distinct):
+            values = [batch.tag_values[code] if code >= 0 else None for code in row[1:]]
+            if self.group_by is None:
+                tags = tuple((name, value) for name, value in zip(tag_names, values) if value is not None)
+            else:
+                tags = tuple(values)
+            lookup[i] = self._intern_series((batch.measurements[row[0]], tags))
+        series_ids = lookup[inverse.reshape(-1)]
+
+        fields = {}
+        for key, column in columns["fields"].items():
+            if self.fields is not None and key not in self.fields:
+                continue
+            if column.dtype.kind == "O":
+                # a field sent with mixed types, only its numbers are aggregated
+                column = np.array([value if type(value) in _NUMERIC else math.nan for value in column])
+            elif column.dtype.kind not in "iuf":
+                continue
+            fields[key] = np.ma.filled(column[keep].astype(np.float64), math.nan)
+        for start in np.unique(starts).tolist():
+            rows = starts == start
+            window = self._windows.get(start)
+            if window is None:
+                window = self._windows[start] = (array("q"), {})
+            window_ids, window_values = window
+            before = len(window_ids)
+            window_ids.frombytes(series_ids[rows].tobytes())
+            added = len(window_ids) - before
+            for key, values in fields.items():
+                column = window_values.get(key)
+                if column is None:
+                    column = window_values[key] = array("d", [math.nan]) * before
+                column.frombytes(values[rows].tobytes())
+            for column in window_values.values():
+                if len(column) < len(window_ids):
+                    column.extend(array("d", [math.nan]) * added)
+        return len(starts), late
+
+    def _take_closed(self, everything: bool = False) -> List[Tuple[int, Any]]:
+        """Private method removing the windows the watermark has passed, oldest first.
+        Must be called with the lock held."""
+        if not self._windows:
+            return []
+        if everything:
+            closed = sorted(self._windows)
+        else:
+            horizon = self._max_timestamp - self.watermark
+            closed = sorted(start for start in self._windows if start + self.window <= horizon)
+        if not closed:
+            return []
+        end = closed[-1] + self.window
+        if self._emitted_until is None or end > self._emitted_until:
+            self._emitted_until = end
+        return [(start, self._windows.pop(start)) for start in closed]
+
+    def _emit(self):
+        """Private method turning the pending windows into records and handing them to emit,
+        in the order they were closed whichever thread closed them"""
+        with self._emit_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return
+                    client, userdata, windows = self._pending.popleft()
+                for start, window in windows:
+                    if self.vectorized:
+                        records = self._reduce_columns(start, *window)
+                    else:
+                        records = [self._record(start, series_id, fields) for series_id, fields in window.items()]
+                    self.metrics.add(aggregates_emitted=len(records))
+                    self.emit(client, userdata, records)
+
+    def _record(self, start: int, series_id: int, fields: Dict[str, List[float]]) -> Influx_Data:
+        """Private method building the aggregated record of one series from its accumulators"""
+        measurement, tags = self._series[series_id]
+        field_set = {}
+        for key, accumulator in fields.items():
+            for func in self.funcs:
+                if func == "mean":
+                    field_set[f"{key}_mean"] = accumulator[_SUM] / accumulator[_COUNT]
+                else:
+                    field_set[f"{key}_{func}"] = accumulator[_SLOTS[func]]
+        return Influx_Data(measurement, self._tag_set(tags), field_set, start)
+
+    def _tag_set(self, tags: Tuple) -> Dict[str, str]:
+        """Private method turning the tags of a series key back into a tag set"""
+        if self.group_by is None:
+            return dict(tags)
+        return {key: value for key, value in zip(self.group_by, tags) if value is not None}
+
+    def _reduce_columns(self, start: int, series_ids: array, values: Dict[str, array]) -> List[Influx_Data]:
+        """Private method reducing the columns of one window with NumPy, grouped by series id"""
+        np = self._np
+        ids = np.frombuffer(series_ids, dtype=np.int64)
+        present, ids = np.unique(ids, return_inverse=True)
+        size = len(present)
+        results: Dict[str, Dict[str, Any]] = {}
+        for key, column in values.items():
+            column = np.frombuffer(column, dtype=np.float64)
+            mask = ~np.isnan(column)
+            group, column = ids[mask], column[mask]
+            count = np.bincount(group, minlength=size)
+            reduced = {"count": count}
+            if "sum" in self.funcs or "mean" in self.funcs:
+                reduced["sum"] = np.bincount(group, weights=column, minlength=size)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    reduced["mean"] = reduced["sum"] / count
+            if "min" in self.funcs:
+                reduced["min"] = np.full(size, np.inf)
+                np.minimum.at(reduced["min"], group, column)
+            if "max" in self.funcs:
+                reduced["max"] = np.full(size, -np.inf)
+                np.maximum.at(reduced["max"], group, column)
+            if "last" in self.funcs:
+                # with repeated indices the last assignment wins
+                reduced["last"] = np.full(size, np.nan)
+                reduced["last"][group] = column
+            if "first" in self.funcs:
+                reduced["first"] = np.full(size, np.nan)
+                reduced["first"][group[::-1]] = column[::-1]
+            results[key] = {func: reduced[func].tolist() for func in self.funcs}
+            results[key]["count"] = count.tolist()
+        records = []
+        for index, series_id in enumerate(present.tolist()):
+            measurement, tags = self._series[series_id]
+            field_set = {}
+            for key, reduced in results.items():
+                if reduced["count"][index]:
+                    for func in self.funcs:
+                        field_set[f"{key}_{func}"] = reduced[func][index]
+            records.append(Influx_Data(measurement, self._tag_set(tags), field_set, start))
+        return records
+
+    def flush(self):
+        """Emit every open window, for example before shutting down"""
+        with self._lock:
+            ready = self._take_closed(everything=True)
+            if ready:
+                self._pending.append((self._client, self._userdata, ready))
+        self._emit()
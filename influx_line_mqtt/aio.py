@@ -0,0 +1,373 @@
+import asyncio
+import socket
+from typing import Any, Dict, Optional
+import paho.mqtt.client as mqtt
+from .client import Client
+from .data import Influx_Data
+from .encoding import decode_payload, message_content_type
+from .parser import parse
+
+# queued by AsyncSubscriber once no more records will come
+_END = object()
+
+
+class _AsyncioHelper:
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        """Drives a paho client from an asyncio event loop instead of a network thread.
+        The socket is watched with add_reader/add_writer and keepalives run in a task,
+        so one event loop can serve many connections. The name lookup and TCP
+        connect are awaited on the loop and the connected socket is handed to paho,
+        a slow or unreachable broker does not block the other connections.
+
+        Args:
+            loop (asyncio.AbstractEventLoop): loop the client runs on
+            client (mqtt.Client): paho client to drive
+        """
+        self.loop = loop
+        self.client = client
+        self.closing = False
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self._sock = None
+        self._connected_sock: Optional[socket.socket] = None
+        self._paused = False
+        self._misc: Optional[asyncio.Task] = None
+        self._reconnect: Optional[asyncio.Task] = None
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        # paho calls this from reconnect, it gets the socket opened by connect
+        client._create_socket_connection = self._take_socket
+
+    async def connect(self, host: str, port: int):
+        """Open a TCP connection without blocking the loop and let paho send CONNECT on it
+
+        Args:
+            host (str): address of the broker
+            port (int): port number
+
+        Raises:
+            OSError: when the broker can not be reached
+        """
+        self.host, self.port = host, port
+        self.client.connect_async(host, port)
+        self._connected_sock = await self._open_socket()
+        try:
+            self.client.reconnect()
+        finally:
+            if self._connected_sock is not None:
+                self._connected_sock.close()
+                self._connected_sock = None
+
+    async def _open_socket(self) -> socket.socket:
+        """Private method resolving the broker and connecting to the first address that accepts,
+        within paho's connect timeout"""
+        infos = await self.loop.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        error: OSError = OSError(f"could not resolve {self.host}")
+        for family, kind, proto, _, address in infos:
+            sock = socket.socket(family, kind, proto)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(self.loop.sock_connect(sock, address), self.client._connect_timeout)
+                return sock
+            except (OSError, asyncio.TimeoutError) as exc:
+                sock.close()
+                error = exc if isinstance(exc, OSError) else TimeoutError(f"connecting to {address} timed out")
+        raise error
+
+    def _take_socket(self) -> socket.socket:
+        """Private method handing the socket opened by connect to paho's reconnect"""
+        sock, self._connected_sock = self._connected_sock, None
+        if sock is None:
+            raise OSError("paho may only connect through _AsyncioHelper.connect")
+        return sock
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._sock = sock
+        if not self._paused:
+            self.loop.add_reader(sock, client.loop_read)
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        self._sock = None
+        if self._misc is not None:
+            self._misc.cancel()
+            self._misc = None
+        if not self.closing and self._reconnect is None:
+            self._reconnect = self.loop.create_task(self._reconnect_loop())
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """Private task handling keepalives, the job loop_forever does in threaded mode"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    async def _reconnect_loop(self):
+        """Private task reconnecting with backoff after the connection is lost"""
+        delay = 1
+        try:
+            while not self.closing:
+                await asyncio.sleep(delay)
+                try:
+                    await self.connect(self.host, self.port)
+                    return
+                except OSError:
+                    delay = min(delay * 2, 120)
+        finally:
+            self._reconnect = None
+
+    def pause_reading(self):
+        """Stop reading from the socket, used for backpressure"""
+        if not self._paused:
+            self._paused = True
+            if self._sock is not None:
+                self.loop.remove_reader(self._sock)
+
+    def resume_reading(self):
+        """Start reading from the socket again after pause_reading"""
+        if self._paused:
+            self._paused = False
+            if self._sock is not None:
+                self.loop.add_reader(self._sock, self.client.loop_read)
+
+    def close(self):
+        """Stop reconnecting and disconnect"""
+        self.closing = True
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+        self.client.disconnect()
+
+
+class AsyncClient(Client):
+    def __init__(self, broker: str, port: int, client_id: str = "Random", qos=2, **kwargs):
+        """Create an instance of AsyncClient, a Client driven by the running asyncio loop.
+        Call await connect() before sending, all methods must be used from the loop.
+
+        Args:
+            broker (str):Address of the broker you are using
+            port (int): port number you want to connect on
+            client_id (str): Client id
+            qos (int, optional): QoS used for every publish. Defaults to 2.
+            **kwargs: batching and precision options, see Client.
+        """
+        if kwargs.get("spool_dir") is not None:
+            raise ValueError("AsyncClient does not support spool_dir, use Client")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._helper: Optional[_AsyncioHelper] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._connected: Optional[asyncio.Future] = None
+        self._linger_timers: Dict[str, asyncio.TimerHandle] = {}
+        super().__init__(broker, port, client_id, qos, **kwargs)
+
+    def _connect(self, broker="localhost", port=1883):
+        """Private method storing the broker, the connection is made by connect"""
+        self.broker = broker
+        self.port = port
+
+    async def connect(self):
+        """Connect to the broker and wait for its CONNACK
+
+        Raises:
+            ConnectionError: when the broker refuses the connection
+            OSError: when the broker can not be reached
+        """
+        self._loop = asyncio.get_running_loop()
+        self._helper = _AsyncioHelper(self._loop, self.client)
+        self._connected = self._loop.create_future()
+        self.client.on_connect = self._on_connect
+        self.client.on_publish = self._on_publish
+        await self._helper.connect(self.broker, self.port)
+        await self._connected
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if self._connected is not None and not self._connected.done():
+            if rc == mqtt.CONNACK_ACCEPTED:
+                self._connected.set_result(None)
+            else:
+                self._connected.set_exception(ConnectionError(mqtt.connack_string(rc)))
+
+    def _on_publish(self, client, userdata, mid):
+        super()._on_publish(client, userdata, mid)
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _schedule_linger(self, topic: str):
+        """Private method to flush a topic once linger_ms has passed, using the event loop"""
+        self._linger_timers[topic] = self._loop.call_later(self.linger_ms / 1000, self._flush_topic, topic)
+
+    def _cancel_linger(self, topic: str):
+        """Private method to cancel the linger timer of a topic"""
+        timer = self._linger_timers.pop(topic, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _wait_published(self, info: Optional[mqtt.MQTTMessageInfo]):
+        """Private method waiting until paho reports the message as published,
+        which is the broker's acknowledgement for QoS 1 and 2"""
+        if info is None or info.is_published():
+            return
+        future = self._pending[info.mid] = self._loop.create_future()
+        await future
+
+    async def make_send(self,
+                        topic: str,
+                        tags: Dict[str, Any],
+                        values: Dict[str, Any],
+                        epoch_timestamp,
+                        dest_table: str,
+                        batch: bool = None,
+                        ):
+        """
+        Use this method to make data, encode it in influx_line_protocol and send it.
+        Returns once the broker has acknowledged the message, or right away when batching.
+
+        Args:
+            topic (str): Add the topic of the message
+            tags (Dict[str, Any]): Tags you would like to send.
+            values (Dict[str, Any]): values you would like to add
+            epoch_timestamp (int|float|str|Datetime|None): Timestamp you would like to define, None for now.
+            dest_table (str | None, optional): Dest_table you would like to add. Defaults to None.
+            batch (bool | None, optional): Override the batching mode of the client for this call.
+        """
+        self._make_data(
+            topic=topic,
+            tags=tags,
+            values=values,
+            epoch_timestamp=epoch_timestamp,
+            dest_table=dest_table,
+        )
+        await self._wait_published(self._send_data(batch=self.batch if batch is None else batch))
+
+    async def close(self):
+        """
+        Method to flush pending batches and disconnect from the broker
+        """
+        self.flush()
+        if self._helper is not None:
+            self._helper.close()
+
+
+class AsyncSubscriber:
+    def __init__(
+        self,
+        broker: str,
+        topic: str,
+        port: int = 1883,
+        client_id: str = "Smartphone",
+        qos: int = 0,
+        maxsize: int = 10000,
+        protocol: int = mqtt.MQTTv311,
+    ):
+        """Creates an instance of AsyncSubscriber, iterate it with async for
+        to receive Influx_Data records.
+
+        When maxsize records are waiting the socket is no longer read until the
+        consumer has taken half of them, so a slow consumer slows the broker down
+        instead of growing memory. Pausing longer than the keepalive drops the
+        connection, it is reestablished once reading resumes. Iteration ends after
+        close, or when the broker refuses a reconnect, once the records that were
+        already received have been taken.
+
+        Args:
+            broker (str): Address of the broker you are using.
+            topic (str): Give the topic you want to subscribe to.
+            port (int, optional): Port number. Defaults to 1883.
+            client_id (str, optional): Client ID. Defaults to "Smartphone".
+            qos (int, optional): QoS of the subscription. Defaults to 0.
+            maxsize (int, optional): Records buffered before reading pauses. Defaults to 10000.
+            protocol (int, optional): MQTT protocol version, with mqtt.MQTTv5 the content type
+                property of a message names its encoding. Defaults to mqtt.MQTTv311.
+        """
+        self.broker = broker
+        self.topic = topic
+        self.port = port
+        self.qos = qos
+        self.maxsize = maxsize
+        self.client = mqtt.Client(client_id, protocol=protocol)
+        self._queue: Optional[asyncio.Queue] = None
+        self._helper: Optional[_AsyncioHelper] = None
+        self._connected: Optional[asyncio.Future] = None
+        self._ended = False
+
+    async def start(self):
+        """Connect, subscribe and wait for the CONNACK
+
+        Raises:
+            ConnectionError: when the broker refuses the connection
+            OSError: when the broker can not be reached
+        """
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._helper = _AsyncioHelper(loop, self.client)
+        self._connected = loop.create_future()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message_inner
+        await self._helper.connect(self.broker, self.port)
+        await self._connected
+
+    async def close(self):
+        """Disconnect from the broker and end async for loops"""
+        if self._helper is not None:
+            self._helper.close()
+        self._end()
+
+    def _end(self):
+        """Private method queueing the end of iteration, once"""
+        if self._queue is not None and not self._ended:
+            self._ended = True
+            self._queue.put_nowait(_END)
+
+    async def __aenter__(self) -> "AsyncSubscriber":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self) -> "AsyncSubscriber":
+        return self
+
+    async def __anext__(self) -> Influx_Data:
+        point = await self._queue.get()
+        if point is _END:
+            # left in place so every waiting and later consumer stops too
+            self._queue.put_nowait(_END)
+            raise StopAsyncIteration
+        if self._queue.qsize() <= self.maxsize // 2:
+            self._helper.resume_reading()
+        return point
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == mqtt.CONNACK_ACCEPTED:
+            client.subscribe(self.topic, qos=self.qos)
+        if not self._connected.done():
+            if rc == mqtt.CONNACK_ACCEPTED:
+                self._connected.set_result(None)
+            else:
+                self._connected.set_exception(ConnectionError(mqtt.connack_string(rc)))
+        elif rc != mqtt.CONNACK_ACCEPTED:
+            # refused on reconnect, retrying would not help
+            self._helper.close()
+            self._end()
+
+    def _on_message_inner(self, client, userdata, message):
+        """Inner module that decodes the received message and queues its records.
+
+        Args:
+            client (Any):   MQTT client
+            userdata (Any): Userdata
+            message (Any): Received message
+        """
+        for point in parse(decode_payload(message.payload, message_content_type(message))):
+            self._queue.put_nowait(point)
+        if self._queue.qsize() >= self.maxsize:
+            self._helper.pause_reading()
@@ -1,22 +1,94 @@
-import contextlib
-from typing import Any, Dict
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from influx_line_protocol import Metric
-import datetime
+from .encoding import check_encoding, content_type, encode_payload
+from .metrics import Metrics
+from .serializer import Series
+from .spool import Spool
+from .timestamps import PRECISIONS, InvalidTimestamp, to_precision
 
 
 class Client:
-    def __init__(self, broker: str, port: int, client_id: str = "Random",qos=2):
+    def __init__(self, broker: str, port: int, client_id: str = "Random",qos=2,
+                 batch: bool = False,
+                 max_lines: int = 1000,
+                 max_bytes: int = 256 * 1024,
+                 linger_ms: int = 100,
+                 precision: str = "ns",
+                 spool_dir: str = None,
+                 spool_max_bytes: int = 256 * 1024 * 1024,
+                 spool_max_age: float = None,
+                 encoding: str = "identity",
+                 protocol: int = mqtt.MQTTv311,
+                 ):
         """Create an instance of Client
 
         Args:
             broker (str):Address of the broker you are using
             port (int): port number you want to connect on
             client_id (str): Client id 
+            qos (int, optional): QoS used for every publish. Defaults to 2.
+            batch (bool, optional): Buffer lines per topic and publish them
+                as one newline-joined payload. Defaults to False.
+            max_lines (int, optional): Flush a topic once it holds this many lines. Defaults to 1000.
+            max_bytes (int, optional): Flush a topic once its payload reaches this size, a payload only
+                exceeds it when a single line is larger. Defaults to 256 KiB.
+            linger_ms (int, optional): Flush a topic this long after its first buffered line. Defaults to 100.
+            precision (str, optional): Timestamp precision of the lines, one of "s", "ms", "us", "ns".
+                Must match the precision the consumer writes with. Defaults to "ns".
+            spool_dir (str, optional): Keep payloads in a disk spool in this directory while the broker
+                is unreachable or the in-flight window is full, and send them once it can take them again.
+                The client then also starts without waiting for the broker. Defaults to None.
+            spool_max_bytes (int, optional): Size cap of the spool, the oldest data is dropped first. Defaults to 256 MiB.
+            spool_max_age (float, optional): Seconds after which spooled data is no longer sent. Defaults to None.
+            encoding (str, optional): Wire encoding of every payload, one of "identity", "zlib", "gzip",
+                "zstd" or "binary". Subscriber detects it on its own. Defaults to "identity".
+            protocol (int, optional): MQTT protocol version, with mqtt.MQTTv5 the encoding is also
+                announced in the content type property. Defaults to mqtt.MQTTv311.
         """
-        self.client = mqtt.Client(client_id)
-        self._connect(broker=broker, port=port)
+        check_encoding(encoding)
+        if precision not in PRECISIONS:
+            raise InvalidTimestamp(f"{precision!r} is not a valid precision, use one of {list(PRECISIONS)}")
         self.qos=qos
+        self.precision = precision
+        self.batch = batch
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.linger_ms = linger_ms
+        self.encoding = encoding
+        self._properties: Properties = None
+        if protocol == mqtt.MQTTv5:
+            self._properties = Properties(PacketTypes.PUBLISH)
+            self._properties.ContentType = content_type(encoding)
+        self._batch_lock = threading.Lock()
+        self._batches: Dict[str, List[bytes]] = {}
+        self._batch_sizes: Dict[str, int] = {}
+        self._topic_locks: Dict[str, threading.Lock] = {}
+        # topic -> flush deadline, and the same in the order they were set, which is
+        # deadline order as every batch lingers equally long
+        self._linger_deadlines: Dict[str, float] = {}
+        self._linger_order: Deque[Tuple[float, str]] = deque()
+        self._linger_wakeup = threading.Condition(self._batch_lock)
+        self._linger_thread: Optional[threading.Thread] = None
+        self._linger_stopped = False
+        self._spool: Spool = None
+        if spool_dir is not None:
+            self._spool = Spool(spool_dir, max_bytes=spool_max_bytes, max_age=spool_max_age)
+        self._drain_wanted = threading.Event()
+        self._drain_thread: threading.Thread = None
+        self._closing = False
+        self.metrics = Metrics()
+        self._ack_lock = threading.Lock()
+        self._publish_times: Dict[int, float] = {}
+        self._early_acks: Dict[int, float] = {}
+        self.client = mqtt.Client(client_id, protocol=protocol)
+        self.client.on_publish = self._on_publish
+        self._connect(broker=broker, port=port)
 
     def _connect(self, broker="localhost", port=1883):
         """Private method to connect to the broker and start loop for sending data
@@ -25,8 +97,15 @@ class Client:
             broker (str, optional): the broker id. Defaults to "localhost".
             port (int, optional): port number. Defaults to 1883.
         """
-        self.client.connect(host=broker, port=port)
+        if self._spool is None:
+            self.client.connect(host=broker, port=port)
+            self.client.loop_start()
+            return
+        self.client.on_connect = self._on_spool_connect
+        self.client.connect_async(host=broker, port=port)
         self.client.loop_start()
+        self._drain_thread = threading.Thread(target=self._drain_loop, name="influx-spool-drain", daemon=True)
+        self._drain_thread.start()
 
     def _fix_dest_table(self, dest_table: str, tags) -> str:
         """Private method to extract the dest_table from the tags if it is not defined
@@ -54,48 +133,23 @@ class Client:
         """
         return topic
 
-    def _fix_timestamp(self, epoch_timestamp) -> float:
+    def _fix_timestamp(self, epoch_timestamp) -> int:
         """
         Private method to fix the timestamp
         and standardize it to the format of influx_line_protocol.
 
 
         Args:
-            epoch_timestamp (float|str|Datetime): Timestamp you would like to define defaults to now.
+            epoch_timestamp (int|float|str|Datetime|None): int nanoseconds, float seconds,
+                a datetime or a "YYYY-MM-DD HH:MM:SS[.ffffff]" string, None for now.
+
+        Raises:
+            InvalidTimestamp: when the timestamp can not be read
 
         Returns:
-            (float): Timestamp in the format of influx_line_protocol.
-        """
-
-        if isinstance(epoch_timestamp, datetime.datetime):
-            epoch_timestamp = epoch_timestamp.timestamp()
-
-        if type(epoch_timestamp) is float:
-            epoch_timestamp = epoch_timestamp * 10**9
-
-        else:
-            with contextlib.suppress(Exception):
-                epoch_timestamp = (
-                    datetime.datetime.strptime(
-                        epoch_timestamp, "%Y-%m-%d %H:%M:%S.%f"
-                    ).timestamp()
-                    * 10**9
-                )
-                return epoch_timestamp
-            try:
-                epoch_timestamp = (
-                    datetime.datetime.strptime(
-                        epoch_timestamp, "%Y-%m-%d %H:%M:%S"
-                    ).timestamp()
-                    * 10**9
-                )
-                return epoch_timestamp
-            except Exception:
-                print(
-                    f"{epoch_timestamp} is not a valid timestamp \nThe correct format is YYYY-MM-DD HH:MM:SS.SSS\nPlease try this or use a datetime object"
-                )
-                exit()
-        return epoch_timestamp
+            (int): Timestamp in the precision of the client.
+        """
+        return to_precision(epoch_timestamp, self.precision)
 
     def make_send(self,
                   topic: str,
@@ -103,17 +157,20 @@ class Client:
                   values: Dict[str, Any],
                   epoch_timestamp: float,
                   dest_table: str,
+                  batch: bool = None,
                   ):
         """
         Use this method to make data and encode it in influx_line_protocol
         data is stored in metric and send it to the broker.
+        When batching, the line is buffered and sent on the next flush.
 
         Args:
             topic (str): Add the topic of the message
             tags (Dict[str, Any]): Tags you would like to send. 
             values (Dict[str, Any]): values you would like to add
-            epoch_timestamp (float): Timestamp you would like to define defaults to now.
+            epoch_timestamp (int|float|str|Datetime|None): Timestamp you would like to define, None for now.
             dest_table (str | None, optional): Dest_table you would like to add. Defaults to None.
+            batch (bool | None, optional): Override the batching mode of the client for this call.
         """
         self._make_data(
             topic=topic,
@@ -122,7 +179,23 @@ class Client:
             epoch_timestamp=epoch_timestamp,
             dest_table=dest_table,
         )
-        self._send_data()
+        self._send_data(batch=self.batch if batch is None else batch)
+
+    def series(self, dest_table: str, tags: Dict[str, Any], topic: str = None) -> Series:
+        """
+        Use this method to get a handle for sending many points with the
+        same measurement and tags. The measurement and tags are rendered once
+        instead of building an influx_line_protocol Metric for every point.
+
+        Args:
+            dest_table (str | None): Dest_table of the series, taken from the tags when None.
+            tags (Dict[str, Any]): Tags of the series.
+            topic (str, optional): Topic Series.send publishes on when it is not given one.
+
+        Returns:
+            (Series): handle with encode and send methods
+        """
+        return Series(self, self._fix_dest_table(dest_table, tags), tags, topic)
 
     def _make_data(
         self,
@@ -140,9 +213,10 @@ class Client:
             topic (str): Add the topic of the message
             tags (Dict[str, Any]): Tags you would like to send. 
             values (Dict[str, Any]): values you would like to add
-            epoch_timestamp (float): Timestamp you would like to define defaults to now.
+            epoch_timestamp (int|float|str|Datetime|None): Timestamp you would like to define, None for now.
             dest_table (str | None, optional): Dest_table you would like to add. Defaults to None.
         """
+        self._encode_started = time.perf_counter()
         dest_table = self._fix_dest_table(dest_table, tags)
         self.topic = self._fix_topic(topic, tags)
         self.metric = Metric(dest_table)
@@ -152,15 +226,330 @@ class Client:
         for (k, v) in tags.items():
             self.metric.add_tag(k, v)
 
-    def _send_data(self):
+    def _send_data(self, batch: bool = False):
         """Method to sent the made data made after using_make_data 
+
+        Args:
+            batch (bool, optional): Buffer the line instead of publishing it right away.
+
+        Returns:
+            (mqtt.MQTTMessageInfo | None): paho's message info, None when the line was buffered
+        """
+        line = f"{self.metric}".encode("utf-8")
+        self.metrics.observe("encode_seconds", time.perf_counter() - self._encode_started)
+        return self._send_line(self.topic, line, batch)
+
+    def _send_line(self, topic: str, line: bytes, batch: bool = False):
+        """Private method to publish an encoded line or add it to the batch of its topic
+
+        Args:
+            topic (str): topic to publish on
+            line (bytes): encoded line
+            batch (bool, optional): Buffer the line instead of publishing it right away.
+
+        Returns:
+            (mqtt.MQTTMessageInfo | None): paho's message info, None when the line was buffered
+        """
+        if batch:
+            self._buffer_line(topic, line)
+            return None
+        return self._publish(topic, line)
+
+    def _publish(self, topic: str, payload: bytes):
+        """Private method that hands a ready payload to paho
+
+        Args:
+            topic (str): topic to publish on
+            payload (bytes): one or more newline separated lines
+
+        Returns:
+            (mqtt.MQTTMessageInfo): paho's message info
+        """
+        if self._spool is not None and (
+            self._spool.pending or not self.client.is_connected() or self._window_full()
+        ):
+            self._spool.append(topic, payload)
+            self.metrics.add(messages_spooled=1, points_spooled=payload.count(b"\n") + 1)
+            self._drain_wanted.set()
+            return None
+        return self._publish_now(topic, payload)
+
+    def _publish_now(self, topic: str, payload: bytes):
+        """Private method encoding a payload with the wire encoding and publishing it
+
+        Args:
+            topic (str): topic to publish on
+            payload (bytes): one or more newline separated lines
+
+        Returns:
+            (mqtt.MQTTMessageInfo): paho's message info
+        """
+        lines = payload
+        if self.encoding != "identity":
+            payload = encode_payload(payload, self.encoding)
+        started = time.perf_counter()
+        info = self.client.publish(topic=topic, payload=payload, qos=self.qos, properties=self._properties)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (self.qos and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            with self._ack_lock:
+                acked = self._early_acks.pop(info.mid, None)
+                if acked is None:
+                    self._publish_times[info.mid] = started
+            if acked is not None:
+                self.metrics.observe("publish_ack_seconds", acked - started)
+            self.metrics.add(
+                messages_published=1, points_published=lines.count(b"\n") + 1, bytes_published=len(payload)
+            )
+        return info
+
+    def _window_full(self) -> bool:
+        """Private method checking if paho holds as many unacknowledged messages as it may have in flight"""
+        max_inflight = self.client._max_inflight_messages
+        return max_inflight > 0 and self._inflight() >= max_inflight
+
+    def _inflight(self) -> int:
+        """Private method counting the messages paho has not finished sending"""
+        return len(self.client._out_messages)
+
+    def _on_spool_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == mqtt.CONNACK_ACCEPTED:
+            self._drain_wanted.set()
+
+    def _on_publish(self, client, userdata, mid):
+        """Records the publish to acknowledgement latency, paho calls this once the
+        broker acknowledged a QoS 1 or 2 message or a QoS 0 message was written"""
+        acked = time.perf_counter()
+        with self._ack_lock:
+            started = self._publish_times.pop(mid, None)
+            if started is None:
+                # paho can report the message before publish has returned its mid
+                self._early_acks[mid] = acked
+        if started is not None:
+            self.metrics.observe("publish_ack_seconds", acked - started)
+        if self._spool is not None and self._spool.pending:
+            self._drain_wanted.set()
+
+    def _drain_loop(self):
+        """Private thread sending spooled payloads whenever the broker can take them"""
+        while not self._closing:
+            self._drain_wanted.wait()
+            self._drain_wanted.clear()
+            if not self._closing:
+                self._drain()
+
+    def _drain(self):
+        """Private method publishing spooled payloads as batches until the spool is empty,
+        the connection drops or the in-flight window is full"""
+        while self._spool.pending and self.client.is_connected() and not self._window_full():
+            records, position = self._spool.read(self.max_lines, self.max_bytes)
+            for topic, payload in self._join_records(records):
+                info = self._publish_now(topic, payload)
+                if self.qos == 0 and info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    return
+            self._spool.consume(position)
+
+    def _join_records(self, records):
+        """Private generator joining consecutive spooled payloads of a topic up to max_bytes
+
+        Args:
+            records (List[Tuple[str, bytes]]): spooled topic and payload pairs
+
+        Yields:
+            Tuple[str, bytes]: topic and newline joined payload
+        """
+        topic, parts, size = None, [], 0
+        for record_topic, payload in records:
+            if parts and (record_topic != topic or size + len(payload) > self.max_bytes):
+                yield topic, b"\n".join(parts)
+                parts, size = [], 0
+            topic = record_topic
+            parts.append(payload)
+            size += len(payload) + 1
+        if parts:
+            yield topic, b"\n".join(parts)
+
+    def _buffer_line(self, topic: str, line: bytes):
+        """Private method to add a line to the batch of a topic,
+        publishing the batch when max_lines or max_bytes is reached.
+        A batch the line would push past max_bytes is published first.
+
+        Args:
+            topic (str): topic the line belongs to
+            line (bytes): encoded line
+        """
+        with self._topic_lock(topic):
+            full = payload = None
+            with self._batch_lock:
+                size = self._batch_sizes.get(topic, 0)
+                if size and size + len(line) > self.max_bytes:
+                    full = self._take_batch(topic)
+                    size = 0
+                lines = self._batches.setdefault(topic, [])
+                lines.append(line)
+                size += len(line) + 1
+                self._batch_sizes[topic] = size
+                if len(lines) >= self.max_lines or size > self.max_bytes:
+                    payload = self._take_batch(topic)
+                elif len(lines) == 1:
+                    self._schedule_linger(topic)
+            if full is not None:
+                self._publish(topic, full)
+            if payload is not None:
+                self._publish(topic, payload)
+
+    def _topic_lock(self, topic: str) -> threading.Lock:
+        """Private method returning the lock that orders the batches of a topic.
+        It is held from taking a batch until it is published, so a newer batch
+        of the topic can not overtake it. Take it before _batch_lock.
+        """
+        lock = self._topic_locks.get(topic)
+        if lock is None:
+            with self._batch_lock:
+                lock = self._topic_locks.setdefault(topic, threading.Lock())
+        return lock
+
+    def _take_batch(self, topic: str) -> bytes:
+        """Private method to remove the batch of a topic and join it.
+        Must be called with _batch_lock held.
+
+        Returns:
+            (bytes | None): newline joined payload, None if nothing is buffered
         """
-        self.client.publish(topic=self.topic, payload=f"{self.metric}",qos=self.qos)
+        self._cancel_linger(topic)
+        lines = self._batches.pop(topic, None)
+        self._batch_sizes.pop(topic, None)
+        if not lines:
+            return None
+        return b"\n".join(lines)
+
+    def _schedule_linger(self, topic: str):
+        """Private method to flush a topic once linger_ms has passed.
+        The deadline is handed to one flusher thread, started on first use.
+        Must be called with _batch_lock held."""
+        deadline = time.monotonic() + self.linger_ms / 1000
+        self._linger_deadlines[topic] = deadline
+        self._linger_order.append((deadline, topic))
+        if self._linger_thread is None:
+            self._linger_thread = threading.Thread(target=self._linger_loop, name="influx-linger", daemon=True)
+            self._linger_thread.start()
+        elif len(self._linger_order) == 1:
+            # the flusher only sleeps without a deadline when nothing was queued
+            self._linger_wakeup.notify()
+
+    def _cancel_linger(self, topic: str):
+        """Private method to drop the linger deadline of a topic, its entry
+        in the order is skipped by the flusher. Must be called with _batch_lock held."""
+        self._linger_deadlines.pop(topic, None)
+
+    def _linger_loop(self):
+        """Private thread flushing topics whose linger deadline has passed, earliest first"""
+        while True:
+            with self._batch_lock:
+                topic = self._next_lingered()
+            if topic is None:
+                return
+            self._flush_topic(topic)
+
+    def _next_lingered(self) -> Optional[str]:
+        """Private method waiting until the earliest linger deadline passed.
+        Must be called with _batch_lock held.
+
+        Returns:
+            (str | None): topic to flush, None once the client is closed
+        """
+        order = self._linger_order
+        while not self._linger_stopped:
+            if not order:
+                self._linger_wakeup.wait()
+                continue
+            deadline, topic = order[0]
+            if self._linger_deadlines.get(topic) != deadline:
+                # flushed or rescheduled since
+                order.popleft()
+                continue
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                self._linger_wakeup.wait(delay)
+                continue
+            order.popleft()
+            del self._linger_deadlines[topic]
+            return topic
+        return None
+
+    def _flush_topic(self, topic: str):
+        """Private method to publish whatever is buffered for a topic"""
+        with self._topic_lock(topic):
+            with self._batch_lock:
+                payload = self._take_batch(topic)
+            if payload is not None:
+                self._publish(topic, payload)
+
+    def flush(self):
+        """
+        Method to publish every buffered batch right away
+        """
+        with self._batch_lock:
+            topics = list(self._batches)
+        for topic in topics:
+            self._flush_topic(topic)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Method to read the instrumentation of the client: points_published,
+        messages_published, bytes_published (after encoding), points_spooled and messages_spooled counters,
+        encode_seconds and publish_ack_seconds histograms (_count, _sum, _mean,
+        _p50, _p99, _max) and the current inflight, buffered_lines and spool gauges.
+
+        Returns:
+            (Dict[str, Any]): flat dict of every metric
+        """
+        stats = self.metrics.snapshot()
+        stats.update(self._gauges())
+        return stats
+
+    def prometheus_text(self, prefix: str = "influx_line_mqtt_client") -> str:
+        """
+        Method to render stats in the Prometheus text format,
+        see metrics.start_prometheus_server to serve it
+
+        Args:
+            prefix (str, optional): prepended to every metric name. Defaults to "influx_line_mqtt_client".
+
+        Returns:
+            (str): exposition text
+        """
+        return self.metrics.prometheus(prefix, self._gauges())
+
+    def _gauges(self) -> Dict[str, float]:
+        """Private method reading the current in-flight window, batch and spool sizes"""
+        with self._batch_lock:
+            buffered = sum(len(lines) for lines in self._batches.values())
+        gauges = {
+            "inflight": self._inflight(),
+            "inflight_max": self.client._max_inflight_messages,
+            "buffered_lines": buffered,
+        }
+        if self._spool is not None:
+            gauges["spool_pending"] = int(self._spool.pending)
+            gauges["spool_dropped_bytes"] = self._spool.dropped_bytes
+            gauges["spool_expired"] = self._spool.expired
+        return gauges
 
     def close(self):
         """
         Method to close the connection to the broker
         and stop the loop
         """
+        self.flush()
+        with self._batch_lock:
+            self._linger_stopped = True
+            self._linger_wakeup.notify()
+        if self._linger_thread is not None:
+            self._linger_thread.join()
+        if self._drain_thread is not None:
+            self._closing = True
+            self._drain_wanted.set()
+            self._drain_thread.join()
         self.client.loop_stop()
         self.client.disconnect()
+        if self._spool is not None:
+            self._spool.close()
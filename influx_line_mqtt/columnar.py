@@ -0,0 +1,248 @@
+from array import array
+from sys import intern
+from typing import Any, Dict, Iterator, List, Union
+from .data import Influx_Data
+
+NO_TIMESTAMP = -(2**63)
+"""Value stored in the timestamp column for records sent without a timestamp"""
+
+_NO_ID = -1
+
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+_UINT64_MAX = 2**64 - 1
+
+
+class InfluxBatch:
+    __slots__ = (
+        "timestamps",
+        "measurement_ids",
+        "measurements",
+        "tag_columns",
+        "tag_values",
+        "fields",
+        "field_masks",
+        "_measurement_index",
+        "_tag_value_index",
+        "_length",
+    )
+
+    def __init__(self):
+        """A columnar container for many decoded records.
+
+        Timestamps are kept in an array('q'), measurements and tag values are
+        dictionary encoded: the columns hold ids into measurements and tag_values.
+        Field columns are array('d') for floats, array('q') for integers,
+        array('Q') once an unsigned value exceeds the signed range, array('b')
+        for booleans and a list for strings. A column that receives a value of
+        another type becomes a list, so every value keeps the type it was parsed
+        with. Once a field is missing from a record, field_masks holds a
+        bytearray for it with 1 for each row that has a value, the column holds
+        0 or None in the gaps.
+        """
+        self.timestamps = array("q")
+        self.measurement_ids = array("i")
+        self.measurements: List[str] = []
+        self.tag_columns: Dict[str, array] = {}
+        self.tag_values: List[str] = []
+        self.fields: Dict[str, Union[array, list]] = {}
+        self.field_masks: Dict[str, bytearray] = {}
+        self._measurement_index: Dict[str, int] = {}
+        self._tag_value_index: Dict[str, int] = {}
+        self._length = 0
+
+    @classmethod
+    def from_points(cls, points) -> "InfluxBatch":
+        """Create a batch from Influx_Data objects
+
+        Args:
+            points (Iterable[Influx_Data]): records to store
+
+        Returns:
+            InfluxBatch: the filled batch
+        """
+        batch = cls()
+        for point in points:
+            batch.append(point.measurement, point.tag_set, point.field_set, point.timestamp)
+        return batch
+
+    def __len__(self) -> int:
+        return self._length
+
+    def append(
+        self,
+        measurement: str,
+        tag_set: Dict[str, str],
+        field_set: Dict[str, Any],
+        timestamp: Union[int, None],
+    ):
+        """Add one record to the batch
+
+        Args:
+            measurement (str)
+            tag_set (Dict[str, str])
+            field_set (Dict[str, Any])
+            timestamp (int | None)
+        """
+        row = self._length
+        self.timestamps.append(NO_TIMESTAMP if timestamp is None else timestamp)
+        self.measurement_ids.append(self._encode(measurement, self._measurement_index, self.measurements))
+
+        for key, value in tag_set.items():
+            column = self.tag_columns.get(key)
+            if column is None:
+                column = self.tag_columns[intern(key)] = array("i", [_NO_ID]) * row
+            column.append(self._encode(value, self._tag_value_index, self.tag_values))
+        if len(tag_set) != len(self.tag_columns):
+            for key, column in self.tag_columns.items():
+                if len(column) == row:
+                    column.append(_NO_ID)
+
+        for key, value in field_set.items():
+            column = self.fields.get(key)
+            if column is None:
+                column = self.fields[intern(key)] = _new_column(value, row)
+                if row:
+                    self.field_masks[key] = bytearray(row)
+            elif not _fits(column, value):
+                column = self.fields[key] = _promote(column, value)
+            column.append(value)
+        if self.field_masks or len(field_set) != len(self.fields):
+            masks = self.field_masks
+            for key, column in self.fields.items():
+                mask = masks.get(key)
+                if len(column) == row:
+                    column.append(None if isinstance(column, list) else 0)
+                    if mask is None:
+                        mask = masks[key] = bytearray(b"\x01") * row
+                    mask.append(0)
+                elif mask is not None:
+                    mask.append(1)
+
+        self._length = row + 1
+
+    def __iter__(self) -> Iterator[Influx_Data]:
+        for row in range(self._length):
+            yield self[row]
+
+    def __getitem__(self, row: int) -> Influx_Data:
+        """Rebuild the record stored at row as an Influx_Data"""
+        if row < 0:
+            row += self._length
+        if not 0 <= row < self._length:
+            raise IndexError("InfluxBatch index out of range")
+        tag_set = {}
+        for key, column in self.tag_columns.items():
+            value_id = column[row]
+            if value_id != _NO_ID:
+                tag_set[key] = self.tag_values[value_id]
+        field_set = {}
+        masks = self.field_masks
+        for key, column in self.fields.items():
+            mask = masks.get(key)
+            if mask is not None and not mask[row]:
+                continue
+            value = column[row]
+            if isinstance(column, array) and column.typecode == "b":
+                value = bool(value)
+            field_set[key] = value
+        timestamp = self.timestamps[row]
+        return Influx_Data(
+            self.measurements[self.measurement_ids[row]],
+            tag_set,
+            field_set,
+            None if timestamp == NO_TIMESTAMP else timestamp,
+        )
+
+    def to_numpy(self) -> Dict[str, Any]:
+        """Convert the columns to numpy arrays without copying the array buffers.
+
+        Raises:
+            ImportError: when numpy is not installed
+
+        Returns:
+            Dict[str, Any]: "timestamp" and "measurement" arrays, plus "tags"
+                and "fields" dicts of arrays keyed by name. Measurement and tag
+                arrays hold ids into measurements and tag_values, tags missing
+                from a record have id -1. Fields with gaps are numpy masked arrays.
+        """
+        try:
+            import numpy as np
+        except ImportError as error:
+            raise ImportError(
+                "InfluxBatch.to_numpy requires numpy, install it with pip install numpy"
+            ) from error
+        fields = {}
+        for key, column in self.fields.items():
+            if isinstance(column, list):
+                fields[key] = np.array(column, dtype=object)
+            elif column.typecode == "b":
+                fields[key] = np.frombuffer(column, dtype=np.int8).astype(bool)
+            else:
+                fields[key] = np.frombuffer(column, dtype=column.typecode)
+            mask = self.field_masks.get(key)
+            if mask is not None:
+                fields[key] = np.ma.MaskedArray(fields[key], mask=np.frombuffer(mask, dtype=np.uint8) == 0)
+        return {
+            "timestamp": np.frombuffer(self.timestamps, dtype=np.int64),
+            "measurement": np.frombuffer(self.measurement_ids, dtype=np.intc),
+            "tags": {key: np.frombuffer(column, dtype=np.intc) for key, column in self.tag_columns.items()},
+            "fields": fields,
+        }
+
+    @staticmethod
+    def _encode(value: str, index: Dict[str, int], values: List[str]) -> int:
+        """Private method returning the dictionary id of value, adding it when new"""
+        value_id = index.get(value)
+        if value_id is None:
+            value_id = index[value] = len(values)
+            values.append(value)
+        return value_id
+
+
+def _new_column(value: Any, rows: int) -> Union[array, list]:
+    """Private function to create a column for the type of value, with rows empty slots"""
+    if isinstance(value, bool):
+        typecode = "b"
+    elif isinstance(value, int):
+        if _INT64_MIN <= value <= _INT64_MAX:
+            typecode = "q"
+        elif 0 <= value <= _UINT64_MAX:
+            typecode = "Q"
+        else:
+            return [None] * rows
+    elif isinstance(value, float):
+        typecode = "d"
+    else:
+        return [None] * rows
+    return array(typecode, [0]) * rows
+
+
+def _fits(column: Union[array, list], value: Any) -> bool:
+    """Private function to check if value can be stored in column as is"""
+    if isinstance(column, list):
+        return True
+    kind = type(value)
+    typecode = column.typecode
+    if typecode == "d":
+        return kind is float
+    if typecode == "b":
+        return kind is bool
+    if typecode == "q":
+        return kind is int and _INT64_MIN <= value <= _INT64_MAX
+    return kind is int and 0 <= value <= _UINT64_MAX
+
+
+def _promote(column: array, value: Any) -> Union[array, list]:
+    """Private function to widen a column so it can hold value, an int column
+    becomes unsigned for values past the signed range, any other mix becomes a list"""
+    if (
+        column.typecode == "q"
+        and type(value) is int
+        and _INT64_MAX < value <= _UINT64_MAX
+        and (not column or min(column) >= 0)
+    ):
+        return array("Q", column)
+    if column.typecode == "b":
+        return [bool(item) for item in column]
+    return column.tolist()
@@ -0,0 +1,23 @@
+class Influx_Data:
+    __slots__ = ("measurement", "tag_set", "field_set", "timestamp")
+
+    def __init__(
+        self, measurement: str, tag_set: dict, field_set: dict, timestamp: int
+    ):
+        """A custom object to store data received and decode it in Influx data format
+        The parser interns measurement, tag keys and field keys so repeated
+        records share the same string objects.
+
+        Args:
+            measurement (str)
+            tag_set (dict)
+            field_set (dict)
+            timestamp (int)
+        """
+        self.measurement = measurement
+        self.tag_set = tag_set
+        self.field_set = field_set
+        self.timestamp = timestamp
+
+    def __str__(self):
+        return f"measurement: {self.measurement}\ntag_set: {self.tag_set}\nfield_set: {self.field_set}\ntimestamp: {self.timestamp}"
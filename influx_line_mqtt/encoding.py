@@ -0,0 +1,253 @@
+import gzip
+import zlib
+from typing import Any, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ENCODINGS = ("identity", "zlib", "gzip", "zstd", "binary")
+
+CONTENT_TYPE = "text/x-influx-line-protocol"
+"""Content type of plain line protocol, encoded payloads add "; encoding=<name>" """
+
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+_BINARY_MAGIC = b"\x00ILB\x01"
+
+_HAS_TIMESTAMP = 1
+
+
+class EncodingError(ValueError):
+    """Raised when a payload can not be encoded or decoded"""
+
+
+def check_encoding(encoding: str):
+    """Make sure an encoding is known and usable here
+
+    Raises:
+        ValueError: when the encoding is unknown
+        ImportError: when zstd is asked for and zstandard is not installed
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"{encoding!r} is not a valid encoding, use one of {ENCODINGS}")
+    if encoding == "zstd" and zstandard is None:
+        raise ImportError("the zstd encoding requires zstandard, install it with pip install zstandard")
+
+
+def content_type(encoding: str) -> str:
+    """Content type announcing an encoding, sent as the MQTT v5 content type property"""
+    if encoding == "identity":
+        return CONTENT_TYPE
+    return f"{CONTENT_TYPE}; encoding={encoding}"
+
+
+def message_content_type(message: Any) -> Optional[str]:
+    """Content type property of a received MQTT message, None when it has none.
+    paho only sets properties on messages received over MQTT v5."""
+    return getattr(getattr(message, "properties", None), "ContentType", None)
+
+
+def encode_payload(payload: bytes, encoding: str) -> bytes:
+    """Encode newline separated lines for the wire
+
+    Args:
+        payload (bytes): one or more lines of line protocol
+        encoding (str): one of ENCODINGS
+
+    Returns:
+        bytes: the encoded payload
+    """
+    if encoding == "identity":
+        return payload
+    if encoding == "zlib":
+        return zlib.compress(payload)
+    if encoding == "gzip":
+        return gzip.compress(payload, mtime=0)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor().compress(payload)
+    if encoding == "binary":
+        return _encode_binary(payload)
+    check_encoding(encoding)
+
+
+def detect_encoding(payload: bytes, content_type: Optional[str] = None) -> str:
+    """Find the encoding of a received payload from its content type or its first bytes
+
+    Args:
+        payload (bytes): received payload
+        content_type (str | None, optional): MQTT v5 content type property. Defaults to None.
+
+    Returns:
+        str: one of ENCODINGS
+    """
+    if content_type and content_type.startswith(CONTENT_TYPE):
+        encoding = content_type.partition("encoding=")[2].strip()
+        return encoding if encoding in ENCODINGS else "identity"
+    head = bytes(payload[:5])
+    if head == _BINARY_MAGIC:
+        return "binary"
+    if head[:2] == _GZIP_MAGIC:
+        return "gzip"
+    if head[:4] == _ZSTD_MAGIC:
+        return "zstd"
+    if len(head) >= 2 and head[0] == 0x78 and (head[0] * 256 + head[1]) % 31 == 0:
+        return "zlib"
+    return "identity"
+
+
+def decode_payload(payload: bytes, content_type: Optional[str] = None) -> bytes:
+    """Turn a received payload back into newline separated lines.
+
+    Without a content type the encoding is detected from the first bytes.
+    A payload that only looks compressed, for example a line starting
+    with x^, is returned unchanged.
+
+    Args:
+        payload (bytes): received payload
+        content_type (str | None, optional): MQTT v5 content type property. Defaults to None.
+
+    Raises:
+        EncodingError: when the content type names an encoding the payload does not decode with
+
+    Returns:
+        bytes: line protocol text
+    """
+    encoding = detect_encoding(payload, content_type)
+    try:
+        if encoding == "identity":
+            return payload
+        if encoding == "zlib":
+            return zlib.decompress(payload)
+        if encoding == "gzip":
+            return gzip.decompress(payload)
+        if encoding == "zstd":
+            if zstandard is None:
+                raise EncodingError("received a zstd payload, install zstandard to read it")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+        return _decode_binary(payload)
+    except (zlib.error, OSError, EOFError, IndexError, UnicodeDecodeError) as error:
+        if content_type is None and encoding in ("zlib", "gzip"):
+            return payload
+        raise EncodingError(f"payload is not valid {encoding}: {error}") from None
+    except Exception as error:
+        if zstandard is not None and isinstance(error, zstandard.ZstdError):
+            raise EncodingError(f"payload is not valid zstd: {error}") from None
+        raise
+
+
+def _put_varint(out: bytearray, value: int):
+    """Private function appending an unsigned LEB128 varint"""
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    """Private function reading an unsigned LEB128 varint
+
+    Returns:
+        Tuple[int, int]: the value and the offset after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _split_prefix(line: bytes) -> Tuple[bytes, bytes, Optional[int]]:
+    """Private function splitting a line into "measurement,tags", field set and timestamp"""
+    space = line.find(b" ")
+    while space > 0 and line[space - 1] == 0x5C:
+        space = line.find(b" ", space + 1)
+    if space < 0:
+        raise EncodingError(f"line has no field set: {line[:60]!r}")
+    prefix, rest = line[:space], line[space + 1:]
+    last = rest.rfind(b" ")
+    if last > 0 and rest[last - 1] != 0x5C:
+        tail = rest[last + 1:]
+        if tail.lstrip(b"-").isdigit():
+            return prefix, rest[:last], int(tail)
+    return prefix, rest, None
+
+
+def _encode_binary(payload: bytes) -> bytes:
+    """Private function framing lines with a prefix dictionary and delta encoded timestamps.
+
+    Layout: magic, varint prefix count, the prefixes as varint length + bytes,
+    varint line count, then per line: varint prefix id, flags byte,
+    zigzag varint timestamp delta when flagged, varint length + field set.
+    """
+    prefixes: List[bytes] = []
+    index = {}
+    body = bytearray()
+    lines = 0
+    previous = 0
+    for line in payload.split(b"\n"):
+        line = line.strip()
+        if not line or line[0] == 0x23:
+            continue
+        prefix, fields, timestamp = _split_prefix(line)
+        prefix_id = index.get(prefix)
+        if prefix_id is None:
+            prefix_id = index[prefix] = len(prefixes)
+            prefixes.append(prefix)
+        _put_varint(body, prefix_id)
+        if timestamp is None:
+            body.append(0)
+        else:
+            body.append(_HAS_TIMESTAMP)
+            delta = timestamp - previous
+            _put_varint(body, _zigzag(delta))
+            previous = timestamp
+        _put_varint(body, len(fields))
+        body += fields
+        lines += 1
+    out = bytearray(_BINARY_MAGIC)
+    _put_varint(out, len(prefixes))
+    for prefix in prefixes:
+        _put_varint(out, len(prefix))
+        out += prefix
+    _put_varint(out, lines)
+    return bytes(out + body)
+
+
+def _zigzag(value: int) -> int:
+    """Private function mapping signed to unsigned so small negative deltas stay short"""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _decode_binary(data: bytes) -> bytes:
+    """Private function turning the binary framing back into line protocol text"""
+    offset = len(_BINARY_MAGIC)
+    count, offset = _get_varint(data, offset)
+    prefixes = []
+    for _ in range(count):
+        length, offset = _get_varint(data, offset)
+        prefixes.append(bytes(data[offset:offset + length]) + b" ")
+        offset += length
+    count, offset = _get_varint(data, offset)
+    lines = []
+    previous = 0
+    for _ in range(count):
+        prefix_id, offset = _get_varint(data, offset)
+        flags = data[offset]
+        offset += 1
+        line = prefixes[prefix_id]
+        if flags & _HAS_TIMESTAMP:
+            zigzag, offset = _get_varint(data, offset)
+            previous += (zigzag >> 1) if not zigzag & 1 else -((zigzag + 1) >> 1)
+        length, offset = _get_varint(data, offset)
+        line += data[offset:offset + length]
+        offset += length
+        if flags & _HAS_TIMESTAMP:
+            line += b" %d" % previous
+        lines.append(line)
+    return b"\n".join(lines)
@@ -0,0 +1,199 @@
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List
+
+BUCKETS = tuple(1e-6 * 2 ** i for i in range(25))
+"""Upper bounds in seconds of the histogram buckets, 1 µs to about 17 s"""
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        """Counts of observed durations in fixed exponential buckets.
+        Quantiles are interpolated inside a bucket, so they are accurate
+        to about a factor of two, which is enough to spot regressions.
+
+        Args:
+            buckets (Tuple[float], optional): sorted upper bounds. Defaults to BUCKETS.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float, count: int = 1):
+        """Add a value count times, must be called with the lock of the owning Metrics held"""
+        self.counts[bisect_left(self.buckets, value)] += count
+        self.count += count
+        self.sum += value * count
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile
+
+        Args:
+            q (float): between 0 and 1, 0.99 for p99
+
+        Returns:
+            float: the estimate, 0.0 when nothing was observed
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        """Thread safe counters and duration histograms of a Client or Subscriber"""
+        self._lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def inc(self, name: str, value: int = 1):
+        """Add value to a counter
+
+        Args:
+            name (str): counter name
+            value (int, optional): amount to add. Defaults to 1.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add(self, **values: int):
+        """Add to several counters under one lock, for the hot paths
+
+        Args:
+            **values (int): amount to add per counter name
+        """
+        counters = self.counters
+        with self._lock:
+            for name, value in values.items():
+                counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float, count: int = 1):
+        """Add a duration to a histogram
+
+        Args:
+            name (str): histogram name, ending in _seconds by convention
+            seconds (float): the duration
+            count (int, optional): number of times it is added, like once per point
+                with the mean duration of a batch. Defaults to 1.
+        """
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds, count)
+
+    @classmethod
+    def merged(cls, sources: Iterable["Metrics"]) -> "Metrics":
+        """Sum several Metrics into a new one, counters are added and histogram buckets combined
+
+        Args:
+            sources (Iterable[Metrics]): metrics to combine, like those of pooled clients
+
+        Returns:
+            Metrics: the combined copy
+        """
+        out = cls()
+        for source in sources:
+            with source._lock:
+                for name, value in source.counters.items():
+                    out.counters[name] = out.counters.get(name, 0) + value
+                for name, histogram in source.histograms.items():
+                    total = out.histograms.get(name)
+                    if total is None:
+                        total = out.histograms[name] = Histogram(histogram.buckets)
+                    total.counts = [a + b for a, b in zip(total.counts, histogram.counts)]
+                    total.count += histogram.count
+                    total.sum += histogram.sum
+                    total.max = max(total.max, histogram.max)
+        return out
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Copy the current values into a flat dict
+
+        Returns:
+            Dict[str, Any]: every counter, and for every histogram its
+                _count, _sum, _mean, _p50, _p99 and _max
+        """
+        with self._lock:
+            out: Dict[str, Any] = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                out[f"{name}_count"] = histogram.count
+                out[f"{name}_sum"] = histogram.sum
+                out[f"{name}_mean"] = histogram.sum / histogram.count if histogram.count else 0.0
+                out[f"{name}_p50"] = histogram.quantile(0.5)
+                out[f"{name}_p99"] = histogram.quantile(0.99)
+                out[f"{name}_max"] = histogram.max
+        return out
+
+    def prometheus(self, prefix: str, gauges: Dict[str, float] = None) -> str:
+        """Render the metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): prepended to every metric name, like influx_line_mqtt_client
+            gauges (Dict[str, float], optional): extra current values to export as gauges. Defaults to None.
+
+        Returns:
+            str: the exposition text
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{prefix}_{name}_bucket{{le="{bound:g}"}} {cumulative}')
+                lines.append(f'{prefix}_{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines.append(f"{prefix}_{name}_sum {histogram.sum!r}")
+                lines.append(f"{prefix}_{name}_count {histogram.count}")
+        for name, value in sorted((gauges or {}).items()):
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            lines.append(f"{prefix}_{name} {value!r}")
+        return "\n".join(lines) + "\n"
+
+
+def start_prometheus_server(port: int, *sources: Callable[[], str], address: str = "") -> ThreadingHTTPServer:
+    """Serve the metrics of clients and subscribers for Prometheus to scrape,
+    on a daemon thread
+
+    Args:
+        port (int): port to listen on, 0 picks a free one
+        *sources (Callable[[], str]): called per scrape for exposition text, like
+            client.prometheus_text. Give several clients different prefixes.
+        address (str, optional): address to bind. Defaults to all interfaces.
+
+    Returns:
+        ThreadingHTTPServer: the running server, call shutdown to stop it
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = "".join(source() for source in sources).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="influx-prometheus", daemon=True).start()
+    return server
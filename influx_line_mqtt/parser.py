@@ -0,0 +1,322 @@
+from sys import intern
+from typing import Any, Dict, Iterator, List, Tuple, Union
+from .columnar import InfluxBatch
+from .data import Influx_Data
+
+_SPACE = " "
+_COMMA = ","
+_EQUALS = "="
+_QUOTE = '"'
+_BACKSLASH = "\\"
+
+_MEASUREMENT_STOPS = frozenset((_COMMA, _SPACE))
+_KEY_STOPS = frozenset((_COMMA, _EQUALS, _SPACE))
+
+# characters a number may hold, float and int accept more, like nan, inf and 1_000
+_DIGITS = "0123456789"
+_INTEGER_CHARS = "-0123456789"
+_FLOAT_CHARS = "+-.eE0123456789"
+
+_HEADER_CACHE_SIZE = 4096
+
+_TRUE = frozenset(("t", "T", "true", "True", "TRUE"))
+_FALSE = frozenset(("f", "F", "false", "False", "FALSE"))
+_BOOLEAN_ENDINGS = frozenset("tTfFeE")
+_SKIP = frozenset(" \t\r#")
+
+
+class LineProtocolError(ValueError):
+    """Raised when a line does not follow the influx line protocol"""
+
+
+# unescaped "measurement,tags" -> measurement and tag set, shared by the lines of a series
+_headers: Dict[str, Tuple[str, Dict[str, str]]] = {}
+
+
+def parse(payload: Union[bytes, bytearray, memoryview, str]) -> List[Influx_Data]:
+    """Decode a payload holding one or more lines of influx line protocol.
+
+    The payload is decoded to text once and every line is scanned
+    without further copies of the payload. Blank lines and comments are skipped.
+
+    Args:
+        payload (bytes | bytearray | memoryview | str): payload as received by the subscriber
+
+    Raises:
+        LineProtocolError: when a line is malformed
+
+    Returns:
+        List[Influx_Data]: one record per line
+    """
+    points = []
+    append = points.append
+    for number, line in iter_lines(payload):
+        try:
+            append(Influx_Data(*_split_line(line)))
+        except ValueError as error:
+            raise LineProtocolError(f"line {number}: {error}") from None
+    return points
+
+
+def parse_columnar(payload: Union[bytes, bytearray, memoryview, str]) -> InfluxBatch:
+    """Decode a payload straight into an InfluxBatch without creating
+    an Influx_Data object per line.
+
+    Args:
+        payload (bytes | bytearray | memoryview | str): payload as received by the subscriber
+
+    Raises:
+        LineProtocolError: when a line is malformed
+
+    Returns:
+        InfluxBatch: the decoded records stored as columns
+    """
+    batch = InfluxBatch()
+    append = batch.append
+    for line in _lines(payload):
+        append(*line)
+    return batch
+
+
+def parse_line(line: str) -> Influx_Data:
+    """Decode a single line of influx line protocol.
+
+    Args:
+        line (str): one line without the trailing newline
+
+    Returns:
+        Influx_Data: the decoded record with typed field values
+    """
+    return Influx_Data(*_split_line(line))
+
+
+def iter_lines(payload: Union[bytes, bytearray, memoryview, str]) -> Iterator[Tuple[int, str]]:
+    """Split a payload into lines, skipping blank lines and comments
+
+    Args:
+        payload (bytes | bytearray | memoryview | str): payload as received by the subscriber
+
+    Raises:
+        LineProtocolError: when the payload is not utf-8
+
+    Yields:
+        Tuple[int, str]: line number and stripped line
+    """
+    if not isinstance(payload, str):
+        try:
+            payload = str(payload, "utf-8")
+        except UnicodeDecodeError as error:
+            raise LineProtocolError(f"payload is not utf-8: {error}") from None
+    for number, line in enumerate(payload.split("\n"), 1):
+        if not line or line[0] in _SKIP or line[-1] in _SKIP:
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+        yield number, line
+
+
+def parse_header(line: str) -> Tuple[str, Dict[str, str]]:
+    """Decode only the measurement and tags of a line, so records can be
+    filtered before their fields are decoded.
+
+    Args:
+        line (str): one line without the trailing newline
+
+    Raises:
+        LineProtocolError: when the measurement or a tag is malformed
+
+    Returns:
+        Tuple[str, Dict[str, str]]: measurement and tag set
+    """
+    if _BACKSLASH not in line:
+        measurement, tag_set = _header(line.split(" ", 1)[0])
+        return measurement, tag_set.copy()
+    n = len(line)
+    measurement, i = _scan_key(line, 0, _MEASUREMENT_STOPS)
+    tag_set = {}
+    while i < n and line[i] == _COMMA:
+        key, i = _scan_key(line, i + 1, _KEY_STOPS)
+        if i >= n or line[i] != _EQUALS or not key:
+            raise LineProtocolError(f"invalid tag {key!r}")
+        tag_set[key], i = _scan_key(line, i + 1, _KEY_STOPS)
+    return measurement, tag_set
+
+
+def _lines(payload: Union[bytes, bytearray, memoryview, str]):
+    """Private generator yielding the decoded parts of every line of a payload"""
+    for number, line in iter_lines(payload):
+        try:
+            yield _split_line(line)
+        except ValueError as error:
+            raise LineProtocolError(f"line {number}: {error}") from None
+
+
+def _split_line(line: str) -> Tuple[str, Dict[str, str], Dict[str, Any], Union[int, None]]:
+    """Private function to decode a line into measurement, tag set, field set and timestamp.
+
+    Lines without escapes or quoted strings take a split based fast path,
+    anything else goes through the escape aware scanner.
+    """
+    if _BACKSLASH in line or _QUOTE in line:
+        return _scan_line(line)
+    sections = line.split(" ", 2)
+    if len(sections) < 2 or not sections[1]:
+        raise LineProtocolError("missing field set")
+    measurement, tag_set = _header(sections[0])
+    tag_set = tag_set.copy()
+    field_set = {}
+    # _field_value inlined, this loop runs for every field
+    for field in sections[1].split(","):
+        key, sep, value = field.partition("=")
+        if not sep or not key or not value:
+            raise LineProtocolError(f"invalid field {field!r}")
+        key = intern(key)
+        last = value[-1]
+        if last == "i":
+            if value[:-1].strip(_INTEGER_CHARS):
+                raise LineProtocolError(f"invalid integer {value!r}")
+            field_set[key] = int(value[:-1])
+        elif last in _BOOLEAN_ENDINGS or last == "u":
+            field_set[key] = _field_value(value)
+        else:
+            if value.strip(_FLOAT_CHARS):
+                raise LineProtocolError(f"invalid float {value!r}")
+            field_set[key] = float(value)
+    timestamp = _timestamp(sections[2]) if len(sections) > 2 else None
+    return measurement, tag_set, field_set, timestamp
+
+
+def _header(header: str) -> Tuple[str, Dict[str, str]]:
+    """Private function decoding a "measurement,tags" section without escapes.
+    The result is cached, callers copy the tag set before handing it out."""
+    cached = _headers.get(header)
+    if cached is not None:
+        return cached
+    parts = header.split(",")
+    measurement = intern(parts[0])
+    if not measurement:
+        raise LineProtocolError("missing measurement")
+    tag_set = {}
+    for tag in parts[1:]:
+        key, sep, value = tag.partition("=")
+        if not sep or not key:
+            raise LineProtocolError(f"invalid tag {tag!r}")
+        tag_set[intern(key)] = value
+    if len(_headers) >= _HEADER_CACHE_SIZE:
+        _headers.clear()
+    cached = _headers[header] = (measurement, tag_set)
+    return cached
+
+
+def _field_value(value: str) -> Any:
+    """Private function to convert an unquoted field value to its type"""
+    last = value[-1]
+    if last == "i":
+        if value[:-1].strip(_INTEGER_CHARS):
+            raise LineProtocolError(f"invalid integer {value!r}")
+        return int(value[:-1])
+    if last == "u":
+        if value[:-1].strip(_DIGITS):
+            raise LineProtocolError(f"invalid unsigned integer {value!r}")
+        return int(value[:-1])
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    if value.strip(_FLOAT_CHARS):
+        raise LineProtocolError(f"invalid float {value!r}")
+    return float(value)
+
+
+def _timestamp(value: str) -> Union[int, None]:
+    """Private function to convert the optional timestamp"""
+    if not value:
+        return None
+    if value.strip(_INTEGER_CHARS):
+        raise LineProtocolError(f"invalid timestamp {value!r}")
+    return int(value)
+
+
+def _scan_key(line: str, i: int, stops: frozenset) -> Tuple[str, int]:
+    """Private function to read an escaped name up to one of stops.
+    A backslash escapes a stop character or another backslash, before
+    anything else it is kept as it is.
+
+    Returns:
+        Tuple[str, int]: the unescaped name and the index of the stop byte
+    """
+    n = len(line)
+    buf = []
+    while i < n:
+        c = line[i]
+        if c == _BACKSLASH and i + 1 < n and (line[i + 1] in stops or line[i + 1] == _BACKSLASH):
+            buf.append(line[i + 1])
+            i += 2
+            continue
+        if c in stops:
+            break
+        buf.append(c)
+        i += 1
+    return "".join(buf), i
+
+
+def _scan_string(line: str, i: int) -> Tuple[str, int]:
+    """Private function to read a quoted field value starting after the opening quote
+
+    Returns:
+        Tuple[str, int]: the unescaped string and the index after the closing quote
+    """
+    n = len(line)
+    buf = []
+    while i < n:
+        c = line[i]
+        if c == _BACKSLASH and i + 1 < n and line[i + 1] in (_QUOTE, _BACKSLASH):
+            buf.append(line[i + 1])
+            i += 2
+            continue
+        if c == _QUOTE:
+            return "".join(buf), i + 1
+        buf.append(c)
+        i += 1
+    raise LineProtocolError("unterminated string field")
+
+
+def _scan_line(line: str) -> Tuple[str, Dict[str, str], Dict[str, Any], Union[int, None]]:
+    """Private function that decodes a line in one pass honouring escapes and quotes"""
+    n = len(line)
+    measurement, i = _scan_key(line, 0, _MEASUREMENT_STOPS)
+    measurement = intern(measurement)
+    if not measurement:
+        raise LineProtocolError("missing measurement")
+    tag_set: Dict[str, str] = {}
+    while i < n and line[i] == _COMMA:
+        key, i = _scan_key(line, i + 1, _KEY_STOPS)
+        if i >= n or line[i] != _EQUALS or not key:
+            raise LineProtocolError(f"invalid tag {key!r}")
+        tag_set[intern(key)], i = _scan_key(line, i + 1, _KEY_STOPS)
+    if i >= n or line[i] != _SPACE:
+        raise LineProtocolError("missing field set")
+
+    field_set: Dict[str, Any] = {}
+    while True:
+        key, i = _scan_key(line, i + 1, _KEY_STOPS)
+        if i >= n or line[i] != _EQUALS or not key:
+            raise LineProtocolError(f"invalid field {key!r}")
+        key = intern(key)
+        i += 1
+        if i < n and line[i] == _QUOTE:
+            field_set[key], i = _scan_string(line, i + 1)
+        else:
+            end = i
+            while end < n and line[end] != _COMMA and line[end] != _SPACE:
+                end += 1
+            if end == i:
+                raise LineProtocolError(f"missing value for field {key!r}")
+            field_set[key] = _field_value(line[i:end])
+            i = end
+        if i >= n or line[i] != _COMMA:
+            break
+
+    if i < n and line[i] != _SPACE:
+        raise LineProtocolError("unexpected data after field set")
+    return measurement, tag_set, field_set, _timestamp(line[i + 1:].strip())
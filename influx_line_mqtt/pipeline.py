@@ -0,0 +1,282 @@
+import logging
+import multiprocessing
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .metrics import Metrics
+from .spool import Spool
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop", "spill")
+
+# start method of the process pools, forkserver where it exists as paho's and
+# the worker threads are already running when a pool starts
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class _Shard:
+    def __init__(self, lock: threading.Lock):
+        """The queue of one worker, its condition shares the lock of the pipeline"""
+        self.ring: deque = deque()
+        self.not_empty = threading.Condition(lock)
+
+
+class _WorkerStats:
+    def __init__(self):
+        """Counters written only by their worker thread, summed when read"""
+        self.dispatched = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+
+class DispatchPipeline:
+    def __init__(
+        self,
+        decode: Optional[Callable[[bytes, Optional[str]], Any]],
+        deliver: Callable[[Any, Any], None],
+        workers: int = 4,
+        queue_size: int = 10000,
+        overflow: str = "block",
+        ordered: bool = True,
+        processes: int = 0,
+        metrics: Metrics = None,
+        spill_dir: str = None,
+        spill_max_bytes: int = 256 * 1024 * 1024,
+        restore: Callable[[str, Optional[str]], Any] = None,
+    ):
+        """Decodes and delivers payloads on worker threads so the network
+        thread only has to enqueue them.
+
+        Args:
+            decode (Callable[[bytes, str | None], Any] | None): turns a payload and its content type
+                into the data passed to deliver, must be picklable when processes is used.
+                None passes the raw payload.
+            deliver (Callable[[Any, Any], None]): called with the context given to submit and the decoded data
+            workers (int, optional): number of worker threads. Defaults to 4.
+            queue_size (int, optional): payloads buffered in memory in total, over all workers,
+                before the overflow policy applies. Defaults to 10000.
+            overflow (str, optional): "block" waits for room, "drop" discards the new payload,
+                "spill" appends it to a Spool on disk, read back in order once the workers
+                caught up. Defaults to "block".
+            ordered (bool, optional): keep payloads of one topic in order by giving every topic
+                a fixed worker. Defaults to True.
+            processes (int, optional): decode in a process pool of this size instead of on the
+                worker threads. Defaults to 0.
+            metrics (Metrics, optional): records the decode time as decode_seconds. Defaults to None.
+            spill_dir (str, optional): directory of the spill, payloads left in it are delivered
+                after a restart. Defaults to None, a temporary directory removed by stop.
+            spill_max_bytes (int, optional): size cap of the spill, the oldest payloads are
+                dropped first. Defaults to 256 MiB.
+            restore (Callable[[str, str | None], Any], optional): rebuilds the context of a spilled
+                payload from its key and content type, the context itself is not written to disk.
+                Defaults to None, deliver then gets None as context.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"{overflow!r} is not a valid overflow policy, use one of {OVERFLOW_POLICIES}")
+        if workers < 1:
+            raise ValueError("DispatchPipeline needs at least one worker")
+        self.decode = decode
+        self.deliver = deliver
+        self.workers = workers
+        self.capacity = max(1, queue_size)
+        self.overflow = overflow
+        self.ordered = ordered
+        self.processes = processes
+        self.metrics = metrics
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self.restore = restore
+        # one lock and one capacity for every shard, so a hot topic can use the whole buffer
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._shards = [_Shard(self._lock) for _ in range(workers if ordered else 1)]
+        self._depth = 0
+        self._max_depth = 0
+        self._drops = 0
+        self._spilled = 0
+        self._spool: Optional[Spool] = None
+        self._spool_dir: Optional[str] = None
+        self._drain = True
+        self._stats = [_WorkerStats() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._executor: Optional[Executor] = None
+        self._running = False
+
+    def start(self):
+        """Start the worker threads, the process pool and the spill"""
+        if self._running:
+            return
+        self._running = True
+        self._drain = True
+        if self.processes:
+            context = multiprocessing.get_context(_START_METHOD)
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=context)
+        if self.overflow == "spill":
+            self._spool_dir = self.spill_dir or tempfile.mkdtemp(prefix="influx-spill-")
+            self._spool = Spool(self._spool_dir, max_bytes=self.spill_max_bytes)
+        for i in range(self.workers):
+            shard = self._shards[i % len(self._shards)]
+            thread = threading.Thread(
+                target=self._work, args=(shard, self._stats[i]), name=f"influx-dispatch-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, drain: bool = True):
+        """Stop the workers
+
+        Args:
+            drain (bool, optional): deliver what is still queued or spilled first. Without drain
+                spilled payloads stay in spill_dir. Defaults to True.
+        """
+        if not self._running:
+            return
+        with self._lock:
+            if not drain:
+                for shard in self._shards:
+                    shard.ring.clear()
+                self._depth = 0
+            self._drain = drain
+            self._running = False
+            self._wake_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+            if self.spill_dir is None:
+                shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+    def submit(self, key: str, payload: bytes, context: Any = None, content_type: str = None) -> bool:
+        """Queue a payload, called from the network thread
+
+        Args:
+            key (str): ordering key, the topic
+            payload (bytes): raw payload
+            context (Any, optional): passed to deliver with the decoded data
+            content_type (str, optional): MQTT v5 content type, passed to decode
+
+        Returns:
+            bool: False when the payload was dropped
+        """
+        with self._lock:
+            spool = self._spool
+            if self._depth >= self.capacity or (spool is not None and spool.pending):
+                if self.overflow == "drop":
+                    self._drops += 1
+                    return False
+                if self.overflow == "spill":
+                    # while anything is spilled new payloads queue behind it, which keeps the order
+                    # MQTT topics can not hold U+0000, so the content type is kept after one
+                    spool.append(key if content_type is None else f"{key}\0{content_type}", bytes(payload))
+                    self._spilled += 1
+                    return True
+                while self._depth >= self.capacity and self._running:
+                    self._not_full.wait()
+            self._push(key, (payload, content_type, context, time.perf_counter()))
+        return True
+
+    def _push(self, key: str, item: Tuple[bytes, Optional[str], Any, float]):
+        """Private method adding an item to the shard of its key, must be called with the lock held"""
+        if len(self._shards) == 1:
+            shard = self._shards[0]
+        else:
+            shard = self._shards[zlib.crc32(key.encode("utf-8")) % len(self._shards)]
+        shard.ring.append(item)
+        self._depth += 1
+        if self._depth > self._max_depth:
+            self._max_depth = self._depth
+        shard.not_empty.notify()
+
+    def _refill(self):
+        """Private method moving spilled payloads back into the shards until the buffer is full,
+        must be called with the lock held"""
+        records, position = self._spool.read(self.capacity - self._depth)
+        now = time.perf_counter()
+        for key, payload in records:
+            key, _, content_type = key.partition("\0")
+            content_type = content_type or None
+            context = self.restore(key, content_type) if self.restore is not None else None
+            self._push(key, (payload, content_type, context, now))
+        self._spool.consume(position)
+
+    def _wake_all(self):
+        """Private method waking every waiting thread, must be called with the lock held"""
+        for shard in self._shards:
+            shard.not_empty.notify_all()
+        self._not_full.notify_all()
+
+    def _work(self, shard: _Shard, stats: _WorkerStats):
+        """Private worker loop taking payloads from one shard"""
+        while True:
+            with self._lock:
+                while not shard.ring:
+                    spilled = self._drain and self._spool is not None and self._spool.pending
+                    if spilled and self._depth <= self.capacity // 2:
+                        self._refill()
+                        continue
+                    if not self._running and not self._depth and not spilled:
+                        self._wake_all()
+                        return
+                    shard.not_empty.wait()
+                payload, content_type, context, queued = shard.ring.popleft()
+                self._depth -= 1
+                if self._spool is not None and self._depth <= self.capacity // 2 and self._spool.pending:
+                    self._refill()
+                self._not_full.notify()
+            try:
+                if self.decode is None:
+                    data = payload
+                else:
+                    started = time.perf_counter()
+                    if self._executor is not None:
+                        data = self._executor.submit(self.decode, payload, content_type).result()
+                    else:
+                        data = self.decode(payload, content_type)
+                    if self.metrics is not None:
+                        self.metrics.observe("decode_seconds", time.perf_counter() - started)
+                self.deliver(context, data)
+            except Exception:
+                stats.errors += 1
+                logger.exception("dispatching a message failed")
+            latency = time.perf_counter() - queued
+            stats.dispatched += 1
+            stats.latency_total += latency
+            if latency > stats.latency_max:
+                stats.latency_max = latency
+
+    def stats(self) -> Dict[str, Any]:
+        """Read the pipeline metrics
+
+        Returns:
+            Dict[str, Any]: queue_depth (in memory), max_queue_depth, dispatched, errors, drops, spilled,
+                spill_pending, spill_dropped_bytes (evicted by spill_max_bytes),
+                mean and max dispatch latency in seconds (enqueue or read back from the spill
+                to end of delivery)
+        """
+        dispatched = sum(s.dispatched for s in self._stats)
+        latency_total = sum(s.latency_total for s in self._stats)
+        spool = self._spool
+        return {
+            "queue_depth": self._depth,
+            "max_queue_depth": self._max_depth,
+            "dispatched": dispatched,
+            "errors": sum(s.errors for s in self._stats),
+            "drops": self._drops,
+            "spilled": self._spilled,
+            "spill_pending": int(spool is not None and spool.pending),
+            "spill_dropped_bytes": spool.dropped_bytes if spool is not None else 0,
+            "latency_mean": latency_total / dispatched if dispatched else 0.0,
+            "latency_max": max(s.latency_max for s in self._stats),
+        }
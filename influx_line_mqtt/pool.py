@@ -0,0 +1,278 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Hashable, Iterable, List, Tuple
+from .client import Client
+from .metrics import Metrics
+from .serializer import Series, encode_line, render_prefix
+from .timestamps import to_precision
+
+SHARD_KEYS = ("series", "topic")
+
+# start method of the encoding pool, forkserver where it exists as forking
+# would copy the state of paho's network threads, which run by then
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+Point = Tuple[str, Dict[str, Any], Dict[str, Any], Any, str]
+"""topic, tags, values, epoch_timestamp and dest_table, the arguments of make_send"""
+
+
+def _encode_point(tags: Dict[str, Any], values: Dict[str, Any], epoch_timestamp: Any, dest_table: str,
+                  precision: str) -> bytes:
+    """Private function encoding one point into a line, the same way Series does"""
+    return encode_line(
+        render_prefix(dest_table, tuple((str(k), str(v)) for k, v in tags.items())),
+        values,
+        to_precision(epoch_timestamp, precision),
+    )
+
+
+def _encode_points(points: List[Tuple[Dict[str, Any], Dict[str, Any], Any, str]],
+                   precision: str) -> Tuple[List[bytes], float]:
+    """Private function encoding points into lines, module level so a process pool can pickle it
+
+    Args:
+        points (List[Tuple[Dict[str, Any], Dict[str, Any], Any, str]]): tags, values,
+            epoch_timestamp and dest_table of each point
+        precision (str): timestamp precision of the client
+
+    Returns:
+        Tuple[List[bytes], float]: one encoded line per point and the seconds spent encoding them
+    """
+    started = time.perf_counter()
+    lines = [_encode_point(*point, precision) for point in points]
+    return lines, time.perf_counter() - started
+
+
+class PooledClient:
+    def __init__(self, broker: str, port: int, client_id: str = "Random", qos=2,
+                 sessions: int = 4,
+                 shard_by: str = "series",
+                 processes: int = 0,
+                 chunk_size: int = 1000,
+                 max_shard_keys: int = 100000,
+                 **kwargs,
+                 ):
+        """Create an instance of PooledClient, which publishes over several MQTT
+        sessions to get past the in-flight window of a single one.
+
+        Every topic or series is assigned to one session the first time it is
+        sent and stays there, so its points keep their order. New ones go to the
+        session with the fewest messages in flight. Only the max_shard_keys most
+        recently sent keys are remembered, a key not sent for longer may be
+        assigned again to another session. Session client ids are
+        derived as "<client_id>-<pid>-<n>" so pools in different processes do
+        not take over each other's sessions.
+
+        Args:
+            broker (str): Address of the broker you are using
+            port (int): port number you want to connect on
+            client_id (str, optional): Base of the session client ids. Defaults to "Random".
+            qos (int, optional): QoS used for every publish. Defaults to 2.
+            sessions (int, optional): Number of MQTT sessions. Defaults to 4.
+            shard_by (str, optional): "series" keeps each topic, measurement and tag set on one
+                session, "topic" keeps each topic on one session. Defaults to "series".
+            processes (int, optional): Encode the points given to make_send_many in a process
+                pool of this size. Defaults to 0, encode in the calling thread.
+            chunk_size (int, optional): Points per encoding task of make_send_many. Defaults to 1000.
+            max_shard_keys (int, optional): Number of shard keys whose session is remembered,
+                the least recently sent one is forgotten past it. Defaults to 100000.
+            **kwargs: batching, precision, encoding and spool options, see Client.
+                Each session spools to its own subdirectory of spool_dir.
+        """
+        if shard_by not in SHARD_KEYS:
+            raise ValueError(f"{shard_by!r} is not a valid shard key, use one of {SHARD_KEYS}")
+        if sessions < 1:
+            raise ValueError("PooledClient needs at least one session")
+        if max_shard_keys < 1:
+            raise ValueError("max_shard_keys must be at least 1")
+        self.shard_by = shard_by
+        self.processes = processes
+        self.chunk_size = chunk_size
+        self.max_shard_keys = max_shard_keys
+        spool_dir = kwargs.pop("spool_dir", None)
+        self.clients: List[Client] = []
+        for i in range(sessions):
+            if spool_dir is not None:
+                kwargs["spool_dir"] = os.path.join(spool_dir, str(i))
+            self.clients.append(Client(broker, port, f"{client_id}-{os.getpid()}-{i}", qos, **kwargs))
+        self._locks = [threading.Lock() for _ in self.clients]
+        self._assign_lock = threading.Lock()
+        self._assignments: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._keys_per_session = [0] * sessions
+        self._executor: ProcessPoolExecutor = None
+        if processes:
+            context = multiprocessing.get_context(_START_METHOD)
+            self._executor = ProcessPoolExecutor(processes, mp_context=context)
+
+    def _key(self, topic: str, tags: Dict[str, Any], dest_table: str) -> Hashable:
+        """Private method building the shard key of a point"""
+        if self.shard_by == "topic":
+            return topic
+        # tags given in another order are the same series
+        return (topic, dest_table, tuple(sorted(tags.items())))
+
+    def _session(self, key: Hashable) -> int:
+        """Private method returning the session of a shard key,
+        assigning the least loaded one when the key is new and
+        forgetting the least recently sent key past max_shard_keys
+
+        Args:
+            key (Hashable): shard key from _key
+
+        Returns:
+            int: index into clients
+        """
+        with self._assign_lock:
+            index = self._assignments.get(key)
+            if index is not None:
+                self._assignments.move_to_end(key)
+                return index
+            index = min(
+                range(len(self.clients)),
+                key=lambda i: (self.clients[i]._inflight(), self._keys_per_session[i]),
+            )
+            self._assignments[key] = index
+            self._keys_per_session[index] += 1
+            if len(self._assignments) > self.max_shard_keys:
+                _, forgotten = self._assignments.popitem(last=False)
+                self._keys_per_session[forgotten] -= 1
+        return index
+
+    def make_send(self,
+                  topic: str,
+                  tags: Dict[str, Any],
+                  values: Dict[str, Any],
+                  epoch_timestamp: float,
+                  dest_table: str,
+                  batch: bool = None,
+                  ):
+        """
+        Use this method to make data, encode it in influx_line_protocol
+        and send it on the session of its series, see Client.make_send.
+        Lines are encoded like those of make_send_many and Series, floats keep full precision.
+
+        Args:
+            topic (str): Add the topic of the message
+            tags (Dict[str, Any]): Tags you would like to send.
+            values (Dict[str, Any]): values you would like to add
+            epoch_timestamp (int|float|str|Datetime|None): Timestamp you would like to define, None for now.
+            dest_table (str | None, optional): Dest_table you would like to add. Defaults to None.
+            batch (bool | None, optional): Override the batching mode of the sessions for this call.
+        """
+        index = self._session(self._key(topic, tags, dest_table))
+        client = self.clients[index]
+        started = time.perf_counter()
+        line = _encode_point(tags, values, epoch_timestamp, client._fix_dest_table(dest_table, tags), client.precision)
+        client.metrics.observe("encode_seconds", time.perf_counter() - started)
+        with self._locks[index]:
+            client._send_line(client._fix_topic(topic, tags), line, client.batch if batch is None else batch)
+
+    def make_send_many(self, points: Iterable[Point], batch: bool = None) -> int:
+        """
+        Use this method to send many points at once. With processes the
+        encoding is spread over the process pool in chunks of chunk_size,
+        the sessions publish the lines in the order the points were given.
+
+        Args:
+            points (Iterable[Tuple[str, Dict, Dict, Any, str]]): topic, tags, values,
+                epoch_timestamp and dest_table of every point, like the arguments of make_send
+            batch (bool | None, optional): Override the batching mode of the sessions for this call.
+
+        Returns:
+            (int): number of points sent
+        """
+        groups: Dict[int, List[Tuple[str, Tuple]]] = {}
+        count = 0
+        for topic, tags, values, epoch_timestamp, dest_table in points:
+            index = self._session(self._key(topic, tags, dest_table))
+            dest_table = self.clients[index]._fix_dest_table(dest_table, tags)
+            groups.setdefault(index, []).append((topic, (tags, values, epoch_timestamp, dest_table)))
+            count += 1
+        precision = self.clients[0].precision
+        tasks = []
+        for index, group in groups.items():
+            for start in range(0, len(group), self.chunk_size):
+                chunk = group[start:start + self.chunk_size]
+                encoded = [point for _, point in chunk]
+                if self._executor is not None:
+                    encoded = self._executor.submit(_encode_points, encoded, precision)
+                tasks.append((index, [topic for topic, _ in chunk], encoded))
+        for index, topics, encoded in tasks:
+            lines, seconds = encoded.result() if self._executor is not None else _encode_points(encoded, precision)
+            client = self.clients[index]
+            if lines:
+                client.metrics.observe("encode_seconds", seconds / len(lines), len(lines))
+            with self._locks[index]:
+                for topic, line in zip(topics, lines):
+                    client._send_line(topic, line, client.batch if batch is None else batch)
+        return count
+
+    def series(self, dest_table: str, tags: Dict[str, Any], topic: str) -> Series:
+        """
+        Use this method to get a series handle bound to the session of the series,
+        see Client.series.
+
+        Args:
+            dest_table (str | None): Dest_table of the series, taken from the tags when None.
+            tags (Dict[str, Any]): Tags of the series.
+            topic (str): Topic the series is sent on, part of the shard key.
+
+        Returns:
+            (Series): handle with encode and send methods
+        """
+        index = self._session(self._key(topic, tags, dest_table))
+        return self.clients[index].series(dest_table, tags, topic)
+
+    def flush(self):
+        """
+        Method to publish every buffered batch of every session right away
+        """
+        for client in self.clients:
+            client.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Method to read the metrics of all sessions combined, see Client.stats.
+        Gauges are summed too, the stats of each session are under "per_session".
+
+        Returns:
+            (Dict[str, Any]): flat dict of every metric, plus per_session
+        """
+        stats = Metrics.merged(client.metrics for client in self.clients).snapshot()
+        stats.update(self._gauges())
+        stats["per_session"] = [client.stats() for client in self.clients]
+        return stats
+
+    def prometheus_text(self, prefix: str = "influx_line_mqtt_client") -> str:
+        """
+        Method to render the combined metrics in the Prometheus text format
+
+        Args:
+            prefix (str, optional): prepended to every metric name. Defaults to "influx_line_mqtt_client".
+
+        Returns:
+            (str): exposition text
+        """
+        return Metrics.merged(client.metrics for client in self.clients).prometheus(prefix, self._gauges())
+
+    def _gauges(self) -> Dict[str, float]:
+        """Private method summing the gauges of the sessions"""
+        gauges: Dict[str, float] = {"sessions": len(self.clients), "shard_keys": len(self._assignments)}
+        for client in self.clients:
+            for name, value in client._gauges().items():
+                gauges[name] = gauges.get(name, 0) + value
+        return gauges
+
+    def close(self):
+        """
+        Method to flush and close every session and stop the process pool
+        """
+        for client in self.clients:
+            client.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,162 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+Matcher = Union[str, Iterable[str], None]
+
+
+def _as_set(value: Matcher) -> Optional[frozenset]:
+    """Private function turning a single value or a collection into a frozenset"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return frozenset((value,))
+    return frozenset(value)
+
+
+class Route:
+    __slots__ = ("topic_filter", "handler", "qos", "measurements", "tags")
+
+    def __init__(
+        self,
+        topic_filter: str,
+        handler: Callable,
+        qos: int = 0,
+        measurement: Matcher = None,
+        tags: Dict[str, Matcher] = None,
+    ):
+        """A subscription of a Subscriber, see Subscriber.route
+
+        Args:
+            topic_filter (str): MQTT topic filter, + and # wildcards allowed
+            handler (Callable): called like on_message with the records this route accepts
+            qos (int, optional): QoS of the subscription. Defaults to 0.
+            measurement (str | Iterable[str], optional): only accept these measurements. Defaults to None.
+            tags (Dict[str, str | Iterable[str]], optional): only accept records whose tags have
+                one of the given values. Defaults to None.
+        """
+        self.topic_filter = topic_filter
+        self.handler = handler
+        self.qos = qos
+        self.measurements = _as_set(measurement)
+        self.tags = {key: _as_set(value) for key, value in tags.items()} if tags else None
+
+    @property
+    def filtered(self) -> bool:
+        """True when the route looks at measurement or tags"""
+        return self.measurements is not None or self.tags is not None
+
+    def accepts(self, measurement: str, tag_set: Dict[str, str]) -> bool:
+        """Check a record header against the measurement and tag filter
+
+        Args:
+            measurement (str): measurement of the record
+            tag_set (Dict[str, str]): tags of the record
+
+        Returns:
+            bool: True when the record is wanted
+        """
+        if self.measurements is not None and measurement not in self.measurements:
+            return False
+        if self.tags is not None:
+            for key, values in self.tags.items():
+                if tag_set.get(key) not in values:
+                    return False
+        return True
+
+
+class _Node:
+    __slots__ = ("children", "values", "multi")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.values: List[Any] = []
+        self.multi: List[Any] = []
+
+
+class TopicRouter:
+    def __init__(self):
+        """A trie of MQTT topic filters, one level per node. Matching a topic walks
+        its levels once, so the cost depends on the topic depth and not on the
+        number of filters. + and # follow the MQTT rules, including not matching
+        topics starting with $ at the first level.
+        """
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, topic_filter: str, value: Any):
+        """Register value for a topic filter
+
+        Args:
+            topic_filter (str): MQTT topic filter
+            value (Any): returned by match for matching topics
+
+        Raises:
+            ValueError: when # is not the last level or a wildcard shares a level
+        """
+        node = self._root
+        levels = topic_filter.split("/")
+        for i, level in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    raise ValueError(f"{topic_filter!r}: # must be the last level")
+                node.multi.append(value)
+                self._size += 1
+                return
+            if ("+" in level or "#" in level) and level != "+":
+                raise ValueError(f"{topic_filter!r}: wildcards must fill a whole level")
+            node = node.children.setdefault(level, _Node())
+        node.values.append(value)
+        self._size += 1
+
+    def remove(self, topic_filter: str, value: Any):
+        """Unregister value from a topic filter
+
+        Raises:
+            KeyError: when value is not registered for the filter
+        """
+        node = self._root
+        levels = topic_filter.split("/")
+        for level in levels[:-1] if levels[-1] == "#" else levels:
+            node = node.children.get(level)
+            if node is None:
+                raise KeyError(topic_filter)
+        values = node.multi if levels[-1] == "#" else node.values
+        try:
+            values.remove(value)
+        except ValueError:
+            raise KeyError(topic_filter) from None
+        self._size -= 1
+
+    def match(self, topic: str) -> List[Any]:
+        """Find the values of every filter matching a topic
+
+        Args:
+            topic (str): topic of a received message
+
+        Returns:
+            List[Any]: matching values in no particular order
+        """
+        levels = topic.split("/")
+        found: List[Any] = []
+        nodes = [self._root]
+        for i, level in enumerate(levels):
+            next_nodes = []
+            for node in nodes:
+                if node.multi and not (i == 0 and level.startswith("$")):
+                    found.extend(node.multi)
+                child = node.children.get(level)
+                if child is not None:
+                    next_nodes.append(child)
+                child = node.children.get("+")
+                if child is not None and not (i == 0 and level.startswith("$")):
+                    next_nodes.append(child)
+            if not next_nodes:
+                return found
+            nodes = next_nodes
+        for node in nodes:
+            found.extend(node.values)
+            # "a/#" also matches "a" itself
+            found.extend(node.multi)
+        return found
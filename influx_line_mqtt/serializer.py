@@ -0,0 +1,142 @@
+import time
+from functools import lru_cache
+from typing import Any, Dict, Tuple, Union
+
+
+@lru_cache(maxsize=4096)
+def escape_measurement(measurement: str) -> str:
+    """Escape a measurement name like influx_line_protocol.Metric does, and
+    backslashes too, so a name ending in one can be read back"""
+    return measurement.replace("\\", "\\\\").replace(",", "\\,").replace(" ", "\\ ")
+
+
+@lru_cache(maxsize=4096)
+def escape_key(value: str) -> str:
+    """Escape a tag key, tag value or field key the same way influx_line_protocol.Metric does"""
+    return (
+        value.replace("\\", "\\\\")
+        .replace(" ", "\\ ")
+        .replace("=", "\\=")
+        .replace(",", "\\,")
+    )
+
+
+def escape_string(value: str) -> str:
+    """Escape a string field value"""
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+@lru_cache(maxsize=1024)
+def render_prefix(measurement: str, tags: Tuple[Tuple[str, str], ...]) -> str:
+    """Render and cache the "measurement,tag=value " part of a line
+
+    Args:
+        measurement (str): measurement name
+        tags (Tuple[Tuple[str, str], ...]): tags as key/value pairs in the order they are written
+
+    Returns:
+        str: the escaped prefix including the trailing space
+    """
+    prefix = escape_measurement(measurement)
+    for key, value in tags:
+        prefix = f"{prefix},{escape_key(key)}={escape_key(value)}"
+    return prefix + " "
+
+
+def encode_fields(values: Dict[str, Any]) -> str:
+    """Render the field set of a line
+
+    Floats are written with repr so no precision is lost, ints get the i suffix,
+    bools are written as t/f and anything else as a quoted string.
+
+    Args:
+        values (Dict[str, Any]): field values
+
+    Returns:
+        str: the rendered field set
+    """
+    parts = []
+    for key, value in values.items():
+        kind = type(value)
+        if kind is float:
+            rendered = repr(value)
+        elif kind is int:
+            rendered = f"{value}i"
+        elif kind is bool:
+            rendered = "t" if value else "f"
+        else:
+            rendered = f'"{escape_string(str(value))}"'
+        parts.append(f"{escape_key(str(key))}={rendered}")
+    return ",".join(parts)
+
+
+def encode_line(prefix: str, values: Dict[str, Any], timestamp: Union[int, float, None]) -> bytes:
+    """Render a complete line from a prefix made by render_prefix
+
+    Args:
+        prefix (str): rendered measurement and tags
+        values (Dict[str, Any]): field values
+        timestamp (int | float | None): timestamp already in the wanted precision
+
+    Returns:
+        bytes: the utf-8 encoded line
+    """
+    if timestamp is None:
+        return (prefix + encode_fields(values)).encode("utf-8")
+    return f"{prefix}{encode_fields(values)} {int(timestamp)}".encode("utf-8")
+
+
+class Series:
+    def __init__(self, client, dest_table: str, tags: Dict[str, Any], topic: str = None):
+        """A handle for sending many points that share a measurement and tag set.
+        The measurement and tags are escaped and rendered once, only the values
+        and the timestamp are encoded per point. Use Client.series to create one.
+
+        Args:
+            client (Client): client used for sending
+            dest_table (str): measurement name
+            tags (Dict[str, Any]): tags of the series
+            topic (str, optional): default topic for send. Defaults to None.
+        """
+        self.client = client
+        self.dest_table = dest_table
+        self.tags = tags
+        self.topic = topic
+        self.prefix = render_prefix(dest_table, tuple((str(k), str(v)) for k, v in tags.items()))
+
+    def encode(self, values: Dict[str, Any], epoch_timestamp=None) -> bytes:
+        """Encode a point of this series
+
+        Args:
+            values (Dict[str, Any]): values you would like to add
+            epoch_timestamp (int|float|str|Datetime|None, optional): Timestamp of the point, read
+                like in Client.make_send. Defaults to None, now.
+
+        Raises:
+            InvalidTimestamp: when the timestamp can not be read
+
+        Returns:
+            bytes: the encoded line
+        """
+        return encode_line(self.prefix, values, self.client._fix_timestamp(epoch_timestamp))
+
+    def send(self, values: Dict[str, Any], epoch_timestamp=None, topic: str = None, batch: bool = None):
+        """Encode a point of this series and send it like Client.make_send
+
+        Args:
+            values (Dict[str, Any]): values you would like to add
+            epoch_timestamp (int|float|str|Datetime|None, optional): Timestamp of the point.
+                Defaults to None, now.
+            topic (str, optional): topic to publish on. Defaults to the topic of the series.
+            batch (bool | None, optional): Override the batching mode of the client for this call.
+
+        Returns:
+            (mqtt.MQTTMessageInfo | None): paho's message info, None when the line was buffered
+        """
+        topic = topic or self.topic
+        if topic is None:
+            raise ValueError("Series.send needs a topic, pass one here or to Client.series")
+        started = time.perf_counter()
+        line = self.encode(values, epoch_timestamp)
+        self.client.metrics.observe("encode_seconds", time.perf_counter() - started)
+        return self.client._send_line(topic, line, self.client.batch if batch is None else batch)
@@ -0,0 +1,235 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+_HEADER = struct.Struct("!IdHI")
+"""crc32 of topic and payload, append time, topic length, payload length"""
+
+_SUFFIX = ".spool"
+_POSITION_FILE = "position"
+
+Position = Tuple[int, int]
+Record = Tuple[str, bytes]
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: Optional[float] = None,
+        segment_bytes: int = 4 * 1024 * 1024,
+        fsync_every: int = 64,
+    ):
+        """An append only, disk backed queue of (topic, payload) records
+        used by Client to keep data while the broker can not take it.
+
+        Records are written to numbered segment files through a buffered writer
+        and fsynced every fsync_every records. Fully read segments are deleted and
+        the read position is kept in a small file, so a restart resumes where
+        draining stopped. A record cut short by a crash fails its length or crc
+        check and the segment is truncated there on open.
+
+        Args:
+            directory (str): directory holding the segment files, created when missing
+            max_bytes (int, optional): size cap of all segments, the oldest are deleted
+                when it is exceeded. Defaults to 256 MiB.
+            max_age (float | None, optional): records older than this many seconds
+                are skipped when read. Defaults to None, keep forever.
+            segment_bytes (int, optional): size after which a new segment is started. Defaults to 4 MiB.
+            fsync_every (int, optional): fsync after this many appends. Defaults to 64.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = min(segment_bytes, max(1, max_bytes // 4))
+        self.fsync_every = fsync_every
+        self.dropped_bytes = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        os.makedirs(directory, exist_ok=True)
+
+        self._sizes: Dict[int, int] = {}
+        for name in os.listdir(directory):
+            if name.endswith(_SUFFIX):
+                seq = int(name[: -len(_SUFFIX)])
+                self._sizes[seq] = self._recover(seq)
+        self._read: Position = self._load_position()
+        self._write_seq = max(self._sizes, default=0) + 1
+        self._sizes[self._write_seq] = 0
+        self._writer = open(self._path(self._write_seq), "ab")
+        self._advance()
+
+    def _path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{seq:016d}{_SUFFIX}")
+
+    def _recover(self, seq: int) -> int:
+        """Private method truncating a segment after its last complete record
+
+        Returns:
+            int: the size of the segment after recovery
+        """
+        path = self._path(seq)
+        with open(path, "rb") as segment:
+            data = segment.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            crc, _, topic_length, payload_length = _HEADER.unpack_from(data, offset)
+            end = offset + _HEADER.size + topic_length + payload_length
+            if end > len(data) or zlib.crc32(data[offset + _HEADER.size:end]) != crc:
+                break
+            offset = end
+        if offset != len(data):
+            with open(path, "r+b") as segment:
+                segment.truncate(offset)
+                os.fsync(segment.fileno())
+        return offset
+
+    def _load_position(self) -> Position:
+        """Private method reading the saved read position, or the start of the oldest segment"""
+        oldest = (min(self._sizes), 0) if self._sizes else (1, 0)
+        try:
+            with open(os.path.join(self.directory, _POSITION_FILE)) as position:
+                seq, offset = (int(part) for part in position.read().split())
+        except (OSError, ValueError):
+            return oldest
+        if seq not in self._sizes:
+            return oldest
+        return seq, min(offset, self._sizes[seq])
+
+    def _save_position(self):
+        """Private method writing the read position atomically"""
+        path = os.path.join(self.directory, _POSITION_FILE)
+        with open(path + ".tmp", "w") as position:
+            position.write(f"{self._read[0]} {self._read[1]}")
+        os.replace(path + ".tmp", path)
+
+    @property
+    def pending(self) -> bool:
+        """True while records are waiting to be read"""
+        seq, offset = self._read
+        return seq < self._write_seq or offset < self._sizes[self._write_seq]
+
+    def append(self, topic: str, payload: bytes):
+        """Add a record at the end of the spool
+
+        Args:
+            topic (str): topic the payload is published on
+            payload (bytes): payload to keep
+        """
+        topic_bytes = topic.encode("utf-8")
+        body = topic_bytes + payload
+        record = _HEADER.pack(zlib.crc32(body), time.time(), len(topic_bytes), len(payload)) + body
+        with self._lock:
+            self._writer.write(record)
+            self._sizes[self._write_seq] += len(record)
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                self._sync()
+            if self._sizes[self._write_seq] >= self.segment_bytes:
+                self._rotate()
+
+    def _sync(self):
+        """Private method flushing and fsyncing the current segment"""
+        self._writer.flush()
+        os.fsync(self._writer.fileno())
+        self._unsynced = 0
+
+    def _rotate(self):
+        """Private method starting a new segment and applying max_bytes"""
+        self._sync()
+        self._writer.close()
+        self._write_seq += 1
+        self._sizes[self._write_seq] = 0
+        self._writer = open(self._path(self._write_seq), "ab")
+        while sum(self._sizes.values()) > self.max_bytes and len(self._sizes) > 1:
+            oldest = min(self._sizes)
+            self.dropped_bytes += self._sizes.pop(oldest)
+            os.remove(self._path(oldest))
+            if self._read[0] <= oldest:
+                self._read = (oldest + 1, 0)
+        self._save_position()
+
+    def read(self, max_records: int = 1000, max_bytes: int = 1024 * 1024) -> Tuple[List[Record], Position]:
+        """Read records from the read position without consuming them
+
+        Args:
+            max_records (int, optional): most records to return. Defaults to 1000.
+            max_bytes (int, optional): stop once this many payload bytes are read. Defaults to 1 MiB.
+
+        Returns:
+            Tuple[List[Record], Position]: the records and the position to pass to consume
+        """
+        records: List[Record] = []
+        size = 0
+        oldest = time.time() - self.max_age if self.max_age is not None else None
+        with self._lock:
+            self._writer.flush()
+            seq, offset = self._read
+            while len(records) < max_records and size < max_bytes:
+                if offset >= self._sizes.get(seq, 0):
+                    if seq >= self._write_seq:
+                        break
+                    seq, offset = seq + 1, 0
+                    continue
+                with open(self._path(seq), "rb") as segment:
+                    segment.seek(offset)
+                    data = segment.read(min(max_bytes, self._sizes[seq] - offset) + _HEADER.size)
+                position = 0
+                while len(records) < max_records and size < max_bytes:
+                    if position + _HEADER.size > len(data):
+                        break
+                    crc, appended, topic_length, payload_length = _HEADER.unpack_from(data, position)
+                    start = position + _HEADER.size
+                    end = start + topic_length + payload_length
+                    if end > self._sizes[seq] - offset or (end <= len(data) and zlib.crc32(data[start:end]) != crc):
+                        # a damaged record makes the rest of the segment unreadable
+                        position = self._sizes[seq] - offset
+                        break
+                    if end > len(data):
+                        if position == 0:
+                            with open(self._path(seq), "rb") as segment:
+                                segment.seek(offset)
+                                data = segment.read(end)
+                            continue
+                        break
+                    position = end
+                    if oldest is not None and appended < oldest:
+                        self.expired += 1
+                        continue
+                    records.append((data[start:start + topic_length].decode("utf-8"), data[start + topic_length:end]))
+                    size += payload_length
+                offset += position
+        return records, (seq, offset)
+
+    def consume(self, position: Position):
+        """Mark everything before position as done, deleting finished segments
+
+        Args:
+            position (Position): position returned by read
+        """
+        with self._lock:
+            self._read = position
+            self._advance()
+            self._save_position()
+
+    def _advance(self):
+        """Private method moving the read position past exhausted segments and deleting them"""
+        seq, offset = self._read
+        while seq < self._write_seq and offset >= self._sizes.get(seq, 0):
+            seq, offset = seq + 1, 0
+        self._read = (seq, offset)
+        for old in [old for old in self._sizes if old < seq]:
+            self._sizes.pop(old)
+            os.remove(self._path(old))
+
+    def close(self):
+        """Flush and close the current segment"""
+        with self._lock:
+            self._sync()
+            self._writer.close()
+            self._save_position()
@@ -1,26 +1,28 @@
-from typing import Dict, List
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
 import paho.mqtt.client as mqtt
+from .aggregate import Aggregator
+from .columnar import InfluxBatch
+from .data import Influx_Data
+from .encoding import decode_payload, message_content_type
+from .metrics import Metrics
+from .parser import LineProtocolError, iter_lines, parse, parse_columnar, parse_header, parse_line
+from .pipeline import DispatchPipeline
+from .routing import Route, TopicRouter
 
+# MQTT client, userdata, matching routes and content type of a received message
+Context = Tuple[Any, Any, List[Route], Optional[str]]
 
-class Influx_Data:
-    def __init__(
-        self, measurement: str, tag_set: dict, field_set: dict, timestamp: int
-    ):
-        """A custom object to store data received and decode it in Influx data format
 
-        Args:
-            measurement (str)
-            tag_set (dict)
-            field_set (dict)
-            timestamp (int)
-        """
-        self.measurement = measurement
-        self.tag_set = tag_set
-        self.field_set = field_set
-        self.timestamp = timestamp
+def _parse_payload(payload: bytes, content_type: Optional[str] = None) -> List[Influx_Data]:
+    """Private function decoding the wire encoding of a payload and parsing it,
+    module level so a process pool can pickle it"""
+    return parse(decode_payload(payload, content_type))
 
-    def __str__(self):
-        return f"measurement: {self.measurement}\ntag_set: {self.tag_set}\nfield_set: {self.field_set}\ntimestamp: {self.timestamp}"
+
+def _parse_payload_columnar(payload: bytes, content_type: Optional[str] = None) -> InfluxBatch:
+    """Private function like _parse_payload returning an InfluxBatch"""
+    return parse_columnar(decode_payload(payload, content_type))
 
 
 class Decode:
@@ -71,6 +73,7 @@ class Decode:
                 field_key = field.split("=")[0]
                 field_value = field.split("=")[1]
                 field_set[field_key] = field_value
+        return field_set
 
     def _measurement(self):
         """Private method to extract the measurement from the _data_break
@@ -101,23 +104,74 @@ class Subscriber:
     def __init__(
         self,
         broker: str,
-        topic: str,
+        topic: str = None,
         port: int = 1883,
         client_id: str = "Smartphone",
+        batch_callback: bool = False,
+        columnar: bool = False,
+        workers: int = 0,
+        queue_size: int = 10000,
+        overflow: str = "block",
+        ordered: bool = True,
+        processes: int = 0,
+        spill_dir: str = None,
+        spill_max_bytes: int = 256 * 1024 * 1024,
+        protocol: int = mqtt.MQTTv311,
     ):
         """Creates an instance of Subscriber.
 
         Args:
             broker (str): Address of the broker you are using.
-            topic (str): Give the topic you want to subscribe to.
+            topic (str, optional): Give the topic you want to subscribe to with on_message.
+                Can be left out when every subscription is added with route.
             port (int, optional): Port number. Defaults to 1883.
             client_id (str, optional): Client ID. Defaults to "Smartphone".
+            batch_callback (bool, optional): Call on_message once per payload with the list
+                of decoded records instead of once per record. Defaults to False.
+            columnar (bool, optional): Call on_message once per payload with an InfluxBatch
+                holding the records as columns. Defaults to False.
+            workers (int, optional): Decode and call on_message on this many worker threads instead
+                of paho's network thread. Defaults to 0, which keeps everything on the network thread.
+            queue_size (int, optional): Payloads waiting for all workers together before overflow applies.
+                Defaults to 10000.
+            overflow (str, optional): "block", "drop" or "spill" to disk when the queue is full. Defaults to "block".
+            ordered (bool, optional): Keep the messages of a topic in order. Defaults to True.
+            processes (int, optional): Decode in a process pool of this size. Defaults to 0.
+            spill_dir (str, optional): Directory payloads spill to, what is left in it is delivered
+                after a restart. Defaults to None, a temporary directory.
+            spill_max_bytes (int, optional): Size cap of the spill, the oldest payloads are dropped
+                first. Defaults to 256 MiB.
+            protocol (int, optional): MQTT protocol version, with mqtt.MQTTv5 the content type
+                property of a message names its encoding instead of detecting it from the
+                first bytes. Defaults to mqtt.MQTTv311.
         """
         self.broker = broker
         self.topic = topic
+        self.batch_callback = batch_callback
+        self.columnar = columnar
         self._on_message: function = None
         self.port = port
-        self.client = mqtt.Client(client_id)
+        self.client = mqtt.Client(client_id, protocol=protocol)
+        self._router = TopicRouter()
+        self._routes: List[Route] = []
+        self._default_route: Route = None
+        self._pipeline: DispatchPipeline = None
+        self._aggregators: List[Aggregator] = []
+        self.metrics = Metrics()
+        if workers:
+            self._pipeline = DispatchPipeline(
+                _parse_payload_columnar if columnar else _parse_payload,
+                self._deliver,
+                workers=workers,
+                queue_size=queue_size,
+                overflow=overflow,
+                ordered=ordered,
+                processes=processes,
+                metrics=self.metrics,
+                spill_dir=spill_dir,
+                spill_max_bytes=spill_max_bytes,
+                restore=self._restore_context,
+            )
 
     @property
     def on_message(self):
@@ -132,24 +186,285 @@ class Subscriber:
         """
         self._on_message = func
 
+    def route(
+        self,
+        topic_filter: str,
+        handler: Callable,
+        qos: int = 0,
+        measurement: Union[str, Iterable[str]] = None,
+        tags: Dict[str, Union[str, Iterable[str]]] = None,
+    ) -> Route:
+        """Add a subscription with its own handler on the same connection.
+        Messages are matched against every route through a topic trie. When a
+        measurement or tags filter is given, only the measurement and tags of
+        each line are scanned first and lines no route wants are never fully decoded.
+        With processes the pool still decodes whole payloads and the records are
+        filtered afterwards.
+
+        Args:
+            topic_filter (str): MQTT topic filter, + and # wildcards allowed.
+            handler (Callable): Called like on_message with the accepted records.
+            qos (int, optional): QoS of the subscription. Defaults to 0.
+            measurement (str | Iterable[str], optional): Only pass these measurements. Defaults to None.
+            tags (Dict[str, str | Iterable[str]], optional): Only pass records with these tag values. Defaults to None.
+
+        Returns:
+            Route: the added route
+        """
+        route = Route(topic_filter, handler, qos, measurement, tags)
+        self._router.add(topic_filter, route)
+        self._routes.append(route)
+        if route.filtered and self._pipeline is not None and not self._pipeline.processes:
+            # workers scan headers first, a process pool keeps decoding everything
+            # and _deliver filters the decoded records
+            self._pipeline.decode = None
+        if self.client.is_connected():
+            self.client.subscribe(topic_filter, qos=qos)
+        return route
+
+    def aggregate(
+        self,
+        window: Union[str, int, float] = "10s",
+        fields: Iterable[str] = None,
+        funcs: Sequence[str] = ("mean", "max", "count"),
+        group_by: Iterable[str] = None,
+        watermark: Union[str, int, float] = 0,
+        topic_filter: str = None,
+        handler: Callable = None,
+        qos: int = 0,
+        precision: str = "ns",
+        vectorized: bool = False,
+    ) -> Aggregator:
+        """Downsample records before they reach a handler. Records are grouped by
+        measurement and tags into windows of their timestamps, and each window
+        is passed on as one record per series with a field "<field>_<func>" per
+        aggregated field and function, timestamped with the start of the window.
+        A window is passed on once a record more than watermark past its end
+        arrived, later records for it are dropped and counted as points_late.
+        stop passes on the windows that are still open.
+
+        Args:
+            window (str | int | float, optional): Window length like "10s", "500ms" or "1m",
+                or seconds. Defaults to "10s".
+            fields (Iterable[str], optional): Fields to aggregate. Defaults to None, every numeric field.
+            funcs (Sequence[str], optional): Any of "mean", "min", "max", "sum", "count", "first"
+                and "last". Defaults to ("mean", "max", "count").
+            group_by (Iterable[str], optional): Tags that make up a series and are kept. Defaults to
+                None, all tags.
+            watermark (str | int | float, optional): How long to wait for late records. Defaults to 0.
+            topic_filter (str, optional): Topic filter to aggregate, defaults to topic, whose records
+                then reach on_message only aggregated.
+            handler (Callable, optional): Called like on_message with the aggregated records.
+                Defaults to on_message.
+            qos (int, optional): QoS of the subscription. Defaults to 0.
+            precision (str, optional): Precision of the received timestamps. Defaults to "ns".
+            vectorized (bool, optional): Reduce each window with NumPy when it is emitted instead
+                of updating accumulators per record, needs numpy. Defaults to False.
+
+        Returns:
+            Aggregator: the aggregation stage, flush emits its open windows
+        """
+        output = Route(topic_filter or self.topic, handler or self._call_on_message)
+        aggregator = Aggregator(
+            lambda client, userdata, records: self._deliver_route(
+                output, client, userdata, InfluxBatch.from_points(records) if self.columnar else records
+            ),
+            window=window,
+            fields=fields,
+            funcs=funcs,
+            group_by=group_by,
+            watermark=watermark,
+            precision=precision,
+            vectorized=vectorized,
+            metrics=self.metrics,
+        )
+        if topic_filter is None:
+            if self.topic is None:
+                raise ValueError("aggregate needs a topic_filter when the Subscriber has no topic")
+            self._default_route = self.route(self.topic, aggregator, qos)
+        else:
+            self.route(topic_filter, aggregator, qos)
+        self._aggregators.append(aggregator)
+        return aggregator
+
     def start(self):
         """
         Method to start the subscriber to loop forever,
-        Before starting please assign on_message
+        Before starting please assign on_message or add routes
         """
+        if self.topic is not None and self._default_route is None:
+            self._default_route = self.route(self.topic, self._call_on_message)
+        self.client.on_connect = self._on_connect
         self.client.connect(self.broker, self.port)
-        self.client.subscribe(topic=self.topic)
         self.client.on_message = self._on_message_inner
+        if self._pipeline is not None:
+            self._pipeline.start()
         self.client.loop_forever()
 
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        """Subscribes to every route, again after each reconnect"""
+        qos: Dict[str, int] = {}
+        for route in self._routes:
+            qos[route.topic_filter] = max(route.qos, qos.get(route.topic_filter, 0))
+        if qos:
+            client.subscribe(list(qos.items()))
+
+    def _call_on_message(self, client, userdata, data):
+        """Handler of the route made from topic, calls on_message"""
+        self._on_message(client, userdata, data)
+
+    def stop(self):
+        """
+        Method to disconnect, which ends start, and to deliver
+        whatever the workers still have queued and the open aggregation windows
+        """
+        self.client.disconnect()
+        if self._pipeline is not None:
+            self._pipeline.stop()
+        for aggregator in self._aggregators:
+            aggregator.flush()
+
+    def pipeline_stats(self) -> Dict[str, float]:
+        """Metrics of the worker pipeline: queue depth, dispatch latency, drops
+
+        Returns:
+            Dict[str, float]: see DispatchPipeline.stats, empty without workers
+        """
+        if self._pipeline is None:
+            return {}
+        return self._pipeline.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        """Instrumentation of the subscriber: messages_received, bytes_received and
+        points_received counters, decode_seconds and callback_seconds histograms
+        (_count, _sum, _mean, _p50, _p99, _max, callback_seconds covers the delivery
+        of one payload to one route) and the pipeline_stats prefixed with pipeline_
+
+        Returns:
+            Dict[str, Any]: flat dict of every metric
+        """
+        stats = self.metrics.snapshot()
+        stats.update(self._gauges())
+        return stats
+
+    def prometheus_text(self, prefix: str = "influx_line_mqtt_subscriber") -> str:
+        """Render stats in the Prometheus text format, see metrics.start_prometheus_server
+
+        Args:
+            prefix (str, optional): prepended to every metric name. Defaults to "influx_line_mqtt_subscriber".
+
+        Returns:
+            str: exposition text
+        """
+        return self.metrics.prometheus(prefix, self._gauges())
+
+    def _gauges(self) -> Dict[str, float]:
+        """Private method reading the pipeline metrics as gauges"""
+        return {f"pipeline_{name}": value for name, value in self.pipeline_stats().items()}
+
     def _on_message_inner(self, client, userdata, message):
-        """Inner module that takes the received message and decodes it.
+        """Inner module that takes the received message and decodes it,
+        or hands it to the workers when there are any.
+        A payload may hold several newline separated lines.
 
         Args:
             client (Any):   MQTT client
             userdata (Any): Userdata
             message (Any): Received message
         """
-        message_decode = message.payload.decode("utf-8")
-        data: Influx_Data = Decode(message_decode).decode()
-        self._on_message(client, userdata, data)
+        self.metrics.add(messages_received=1, bytes_received=len(message.payload))
+        routes = self._router.match(message.topic)
+        if not routes:
+            return
+        content_type = message_content_type(message)
+        context = (client, userdata, routes, content_type)
+        if self._pipeline is not None:
+            self._pipeline.submit(message.topic, message.payload, context, content_type)
+            return
+        self._dispatch(context, message.payload)
+
+    def _restore_context(self, topic: str, content_type: Optional[str]) -> Context:
+        """Private method rebuilding the context of a payload read back from the spill"""
+        return self.client, self.client._userdata, self._router.match(topic), content_type
+
+    def _dispatch(self, context: Context, payload: bytes):
+        """Private method decoding a payload for the routes matching its topic.
+        Compressed or binary payloads are turned back into lines first.
+        Filtered routes get the header of every line checked before it is decoded.
+
+        Args:
+            context (Tuple[Any, Any, List[Route], str | None]): MQTT client, userdata,
+                matching routes and content type
+            payload (bytes): received payload
+        """
+        client, userdata, routes, content_type = context
+        started = time.perf_counter()
+        payload = decode_payload(payload, content_type)
+        if not any(route.filtered for route in routes):
+            data = parse_columnar(payload) if self.columnar else parse(payload)
+            self.metrics.observe("decode_seconds", time.perf_counter() - started)
+            self.metrics.inc("points_received", len(data))
+            for route in routes:
+                self._deliver_route(route, client, userdata, data)
+            return
+        selected: Dict[Route, List[Influx_Data]] = {route: [] for route in routes}
+        decoded = 0
+        for number, line in iter_lines(payload):
+            try:
+                measurement, tag_set = parse_header(line)
+                takers = [route for route in routes if route.accepts(measurement, tag_set)]
+                if takers:
+                    point = parse_line(line)
+            except ValueError as error:
+                raise LineProtocolError(f"line {number}: {error}") from None
+            decoded += 1
+            for route in takers:
+                selected[route].append(point)
+        self.metrics.observe("decode_seconds", time.perf_counter() - started)
+        self.metrics.inc("points_received", decoded)
+        for route, points in selected.items():
+            if points:
+                self._deliver_route(
+                    route, client, userdata, InfluxBatch.from_points(points) if self.columnar else points
+                )
+
+    def _deliver(self, context: Context, data: Union[bytes, List[Influx_Data], InfluxBatch]):
+        """Private method called by the workers with what their decode step returned
+
+        Args:
+            context (Tuple[Any, Any, List[Route], str | None]): MQTT client, userdata,
+                matching routes and content type
+            data (bytes | List[Influx_Data] | InfluxBatch): raw payload or records of one payload
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            self._dispatch(context, data)
+            return
+        client, userdata, routes, _ = context
+        self.metrics.inc("points_received", len(data))
+        for route in routes:
+            if route.filtered:
+                points = [point for point in data if route.accepts(point.measurement, point.tag_set)]
+                if not points:
+                    continue
+                self._deliver_route(
+                    route, client, userdata, InfluxBatch.from_points(points) if self.columnar else points
+                )
+            else:
+                self._deliver_route(route, client, userdata, data)
+
+    def _deliver_route(self, route: Route, client, userdata, data: Union[List[Influx_Data], InfluxBatch]):
+        """Private method calling the handler of a route with decoded data
+
+        Args:
+            route (Route): route the data is for
+            client (Any): MQTT client
+            userdata (Any): Userdata
+            data (List[Influx_Data] | InfluxBatch): records of one payload
+        """
+        started = time.perf_counter()
+        if self.columnar or self.batch_callback or isinstance(route.handler, Aggregator):
+            route.handler(client, userdata, data)
+        else:
+            for point in data:
+                route.handler(client, userdata, point)
+        self.metrics.observe("callback_seconds", time.perf_counter() - started)
@@ -0,0 +1,152 @@
+import datetime
+import math
+import time
+from functools import lru_cache
+from typing import Union
+
+PRECISIONS = {"ns": 1, "us": 10**3, "ms": 10**6, "s": 10**9}
+"""Nanoseconds per unit for every precision accepted by the line protocol"""
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+Timestamp = Union[int, float, str, datetime.datetime, None]
+
+
+class InvalidTimestamp(ValueError):
+    """Raised when a value cannot be turned into a timestamp"""
+
+
+def to_nanoseconds(value: Timestamp) -> int:
+    """Convert a timestamp to exact integer nanoseconds since the epoch.
+
+    Args:
+        value (int|float|str|Datetime|None): int nanoseconds, float seconds, a datetime,
+            a "YYYY-MM-DD HH:MM:SS[.ffffff]" or ISO 8601 string, or None for now.
+            Naive datetimes and strings without an offset are read as local time.
+
+    Raises:
+        InvalidTimestamp: when the value has an unsupported type or format
+
+    Returns:
+        int: nanoseconds since the epoch
+    """
+    kind = type(value)
+    if kind is int:
+        return value
+    if kind is float:
+        if not math.isfinite(value):
+            raise InvalidTimestamp(f"{value!r} is not a valid timestamp, it must be a finite number")
+        seconds = int(value)
+        return seconds * 10**9 + round((value - seconds) * 10**9)
+    if kind is str:
+        return _parse_string(value)
+    if isinstance(value, datetime.datetime):
+        return _from_datetime(value)
+    if value is None:
+        return time.time_ns()
+    raise InvalidTimestamp(f"{value!r} is not a valid timestamp, use int ns, float seconds, str or datetime")
+
+
+def to_precision(value: Timestamp, precision: str = "ns") -> int:
+    """Convert a timestamp to an integer in the given line protocol precision
+
+    Args:
+        value (int|float|str|Datetime|None): see to_nanoseconds
+        precision (str, optional): one of "s", "ms", "us", "ns". Defaults to "ns".
+
+    Raises:
+        InvalidTimestamp: when the value or the precision is invalid
+
+    Returns:
+        int: time since the epoch in units of precision
+    """
+    try:
+        factor = PRECISIONS[precision]
+    except KeyError:
+        raise InvalidTimestamp(f"{precision!r} is not a valid precision, use one of {list(PRECISIONS)}") from None
+    return to_nanoseconds(value) // factor
+
+
+def _from_datetime(value: datetime.datetime) -> int:
+    """Private function to convert a datetime without going through float seconds"""
+    if value.tzinfo is None:
+        return int(value.replace(microsecond=0).timestamp()) * 10**9 + value.microsecond * 1000
+    return (value - _EPOCH) // _MICROSECOND * 1000
+
+
+@lru_cache(maxsize=512)
+def _hour_start(date: str, hour: str, utc: bool) -> int:
+    """Private function returning the epoch seconds of the start of an hour.
+    Cached so consecutive timestamps only parse the date once.
+
+    Args:
+        date (str): "YYYY-MM-DD"
+        hour (str): "HH"
+        utc (bool): read the hour as UTC instead of local time
+    """
+    start = datetime.datetime(int(date[:4]), int(date[5:7]), int(date[8:10]), int(hour))
+    if utc:
+        start = start.replace(tzinfo=datetime.timezone.utc)
+    return int(start.timestamp())
+
+
+def _parse_string(text: str) -> int:
+    """Private function parsing "YYYY-MM-DD HH:MM:SS[.f][Z|+HH:MM]" by hand,
+    other ISO 8601 forms go through datetime.fromisoformat."""
+    text = text.strip()
+    if (
+        len(text) < 19
+        or text[4] != "-"
+        or text[7] != "-"
+        or text[10] not in " T"
+        or text[13] != ":"
+        or text[16] != ":"
+        or not (text[14:16] + text[17:19]).isdigit()
+    ):
+        return _parse_fallback(text)
+    minute = int(text[14:16])
+    second = int(text[17:19])
+    if minute > 59 or second > 59:
+        raise InvalidTimestamp(f"{text} is not a valid timestamp, minute or second out of range")
+
+    rest = text[19:]
+    fraction = 0
+    if rest[:1] in (".", ","):
+        end = 1
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        digits = rest[1:end]
+        if not digits:
+            return _parse_fallback(text)
+        fraction = int(digits[:9].ljust(9, "0"))
+        rest = rest[end:]
+
+    offset = 0
+    if rest in ("Z", "z", "+00:00", "-00:00"):
+        utc = True
+    elif not rest:
+        utc = False
+    elif len(rest) == 6 and rest[0] in "+-" and rest[3] == ":" and (rest[1:3] + rest[4:6]).isdigit():
+        utc = True
+        offset = int(rest[1:3]) * 3600 + int(rest[4:6]) * 60
+        if rest[0] == "+":
+            offset = -offset
+    else:
+        return _parse_fallback(text)
+
+    try:
+        start = _hour_start(text[:10], text[11:13], utc)
+    except ValueError:
+        return _parse_fallback(text)
+    return (start + minute * 60 + second + offset) * 10**9 + fraction
+
+
+def _parse_fallback(text: str) -> int:
+    """Private function for strings the fast parser does not handle"""
+    try:
+        return _from_datetime(datetime.datetime.fromisoformat(text))
+    except ValueError:
+        raise InvalidTimestamp(
+            f"{text} is not a valid timestamp \nThe correct format is YYYY-MM-DD HH:MM:SS.SSS\nPlease try this or use a datetime object"
+        ) from None
@@ -8,4 +8,5 @@ setup(
     packages=["influx_line_mqtt"],
     install_requires=["paho-mqtt<2.0",
 'influx-line-protocol @ git+https://github.com/mbhewitt/influx-line-protocol#egg=influx-line-protocol'],
+    extras_require={"numpy": ["numpy"], "zstd": ["zstandard"]},
 )
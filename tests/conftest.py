@@ -0,0 +1,115 @@
+import socket
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from benchmarks.broker import StandInBroker
+from influx_line_mqtt.client import Client
+
+
+def free_port() -> int:
+    """Return a port nothing listens on, for brokers started later in a test"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _Info:
+    rc = 0
+    mid = 0
+
+
+class _RecordingMqtt:
+    """Stands in for paho, recording every publish and yielding the GIL while doing so"""
+
+    _max_inflight_messages = 20
+
+    def __init__(self):
+        self.published = []
+        self._out_messages = {}
+
+    def publish(self, topic, payload, qos, properties=None):
+        time.sleep(0.0001)
+        self.published.append((topic, payload))
+        return _Info
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+
+class OfflineClient(Client):
+    """A Client publishing to a _RecordingMqtt instead of a broker"""
+
+    def _connect(self, broker="localhost", port=1883):
+        self.client = _RecordingMqtt()
+
+
+@pytest.fixture
+def broker():
+    broker = StandInBroker()
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+class Collector:
+    """A plain paho subscriber keeping every payload it receives"""
+
+    def __init__(self, port: int, topic: str = "#", client_id: str = "collector"):
+        self.payloads = []
+        self._lock = threading.Lock()
+        subscribed = threading.Event()
+        self.client = mqtt.Client(client_id)
+        self.client.on_connect = lambda client, userdata, flags, rc: client.subscribe(topic, qos=1)
+        self.client.on_subscribe = lambda client, userdata, mid, granted: subscribed.set()
+        self.client.on_message = self._on_message
+        self.client.connect("127.0.0.1", port)
+        self.client.loop_start()
+        assert subscribed.wait(5), "collector did not subscribe"
+
+    def _on_message(self, client, userdata, message):
+        with self._lock:
+            self.payloads.append(message.payload)
+
+    def lines(self):
+        with self._lock:
+            return [line for payload in self.payloads for line in payload.split(b"\n")]
+
+    def wait_lines(self, count: int, timeout: float = 10.0):
+        deadline = time.monotonic() + timeout
+        while len(self.lines()) < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.lines()
+
+    def stop(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+def start_subscriber(sub, broker, filters: int = 1) -> threading.Thread:
+    """Run Subscriber.start on a thread until the broker holds its subscriptions"""
+    thread = threading.Thread(target=sub.start, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if sum(len(session.subscriptions) for session in list(broker.sessions)) >= filters:
+            return thread
+        time.sleep(0.01)
+    raise AssertionError("subscriber did not subscribe")
+
+
+def publish(port: int, messages, qos: int = 1):
+    """Publish (topic, payload) pairs with a plain paho client and wait until they are acknowledged"""
+    client = mqtt.Client("publisher")
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    infos = [client.publish(topic, payload, qos=qos) for topic, payload in messages]
+    for info in infos:
+        info.wait_for_publish(5)
+    client.loop_stop()
+    client.disconnect()
@@ -0,0 +1,224 @@
+import random
+import threading
+import time
+
+import pytest
+
+from influx_line_mqtt.aggregate import FUNCS, Aggregator, parse_duration
+from influx_line_mqtt.parser import parse, parse_columnar
+from influx_line_mqtt.subscriber import Subscriber
+
+from .conftest import publish, start_subscriber
+
+
+@pytest.mark.parametrize("value, nanoseconds", [
+    ("10s", 10 * 10**9),
+    ("500ms", 500 * 10**6),
+    ("1.5m", 90 * 10**9),
+    (" 2 h ", 2 * 3600 * 10**9),
+    ("1d", 86400 * 10**9),
+    ("250us", 250 * 10**3),
+    ("7ns", 7),
+    (2, 2 * 10**9),
+    (0.5, 5 * 10**8),
+])
+def test_parse_duration(value, nanoseconds):
+    assert parse_duration(value) == nanoseconds
+
+
+@pytest.mark.parametrize("value", ["10", "s", "1w", "-1s", True, None])
+def test_parse_duration_rejects(value):
+    with pytest.raises(ValueError):
+        parse_duration(value)
+
+
+def test_invalid_options():
+    with pytest.raises(ValueError):
+        Aggregator(None, funcs=["median"])
+    with pytest.raises(ValueError):
+        Aggregator(None, funcs=[])
+    with pytest.raises(ValueError):
+        Aggregator(None, precision="m")
+
+
+class _Emitted:
+    """emit callback keeping every aggregated record"""
+
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, client, userdata, records):
+        self.records.extend(records)
+
+
+def _feed(aggregator, lines):
+    aggregator(None, None, parse("\n".join(lines)))
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_windows_close_at_the_watermark(vectorized):
+    emitted = _Emitted()
+    aggregator = Aggregator(emitted, window="10ns", funcs=["count", "sum"], watermark="5ns", vectorized=vectorized)
+    _feed(aggregator, ["m v=1i 1", "m v=2i 9"])
+    _feed(aggregator, ["m v=4i 12"])
+    # 12 - 5 has not passed the end of [0, 10)
+    assert emitted.records == []
+    _feed(aggregator, ["m v=8i 15"])
+    assert [(r.timestamp, r.field_set) for r in emitted.records] == [(0, {"v_count": 2, "v_sum": 3})]
+    # [0, 10) was emitted, [10, 20) is still open
+    _feed(aggregator, ["m v=16i 3", "m v=32i 19"])
+    assert aggregator.metrics.snapshot()["points_late"] == 1
+    aggregator.flush()
+    assert [(r.timestamp, r.field_set) for r in emitted.records] == [
+        (0, {"v_count": 2, "v_sum": 3}), (10, {"v_count": 3, "v_sum": 44}),
+    ]
+    stats = aggregator.metrics.snapshot()
+    assert stats["points_aggregated"] == 5
+    assert stats["aggregates_emitted"] == 2
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_series_and_group_by(vectorized):
+    lines = [
+        "m,room=bed,floor=1 v=1 1",
+        "m,floor=1,room=bed v=2 2",
+        "m,room=bath,floor=1 v=4 3",
+        "m,floor=2 v=8 4",
+        "other,room=bed v=16 5",
+    ]
+    emitted = _Emitted()
+    aggregator = Aggregator(emitted, window="1s", funcs=["sum"], vectorized=vectorized)
+    _feed(aggregator, lines)
+    aggregator.flush()
+    assert sorted((r.measurement, sorted(r.tag_set.items()), r.field_set["v_sum"]) for r in emitted.records) == [
+        ("m", [("floor", "1"), ("room", "bath")], 4.0),
+        ("m", [("floor", "1"), ("room", "bed")], 3.0),
+        ("m", [("floor", "2")], 8.0),
+        ("other", [("room", "bed")], 16.0),
+    ]
+    emitted = _Emitted()
+    aggregator = Aggregator(emitted, window="1s", funcs=["sum"], group_by=["room"], vectorized=vectorized)
+    _feed(aggregator, lines)
+    aggregator.flush()
+    assert sorted((r.measurement, sorted(r.tag_set.items()), r.field_set["v_sum"]) for r in emitted.records) == [
+        ("m", [], 8.0), ("m", [("room", "bath")], 4.0), ("m", [("room", "bed")], 3.0), ("other", [("room", "bed")], 16.0),
+    ]
+
+
+def _random_lines(seed, count=2000):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        tags = [f"room={rng.choice(['bed', 'bath', 'hall'])}"]
+        if rng.random() < 0.8:
+            tags.append(f"floor={rng.randint(1, 3)}")
+        rng.shuffle(tags)
+        fields = []
+        if rng.random() < 0.9:
+            fields.append(f"temp={rng.uniform(-10, 30)!r}")
+        if rng.random() < 0.5:
+            fields.append(f"n={rng.randint(-5, 5)}i")
+        if rng.random() < 0.3:
+            # a field sent as int and as float
+            fields.append(rng.choice([f"mixed={rng.randint(0, 9)}i", f"mixed={rng.random()!r}"]))
+        fields.append(rng.choice(["ok=t", 'note="x"']))
+        measurement = rng.choice(["temp", "temp", "climate"])
+        timestamp = i * 3 + rng.randint(0, 2)
+        lines.append(f"{measurement},{','.join(tags)} {','.join(fields)} {timestamp}")
+    return lines
+
+
+def _normalized(records):
+    return {
+        (record.timestamp, record.measurement, tuple(sorted(record.tag_set.items()))): record.field_set
+        for record in records
+    }
+
+
+@pytest.mark.parametrize("group_by", [None, ["room"]])
+def test_incremental_and_vectorized_results_match(group_by):
+    lines = _random_lines(7)
+    chunks = [lines[start:start + 150] for start in range(0, len(lines), 150)]
+    results = []
+    for vectorized, columnar in ((False, False), (True, False), (True, True)):
+        emitted = _Emitted()
+        aggregator = Aggregator(emitted, window="50ns", funcs=FUNCS, group_by=group_by,
+                                watermark="20ns", vectorized=vectorized)
+        for chunk in chunks:
+            payload = "\n".join(chunk)
+            aggregator(None, None, parse_columnar(payload) if columnar else parse(payload))
+        aggregator.flush()
+        results.append(_normalized(emitted.records))
+    expected = results[0]
+    assert len(expected) > 100
+    assert any("mixed_sum" in fields for fields in expected.values())
+    assert not any("ok_count" in fields or "note_count" in fields for fields in expected.values())
+    for result in results[1:]:
+        assert result.keys() == expected.keys()
+        for key, fields in expected.items():
+            assert result[key] == pytest.approx(fields), key
+
+
+def test_fields_limits_what_is_aggregated():
+    emitted = _Emitted()
+    aggregator = Aggregator(emitted, window="1s", fields=["temp"], funcs=["max"])
+    _feed(aggregator, ["m temp=1,rh=40 1", "m temp=3,rh=50 2"])
+    aggregator.flush()
+    assert [r.field_set for r in emitted.records] == [{"temp_max": 3.0}]
+
+
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_concurrent_handlers_emit_windows_in_order(vectorized):
+    emitted = []
+    clock = iter(range(1, 10**6))
+    clock_lock = threading.Lock()
+
+    def emit(client, userdata, records):
+        # a slow emit lets the other handlers close newer windows meanwhile
+        time.sleep(random.random() / 1000)
+        emitted.extend((userdata, record.timestamp) for record in records)
+
+    aggregator = Aggregator(emit, window="1ns", funcs=["count"], vectorized=vectorized)
+
+    def feed():
+        for _ in range(200):
+            with clock_lock:
+                timestamp = next(clock)
+            # the userdata is the timestamp of the record closing the windows
+            aggregator(None, timestamp, parse(f"m v=1i {timestamp}"))
+
+    threads = [threading.Thread(target=feed) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    aggregator.flush()
+    starts = [start for _, start in emitted]
+    assert starts == sorted(starts)
+    assert len(starts) + aggregator.metrics.snapshot().get("points_late", 0) == 800
+    assert all(start < userdata for userdata, start in emitted[:-1])
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_subscriber_aggregate(broker, columnar):
+    received = []
+    sub = Subscriber("127.0.0.1", "home/#", port=broker.port, client_id=f"agg-{columnar}",
+                     columnar=columnar, batch_callback=True)
+    sub.on_message = lambda client, userdata, data: received.append(data)
+    sub.aggregate(window="10ns", fields=["temp"], funcs=["mean", "count"], group_by=["room"],
+                  qos=1, vectorized=columnar)
+    start_subscriber(sub, broker)
+    publish(broker.port, [
+        ("home/bed", b"climate,room=bed temp=20 1\nclimate,room=bed temp=22 5"),
+        ("home/bath", b"climate,room=bath temp=18 7"),
+        ("home/bed", b"climate,room=bed temp=30 12"),
+        ("home/bath", b"climate,room=bath temp=10 2"),
+    ])
+    deadline = time.monotonic() + 5
+    while sub.stats().get("points_late", 0) < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sub.stop()
+    records = [record for data in received for record in data]
+    assert sorted((r.timestamp, r.tag_set["room"], r.field_set["temp_mean"], r.field_set["temp_count"])
+                  for r in records) == [(0, "bath", 18.0, 1), (0, "bed", 21.0, 2), (10, "bed", 30.0, 1)]
+    assert sub.stats()["points_late"] == 1
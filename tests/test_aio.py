@@ -0,0 +1,138 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from influx_line_mqtt.aio import AsyncClient, AsyncSubscriber
+
+from .conftest import free_port
+
+
+async def _collect(sub, count, timeout=10):
+    points = []
+
+    async def read():
+        async for point in sub:
+            points.append(point)
+            if len(points) == count:
+                return
+
+    await asyncio.wait_for(read(), timeout)
+    return points
+
+
+@pytest.mark.parametrize("qos", [0, 1, 2])
+def test_make_send_reaches_async_subscriber(broker, qos):
+    async def run():
+        async with AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id=f"sub-{qos}", qos=qos) as sub:
+            await asyncio.sleep(0.2)
+            client = AsyncClient("127.0.0.1", broker.port, client_id=f"pub-{qos}", qos=qos)
+            await client.connect()
+            for i in range(20):
+                await client.make_send("home/bed", {"room": "bed"}, {"temp": 20.5, "n": i}, i + 1, "temp")
+            points = await _collect(sub, 20)
+            await client.close()
+        return points
+
+    points = asyncio.run(run())
+    assert [point.field_set["n"] for point in points] == list(range(20))
+    assert points[0].measurement == "temp"
+    assert points[0].tag_set == {"room": "bed"}
+    assert points[0].timestamp == 1
+
+
+def test_batched_make_send_is_flushed_on_close(broker):
+    async def run():
+        async with AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id="sub-batch") as sub:
+            await asyncio.sleep(0.2)
+            client = AsyncClient("127.0.0.1", broker.port, client_id="pub-batch", qos=1, batch=True, linger_ms=10000)
+            await client.connect()
+            for i in range(5):
+                await client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+            await client.close()
+            return await _collect(sub, 5)
+
+    assert [point.field_set["n"] for point in asyncio.run(run())] == list(range(5))
+
+
+def test_reading_pauses_at_maxsize_and_resumes(broker):
+    async def run():
+        async with AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id="sub-slow", maxsize=10) as sub:
+            await asyncio.sleep(0.2)
+            client = AsyncClient("127.0.0.1", broker.port, client_id="pub-fast", qos=1)
+            await client.connect()
+            for i in range(40):
+                await client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+            for _ in range(100):
+                if sub._helper._paused:
+                    break
+                await asyncio.sleep(0.01)
+            assert sub._helper._paused
+            await asyncio.sleep(0.1)
+            assert sub._queue.qsize() == 10
+            points = await _collect(sub, 6)
+            assert not sub._helper._paused
+            points += await _collect(sub, 34)
+            await client.close()
+            return points
+
+    assert [point.field_set["n"] for point in asyncio.run(run())] == list(range(40))
+
+
+def test_connect_does_not_block_the_loop():
+    async def run():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.ensure_future(tick())
+        client = AsyncClient("127.0.0.1", free_port(), client_id="pub-refused")
+        with pytest.raises(OSError):
+            await client.connect()
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(run()) > 0
+
+
+def test_async_for_ends_after_close(broker):
+    async def run():
+        sub = AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id="sub-close", qos=1)
+        await sub.start()
+        await asyncio.sleep(0.2)
+        points = []
+
+        async def consume():
+            async for point in sub:
+                points.append(point)
+
+        consumer = asyncio.ensure_future(consume())
+        client = AsyncClient("127.0.0.1", broker.port, client_id="pub-close", qos=1)
+        await client.connect()
+        for i in range(3):
+            await client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+        while len(points) < 3:
+            await asyncio.sleep(0.01)
+        await client.close()
+        await sub.close()
+        await asyncio.wait_for(consumer, 5)
+        with pytest.raises(StopAsyncIteration):
+            await sub.__anext__()
+        return points
+
+    assert [point.field_set["n"] for point in asyncio.run(run())] == [0, 1, 2]
+
+
+def test_async_for_ends_when_a_reconnect_is_refused(broker):
+    async def run():
+        async with AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id="sub-refused") as sub:
+            # what paho reports when the broker refuses the session on reconnect
+            sub._on_connect(sub.client, None, {}, mqtt.CONNACK_REFUSED_NOT_AUTHORIZED)
+            assert sub._helper.closing
+            return [point async for point in sub]
+
+    assert asyncio.run(run()) == []
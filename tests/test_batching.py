@@ -0,0 +1,70 @@
+import threading
+import time
+
+from .conftest import OfflineClient
+
+
+def test_payload_stays_within_max_bytes():
+    client = OfflineClient("localhost", 1883, qos=0, batch=True, max_bytes=100, linger_ms=10000)
+    line = b"m,room=bed temp=1.5 " + b"1" * 19
+    for _ in range(20):
+        client._send_line("home", line, batch=True)
+    client.flush()
+    payloads = [payload for _, payload in client.client.published]
+    assert all(len(payload) <= 100 for payload in payloads)
+    assert b"\n".join(payloads).count(line) == 20
+
+
+def test_single_line_larger_than_max_bytes_is_sent_alone():
+    client = OfflineClient("localhost", 1883, qos=0, batch=True, max_bytes=10, linger_ms=10000)
+    client._send_line("home", b"m f=1 1", batch=True)
+    client._send_line("home", b"m f=1234567890 2", batch=True)
+    client.flush()
+    assert [payload for _, payload in client.client.published] == [b"m f=1 1", b"m f=1234567890 2"]
+
+
+def test_batches_of_a_topic_keep_their_order_across_threads():
+    client = OfflineClient("localhost", 1883, qos=0, batch=True, max_lines=7, linger_ms=1)
+    counter = iter(range(10**9))
+    lock = threading.Lock()
+
+    def send():
+        for _ in range(300):
+            with lock:
+                line = f"m n={next(counter)}i".encode()
+                client._send_line("home", line, batch=True)
+            if next(counter) % 5 == 0:
+                client.flush()
+
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    client.flush()
+    sent = [int(line[4:-1]) for _, payload in client.client.published for line in payload.split(b"\n")]
+    assert len(sent) == 1200
+    assert sent == sorted(sent)
+
+
+def test_linger_flushes_every_topic_from_one_thread():
+    client = OfflineClient("localhost", 1883, qos=0, batch=True, linger_ms=50)
+    threads = threading.active_count()
+    started = time.monotonic()
+    for i in range(50):
+        client._send_line(f"home/{i}", b"m f=1 1", batch=True)
+    assert threading.active_count() <= threads + 1
+    assert client.client.published == []
+    deadline = time.monotonic() + 5
+    while len(client.client.published) < 50 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert time.monotonic() - started >= 0.05
+    assert sorted(topic for topic, _ in client.client.published) == sorted(f"home/{i}" for i in range(50))
+    # a topic flushed early does not get flushed again by its old deadline
+    client._send_line("home/0", b"m f=2 2", batch=True)
+    client._send_line("home/1", b"m f=3 3", batch=True)
+    client._flush_topic("home/0")
+    time.sleep(0.1)
+    assert client.client.published[50:] == [("home/0", b"m f=2 2"), ("home/1", b"m f=3 3")]
+    client.close()
+    assert not client._linger_thread.is_alive()
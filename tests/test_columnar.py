@@ -0,0 +1,56 @@
+import pytest
+
+from influx_line_mqtt.columnar import InfluxBatch
+from influx_line_mqtt.parser import parse, parse_columnar
+
+PAYLOADS = [
+    b"m f=18446744073709551615u",
+    b"m g=1\nm f=t",
+    b"m c=1i\nm c=2i,d=3\nm d=4",
+    b"m f=1i\nm f=18446744073709551615u\nm f=5i",
+    b"m f=1i\nm f=18446744073709551615u\nm f=-1i",
+    b'm f=1i\nm f=1.5\nm f="s"',
+    b"m f=t\nm f=1i",
+    b'm,room=bed s="a",b=f 1\nm,floor=2 s="b" 2\nm n=1u',
+]
+
+
+def records(points):
+    return [
+        (point.measurement, point.tag_set, [(key, type(value), value) for key, value in point.field_set.items()],
+         point.timestamp)
+        for point in points
+    ]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_batch_returns_what_was_parsed(payload):
+    batch = parse_columnar(payload)
+    assert records(batch) == records(parse(payload))
+    assert records([batch[-1]]) == records(parse(payload)[-1:])
+
+
+def test_column_types():
+    batch = parse_columnar(b"m i=1i,u=18446744073709551615u,f=1.5,b=t,s=\"x\"\nm i=2i")
+    assert {key: getattr(column, "typecode", list) for key, column in batch.fields.items()} == {
+        "i": "q", "u": "Q", "f": "d", "b": "b", "s": list,
+    }
+    assert batch.field_masks["u"] == bytearray(b"\x01\x00")
+    assert "i" not in batch.field_masks
+
+
+def test_from_points_keeps_integer_counts():
+    batch = InfluxBatch.from_points(parse(b"m temp_count=3i\nm temp_mean=2.5"))
+    assert [point.field_set for point in batch] == [{"temp_count": 3}, {"temp_mean": 2.5}]
+
+
+def test_to_numpy_masks_gaps():
+    np = pytest.importorskip("numpy")
+    columns = parse_columnar(b"m,room=bed c=1i 1\nm b=t 2\nm c=3i 3").to_numpy()
+    count, flag = columns["fields"]["c"], columns["fields"]["b"]
+    assert count.dtype == np.int64 and flag.dtype == bool
+    assert count.mask.tolist() == [False, True, False]
+    assert count.compressed().tolist() == [1, 3]
+    assert flag.compressed().tolist() == [True]
+    assert columns["tags"]["room"].tolist() == [0, -1, -1]
+    assert columns["timestamp"].tolist() == [1, 2, 3]
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from influx_line_mqtt import aio, subscriber
+from influx_line_mqtt.aio import AsyncClient, AsyncSubscriber
+from influx_line_mqtt.client import Client
+from influx_line_mqtt.encoding import (
+    CONTENT_TYPE,
+    ENCODINGS,
+    EncodingError,
+    content_type,
+    decode_payload,
+    detect_encoding,
+    encode_payload,
+)
+from influx_line_mqtt.pipeline import DispatchPipeline
+from influx_line_mqtt.subscriber import Subscriber
+
+from .conftest import start_subscriber
+
+
+def _record_content_types(monkeypatch, module):
+    """Wrap decode_payload of a module, returning the content types it is called with"""
+    seen = []
+
+    def record(payload, content_type=None):
+        seen.append(content_type)
+        return decode_payload(payload, content_type)
+
+    monkeypatch.setattr(module, "decode_payload", record)
+    return seen
+
+LINES = b"temp,room=bed temp=20.5 1\ntemp,room=bath temp=21.5 2\nhumidity,room=bed rh=40i 3"
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_payloads_round_trip_with_and_without_content_type(encoding):
+    payload = encode_payload(LINES, encoding)
+    assert detect_encoding(payload) == encoding
+    assert decode_payload(payload) == LINES
+    assert decode_payload(payload, content_type(encoding)) == LINES
+
+
+def test_content_type_wins_over_the_first_bytes():
+    # "x " passes the zlib header check
+    line = b"x f=1 1"
+    assert detect_encoding(line) == "zlib"
+    assert detect_encoding(line, CONTENT_TYPE) == "identity"
+    assert decode_payload(line, CONTENT_TYPE) == line
+    with pytest.raises(EncodingError):
+        decode_payload(line, content_type("zlib"))
+
+
+def test_spilled_payloads_keep_their_content_type(tmp_path):
+    seen = []
+    gate = threading.Event()
+
+    def decode(payload, content_type):
+        gate.wait()
+        return decode_payload(payload, content_type)
+
+    pipeline = DispatchPipeline(
+        decode, lambda context, data: seen.append((context, data)), workers=1, queue_size=1,
+        overflow="spill", spill_dir=str(tmp_path), restore=lambda key, content_type: content_type,
+    )
+    pipeline.start()
+    for i in range(5):
+        assert pipeline.submit("t", zlib.compress(b"x f=%di %d" % (i, i)), content_type("zlib"), content_type("zlib"))
+    assert pipeline.submit("t", b"x f=5i 5", CONTENT_TYPE, CONTENT_TYPE)
+    assert pipeline.stats()["spilled"] >= 4
+    gate.set()
+    pipeline.stop()
+    assert [data for _, data in seen] == [b"x f=%di %d" % (i, i) for i in range(6)]
+    assert [context for context, _ in seen] == [content_type("zlib")] * 5 + [CONTENT_TYPE]
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_subscriber_reads_the_content_type_over_mqtt_v5(broker, workers, monkeypatch):
+    content_types = _record_content_types(monkeypatch, subscriber)
+    received = []
+    sub = Subscriber(
+        "127.0.0.1", "home/#", port=broker.port, client_id=f"sub-v5-{workers}", workers=workers,
+        protocol=mqtt.MQTTv5, batch_callback=True,
+    )
+    sub.on_message = lambda client, userdata, data: received.extend(data)
+    start_subscriber(sub, broker)
+    plain = Client("127.0.0.1", broker.port, client_id="pub-plain", qos=1, protocol=mqtt.MQTTv5)
+    packed = Client("127.0.0.1", broker.port, client_id="pub-zlib", qos=1, protocol=mqtt.MQTTv5,
+                    batch=True, encoding="zlib")
+    # sniffed as zlib without the content type
+    plain.make_send("home/x", {}, {"f": 1}, 1, "x")
+    for i in range(3):
+        packed.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 2, "temp")
+    packed.flush()
+    deadline = time.monotonic() + 5
+    while len(received) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    plain.close()
+    packed.close()
+    sub.stop()
+    assert sorted((point.measurement, point.timestamp) for point in received) == [
+        ("temp", 2), ("temp", 3), ("temp", 4), ("x", 1),
+    ]
+    assert sorted(content_types) == [CONTENT_TYPE, content_type("zlib")]
+
+
+def test_async_subscriber_reads_the_content_type_over_mqtt_v5(broker, monkeypatch):
+    content_types = _record_content_types(monkeypatch, aio)
+    async def run():
+        async with AsyncSubscriber("127.0.0.1", "home/#", port=broker.port, client_id="async-v5",
+                                   qos=1, protocol=mqtt.MQTTv5) as sub:
+            await asyncio.sleep(0.2)
+            client = AsyncClient("127.0.0.1", broker.port, client_id="async-pub-v5", qos=1,
+                                 protocol=mqtt.MQTTv5)
+            await client.connect()
+            await client.make_send("home/x", {}, {"f": 1}, 1, "x")
+            point = await asyncio.wait_for(sub.__anext__(), 5)
+            await client.close()
+        return point
+
+    point = asyncio.run(run())
+    assert (point.measurement, point.field_set, point.timestamp) == ("x", {"f": 1.0}, 1)
+    assert content_types == [CONTENT_TYPE]
@@ -0,0 +1,169 @@
+import time
+import urllib.request
+
+import pytest
+
+from influx_line_mqtt.client import Client
+from influx_line_mqtt.metrics import Histogram, Metrics, start_prometheus_server
+from influx_line_mqtt.subscriber import Subscriber
+
+from .conftest import OfflineClient, start_subscriber
+
+
+def test_snapshot_reports_counters_and_histograms():
+    metrics = Metrics()
+    metrics.inc("points")
+    metrics.inc("points", 4)
+    metrics.add(points=1, bytes=10)
+    for seconds in (0.001, 0.003):
+        metrics.observe("encode_seconds", seconds)
+    metrics.observe("encode_seconds", 0.002, count=2)
+    stats = metrics.snapshot()
+    assert stats["points"] == 6
+    assert stats["bytes"] == 10
+    assert stats["encode_seconds_count"] == 4
+    assert stats["encode_seconds_sum"] == pytest.approx(0.008)
+    assert stats["encode_seconds_mean"] == pytest.approx(0.002)
+    assert stats["encode_seconds_max"] == 0.003
+    assert 0.001 <= stats["encode_seconds_p50"] <= stats["encode_seconds_p99"] <= 0.003
+
+
+def test_quantiles_interpolate_inside_buckets():
+    histogram = Histogram(buckets=(1.0, 2.0, 4.0, 8.0))
+    assert histogram.quantile(0.5) == 0.0
+    for _ in range(10):
+        histogram.observe(1.5)
+    histogram.observe(3.0, count=10)
+    # 10 values in (1, 2] and 10 in (2, 4]
+    assert histogram.counts == [0, 10, 10, 0, 0]
+    assert histogram.quantile(0.5) == pytest.approx(2.0)
+    assert histogram.quantile(0.6) == pytest.approx(2.4)
+    assert histogram.quantile(0.25) == pytest.approx(1.5)
+    # never past the largest value seen
+    assert histogram.quantile(0.99) == 3.0
+    histogram.observe(100.0)
+    assert histogram.counts[-1] == 1
+    assert histogram.quantile(1.0) == 100.0
+
+
+def test_merged_adds_counters_and_buckets():
+    first, second = Metrics(), Metrics()
+    first.inc("messages", 2)
+    second.inc("messages", 3)
+    first.observe("ack_seconds", 0.001)
+    second.observe("ack_seconds", 0.5)
+    stats = Metrics.merged([first, second]).snapshot()
+    assert stats["messages"] == 5
+    assert stats["ack_seconds_count"] == 2
+    assert stats["ack_seconds_max"] == 0.5
+    assert first.snapshot()["messages"] == 2
+
+
+def _prometheus_values(text):
+    values = {}
+    for line in text.splitlines():
+        if not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            values[name] = float(value)
+    return values
+
+
+def test_prometheus_text():
+    metrics = Metrics()
+    metrics.inc("points", 7)
+    for seconds in (1.5e-6, 3e-6, 3e-6, 1.0):
+        metrics.observe("decode_seconds", seconds)
+    text = metrics.prometheus("app", {"inflight": 3})
+    assert "# TYPE app_points_total counter" in text
+    assert "# TYPE app_decode_seconds histogram" in text
+    assert "# TYPE app_inflight gauge" in text
+    values = _prometheus_values(text)
+    assert values["app_points_total"] == 7
+    assert values["app_inflight"] == 3
+    assert values["app_decode_seconds_count"] == 4
+    assert values["app_decode_seconds_sum"] == pytest.approx(1.0000075)
+    buckets = [(name, value) for name, value in values.items() if name.startswith("app_decode_seconds_bucket")]
+    counts = [value for _, value in buckets]
+    assert counts == sorted(counts)
+    assert values['app_decode_seconds_bucket{le="1e-06"}'] == 0
+    assert values['app_decode_seconds_bucket{le="2e-06"}'] == 1
+    assert values['app_decode_seconds_bucket{le="4e-06"}'] == 3
+    assert buckets[-1] == ('app_decode_seconds_bucket{le="+Inf"}', values["app_decode_seconds_count"])
+
+
+def test_prometheus_server_serves_every_source():
+    server = start_prometheus_server(0, lambda: "a_total 1\n", lambda: "b_total 2\n", address="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert response.read() == b"a_total 1\nb_total 2\n"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class _EarlyAckMqtt:
+    """Stands in for paho, reporting the message as published before publish returns"""
+
+    _max_inflight_messages = 20
+
+    def __init__(self, client):
+        self.owner = client
+        self._out_messages = {}
+        self.mid = 0
+
+    def publish(self, topic, payload, qos, properties=None):
+        self.mid += 1
+        self.owner._on_publish(self, None, self.mid)
+
+        class Info:
+            rc = 0
+            mid = self.mid
+        return Info
+
+
+def test_ack_reported_before_publish_returns_is_timed():
+    client = OfflineClient("localhost", 1883, qos=0)
+    client.client = _EarlyAckMqtt(client)
+    for i in range(3):
+        client.make_send("home", {"room": "bed"}, {"n": i}, i + 1, "temp")
+    stats = client.stats()
+    assert stats["publish_ack_seconds_count"] == 3
+    assert stats["publish_ack_seconds_max"] >= 0
+    assert client._early_acks == {}
+    assert client._publish_times == {}
+
+
+@pytest.mark.parametrize("qos", [0, 1, 2])
+def test_stats_through_the_broker(broker, qos):
+    received = []
+    sub = Subscriber("127.0.0.1", "home/#", port=broker.port, client_id=f"stats-sub-{qos}",
+                     batch_callback=True)
+    sub.on_message = lambda client, userdata, data: received.extend(data)
+    start_subscriber(sub, broker)
+    client = Client("127.0.0.1", broker.port, client_id=f"stats-pub-{qos}", qos=qos, batch=True, max_lines=5)
+    for i in range(10):
+        client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+    client.flush()
+    deadline = time.monotonic() + 5
+    while (len(received) < 10 or client.stats().get("publish_ack_seconds_count", 0) < 2) \
+            and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sent = client.stats()
+    client.close()
+    sub.stop()
+    got = sub.stats()
+    assert sent["points_published"] == 10
+    assert sent["messages_published"] == 2
+    assert sent["bytes_published"] > 0
+    assert sent["encode_seconds_count"] == 10
+    assert sent["publish_ack_seconds_count"] == 2
+    assert sent["inflight"] == 0
+    assert sent["buffered_lines"] == 0
+    assert got["messages_received"] == 2
+    assert got["points_received"] == 10
+    assert got["bytes_received"] == sent["bytes_published"]
+    assert got["decode_seconds_count"] == 2
+    assert got["callback_seconds_count"] == 2
+    assert "influx_line_mqtt_client_points_published_total 10" in client.prometheus_text()
@@ -0,0 +1,118 @@
+import pytest
+
+from influx_line_mqtt.parser import LineProtocolError, parse, parse_columnar, parse_header, parse_line
+from influx_line_mqtt.serializer import encode_line, render_prefix
+
+
+def test_plain_line():
+    point = parse_line("weather,location=us-midwest,season=summer temperature=82,humidity=71.5 1465839830100400200")
+    assert point.measurement == "weather"
+    assert point.tag_set == {"location": "us-midwest", "season": "summer"}
+    assert point.field_set == {"temperature": 82.0, "humidity": 71.5}
+    assert point.timestamp == 1465839830100400200
+
+
+def test_timestamp_is_optional():
+    assert parse_line("m f=1").timestamp is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1i", 1),
+    ("-42i", -42),
+    ("18446744073709551615u", 18446744073709551615),
+    ("1.5", 1.5),
+    ("-1e3", -1000.0),
+    ("7", 7.0),
+    ("t", True),
+    ("T", True),
+    ("true", True),
+    ("TRUE", True),
+    ("f", False),
+    ("False", False),
+])
+def test_field_types(value, expected):
+    field = parse_line(f"m v={value}").field_set["v"]
+    assert field == expected
+    assert type(field) is type(expected)
+
+
+def test_quoted_strings():
+    point = parse_line('m s="hello, world =x",q="say \\"hi\\"",b="back\\\\slash",n=1i 5')
+    assert point.field_set == {"s": "hello, world =x", "q": 'say "hi"', "b": "back\\slash", "n": 1}
+    assert point.timestamp == 5
+
+
+def test_escaped_measurement_tags_and_fields():
+    point = parse_line("my\\ meas\\,ure,tag\\ key=tag\\,value,t2=a\\=b field\\ key=1i 10")
+    assert point.measurement == "my meas,ure"
+    assert point.tag_set == {"tag key": "tag,value", "t2": "a=b"}
+    assert point.field_set == {"field key": 1}
+
+
+def test_payload_skips_blank_lines_and_comments():
+    points = parse(b"# header\n\nm f=1 1\r\n  \nm f=2 2\n")
+    assert [point.field_set["f"] for point in points] == [1.0, 2.0]
+    assert [point.timestamp for point in points] == [1, 2]
+
+
+@pytest.mark.parametrize("line", [
+    "m",
+    "m ",
+    ",t=1 f=1",
+    "m,t f=1",
+    "m f",
+    "m f=",
+    "m f=abc",
+    'm s="open',
+    "m f=1 notatime",
+    "m f=nan",
+    "m f=inf",
+    "m f=-Infinity",
+    "m f=1_000",
+    "m f=1_0i",
+    "m f=+-1",
+    "m f=\u0661",
+    "m f=-1u",
+    "m f=1 1_000",
+    'm s="x",f=nan',
+])
+def test_malformed_lines(line):
+    with pytest.raises(LineProtocolError):
+        parse(line.encode())
+
+
+def test_error_names_the_line():
+    with pytest.raises(LineProtocolError, match="line 2"):
+        parse(b"m f=1\nm f")
+
+
+def test_payload_must_be_utf8():
+    with pytest.raises(LineProtocolError):
+        parse(b"m s=\xff")
+
+
+def test_parse_header_does_not_decode_fields():
+    assert parse_header("m,room=bed,floor=1 f=broken") == ("m", {"room": "bed", "floor": "1"})
+    assert parse_header("m\\ x,room=b\\,ed f=1") == ("m x", {"room": "b,ed"})
+
+
+@pytest.mark.parametrize("name", ["a\\b", "a\\", "\\", "a\\\\b", "a\\,b", "a\\ b", "a\\=b"])
+def test_backslashes_round_trip_through_the_serializer(name):
+    line = encode_line(render_prefix(name, ((name, name), ("u", "x"))), {name: "v", "n": 1}, 1)
+    point = parse_line(line.decode())
+    assert point.measurement == name
+    assert point.tag_set == {name: name, "u": "x"}
+    assert point.field_set == {name: "v", "n": 1}
+    assert point.timestamp == 1
+    assert parse_header(line.decode()) == (name, {name: name, "u": "x"})
+
+
+def test_tag_value_ending_in_a_backslash():
+    assert parse_line("m,t=a\\\\,u=x f=1i").tag_set == {"t": "a\\", "u": "x"}
+
+
+def test_repeated_headers_get_their_own_tag_set():
+    first, second = parse(b"m,room=bed f=1 1\nm,room=bed f=2 2")
+    first.tag_set["room"] = "changed"
+    assert second.tag_set == {"room": "bed"}
+    assert parse_columnar(b"m,room=bed f=3 3")[0].tag_set == {"room": "bed"}
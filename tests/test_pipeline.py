@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+from influx_line_mqtt.pipeline import DispatchPipeline
+from influx_line_mqtt.subscriber import _parse_payload
+
+
+class _Recorder:
+    """deliver callback recording what arrives, held back until release is called"""
+
+    def __init__(self):
+        self.delivered = []
+        self.gate = threading.Event()
+        self.called = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, context, data):
+        self.called.set()
+        self.gate.wait()
+        with self.lock:
+            self.delivered.append((context, data))
+
+    def release(self):
+        self.gate.set()
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return condition()
+
+
+def test_capacity_is_shared_by_all_workers():
+    recorder = _Recorder()
+    pipeline = DispatchPipeline(None, recorder, workers=2, queue_size=4, overflow="drop")
+    pipeline.start()
+    accepted = [pipeline.submit("hot/topic", f"{i}".encode()) for i in range(20)]
+    # one payload is held by a worker, the buffer of 4 is shared with the idle worker's shard
+    assert accepted.count(True) in (4, 5)
+    assert pipeline.stats()["queue_depth"] == 4
+    recorder.release()
+    pipeline.stop()
+    assert pipeline.stats()["drops"] == 20 - accepted.count(True)
+
+
+def test_block_waits_for_room():
+    recorder = _Recorder()
+    pipeline = DispatchPipeline(None, recorder, workers=1, queue_size=2, overflow="block")
+    pipeline.start()
+    submitter = threading.Thread(target=lambda: [pipeline.submit("t", b"%d" % i) for i in range(10)])
+    submitter.start()
+    assert _wait_for(lambda: pipeline.stats()["queue_depth"] == 2)
+    time.sleep(0.05)
+    assert submitter.is_alive()
+    recorder.release()
+    submitter.join(5)
+    pipeline.stop()
+    assert [data for _, data in recorder.delivered] == [b"%d" % i for i in range(10)]
+
+
+def test_spill_goes_to_disk_and_keeps_topic_order(tmp_path):
+    recorder = _Recorder()
+    pipeline = DispatchPipeline(
+        None, recorder, workers=3, queue_size=4, overflow="spill",
+        spill_dir=str(tmp_path), restore=lambda key, content_type: ("restored", key),
+    )
+    pipeline.start()
+    for i in range(300):
+        topic = f"t{i % 5}"
+        assert pipeline.submit(topic, f"{topic} {i}".encode(), ("live", topic))
+    stats = pipeline.stats()
+    assert stats["queue_depth"] <= 4
+    assert stats["spilled"] >= 290
+    assert any(tmp_path.iterdir())
+    recorder.release()
+    pipeline.stop()
+    assert len(recorder.delivered) == 300
+    for topic in (f"t{i}" for i in range(5)):
+        received = [data for context, data in recorder.delivered if context[1] == topic]
+        assert received == [f"{topic} {i}".encode() for i in range(300) if f"t{i % 5}" == topic]
+    assert {context[0] for context, _ in recorder.delivered} == {"live", "restored"}
+
+
+def test_spilled_payloads_survive_a_restart(tmp_path):
+    recorder = _Recorder()
+    pipeline = DispatchPipeline(None, recorder, workers=1, queue_size=1, overflow="spill", spill_dir=str(tmp_path))
+    pipeline.start()
+    for i in range(10):
+        pipeline.submit("t", b"%d" % i)
+    assert recorder.called.wait(5)
+    assert _wait_for(lambda: pipeline.stats()["queue_depth"] == 1)
+    # without drain the payload in memory is discarded, the spilled ones stay on disk
+    stopping = threading.Thread(target=pipeline.stop, kwargs={"drain": False})
+    stopping.start()
+    assert _wait_for(lambda: not pipeline._running)
+    recorder.release()
+    stopping.join(5)
+    delivered = [data for _, data in recorder.delivered]
+    assert delivered == [b"0"]
+
+    again = _Recorder()
+    again.release()
+    pipeline = DispatchPipeline(None, again, workers=1, queue_size=1, overflow="spill", spill_dir=str(tmp_path))
+    pipeline.start()
+    assert _wait_for(lambda: len(again.delivered) == 8)
+    pipeline.stop()
+    assert [data for _, data in again.delivered] == [b"%d" % i for i in range(2, 10)]
+
+
+def test_temporary_spill_is_removed_on_stop():
+    recorder = _Recorder()
+    recorder.release()
+    pipeline = DispatchPipeline(None, recorder, workers=2, queue_size=1, overflow="spill")
+    pipeline.start()
+    spill_dir = pipeline._spool_dir
+    for i in range(50):
+        pipeline.submit("t", b"%d" % i)
+    pipeline.stop()
+    assert [data for _, data in recorder.delivered] == [b"%d" % i for i in range(50)]
+    assert not os.path.exists(spill_dir)
+
+
+def test_process_pool_decodes_without_forking():
+    delivered = []
+    pipeline = DispatchPipeline(_parse_payload, lambda context, data: delivered.append(data), workers=2, processes=2)
+    pipeline.start()
+    assert pipeline._executor._mp_context.get_start_method() != "fork"
+    for i in range(10):
+        pipeline.submit("t", b"m n=%di %d" % (i, i))
+    pipeline.stop()
+    assert sorted(point.field_set["n"] for points in delivered for point in points) == list(range(10))
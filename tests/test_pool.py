@@ -0,0 +1,67 @@
+import pytest
+
+from influx_line_mqtt import PooledClient
+from influx_line_mqtt.parser import parse
+
+from .conftest import Collector
+
+POINTS = [
+    ("home/bed", {"room": "bed", "floor": "1"}, {"temp": 0.1 + 0.2, "n": 1}, 1, "temp"),
+    ("home/bed", {"room": "bed", "floor": "1"}, {"temp": 1.2345678901234567e-7, "ok": True}, 2, "temp"),
+    ("home/bath", {"room": "bath"}, {"temp": 123456789.125, "note": 'a "b"'}, 3, "temp"),
+]
+
+
+@pytest.mark.parametrize("processes", [0, 2])
+def test_make_send_and_make_send_many_encode_alike(broker, processes):
+    collector = Collector(broker.port)
+    pool = PooledClient("127.0.0.1", broker.port, client_id="pool", qos=1, sessions=2, processes=processes)
+    for point in POINTS:
+        pool.make_send(*point)
+    lines = collector.wait_lines(len(POINTS))
+    assert pool.make_send_many(POINTS) == len(POINTS)
+    lines = collector.wait_lines(2 * len(POINTS))
+    stats = pool.stats()
+    pool.close()
+    collector.stop()
+    assert sorted(lines[:len(POINTS)]) == sorted(lines[len(POINTS):])
+    assert sorted(point.field_set["temp"] for point in parse(b"\n".join(lines))) == sorted(
+        2 * [values["temp"] for _, _, values, _, _ in POINTS]
+    )
+    assert stats["encode_seconds_count"] == 2 * len(POINTS)
+
+
+def test_tag_order_does_not_split_a_series(broker):
+    pool = PooledClient("127.0.0.1", broker.port, client_id="pool-order", qos=1, sessions=4)
+    for i in range(4):
+        pool.make_send("home", {"room": "bed", "floor": "1"}, {"n": i}, i + 1, "temp")
+        pool.make_send("home", {"floor": "1", "room": "bed"}, {"n": i}, i + 1, "temp")
+    stats = pool.stats()
+    pool.close()
+    assert stats["shard_keys"] == 1
+    assert [session.get("points_published", 0) for session in stats["per_session"]].count(8) == 1
+
+
+def test_shard_assignments_are_bounded(broker):
+    pool = PooledClient("127.0.0.1", broker.port, client_id="pool-bound", qos=0, sessions=2, max_shard_keys=3)
+    keys = [pool._key(f"home/{i}", {"room": "bed"}, "temp") for i in range(5)]
+    for key in keys[:3]:
+        pool._session(key)
+    # keys[0] is now the most recently sent
+    pool._session(keys[0])
+    for key in keys[3:]:
+        pool._session(key)
+    stats = pool.stats()
+    assert list(pool._assignments) == [keys[0], keys[3], keys[4]]
+    assert sum(pool._keys_per_session) == 3
+    pool.close()
+    assert stats["shard_keys"] == 3
+    with pytest.raises(ValueError):
+        PooledClient("127.0.0.1", broker.port, sessions=1, max_shard_keys=0)
+
+
+def test_process_pool_encodes_without_forking(broker):
+    pool = PooledClient("127.0.0.1", broker.port, client_id="pool-spawn", qos=0, sessions=1, processes=1)
+    start_method = pool._executor._mp_context.get_start_method()
+    pool.close()
+    assert start_method != "fork"
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import pytest
+
+from influx_line_mqtt.routing import Route, TopicRouter
+from influx_line_mqtt.subscriber import Subscriber
+
+from .conftest import publish, start_subscriber
+
+
+@pytest.mark.parametrize("topic_filter, topic, matches", [
+    ("sport/tennis/player1", "sport/tennis/player1", True),
+    ("sport/tennis/player1", "sport/tennis/player2", False),
+    ("sport/tennis/player1/#", "sport/tennis/player1", True),
+    ("sport/tennis/player1/#", "sport/tennis/player1/ranking", True),
+    ("sport/tennis/player1/#", "sport/tennis/player1/score/wimbledon", True),
+    ("sport/#", "sport", True),
+    ("#", "sport/tennis", True),
+    ("#", "/leading", True),
+    ("sport/tennis/+", "sport/tennis/player1", True),
+    ("sport/tennis/+", "sport/tennis/player1/ranking", False),
+    ("sport/+", "sport", False),
+    ("sport/+", "sport/", True),
+    ("+/+", "/finance", True),
+    ("/+", "/finance", True),
+    ("+", "/finance", False),
+    ("+/tennis/#", "sport/tennis/player1", True),
+    ("#", "$SYS/broker/load", False),
+    ("+/broker/load", "$SYS/broker/load", False),
+    ("$SYS/#", "$SYS/broker/load", True),
+    ("$SYS/+/load", "$SYS/broker/load", True),
+    ("a/$b", "a/$b", True),
+    ("a/+", "a/$b", True),
+])
+def test_mqtt_matching_rules(topic_filter, topic, matches):
+    router = TopicRouter()
+    router.add(topic_filter, "value")
+    assert (router.match(topic) == ["value"]) is matches
+
+
+def test_every_matching_filter_is_returned():
+    router = TopicRouter()
+    for topic_filter in ("a/b/c", "a/+/c", "a/#", "+/b/#", "#", "a/b", "b/#"):
+        router.add(topic_filter, topic_filter)
+    assert sorted(router.match("a/b/c")) == ["#", "+/b/#", "a/#", "a/+/c", "a/b/c"]
+    assert len(router) == 7
+
+
+@pytest.mark.parametrize("topic_filter", ["a/#/b", "a/b#", "a/+b", "sport+"])
+def test_invalid_filters(topic_filter):
+    with pytest.raises(ValueError):
+        TopicRouter().add(topic_filter, None)
+
+
+def test_remove():
+    router = TopicRouter()
+    router.add("a/#", 1)
+    router.add("a/+", 2)
+    router.remove("a/#", 1)
+    assert router.match("a/b") == [2]
+    with pytest.raises(KeyError):
+        router.remove("a/#", 1)
+    with pytest.raises(KeyError):
+        router.remove("x/y", 2)
+
+
+def test_route_filters():
+    route = Route("#", None, measurement=["temp", "hum"], tags={"room": "bed", "floor": ["1", "2"]})
+    assert route.filtered
+    assert route.accepts("temp", {"room": "bed", "floor": "2", "extra": "x"})
+    assert not route.accepts("pressure", {"room": "bed", "floor": "2"})
+    assert not route.accepts("temp", {"room": "bath", "floor": "2"})
+    assert not route.accepts("temp", {"room": "bed"})
+    assert not Route("#", None).filtered
+
+
+@pytest.mark.parametrize("options", [{}, {"workers": 2}, {"workers": 2, "processes": 2}, {"columnar": True}])
+def test_subscriber_routes(broker, options):
+    received = {"all": [], "temp": [], "bed": []}
+    lock = threading.Lock()
+
+    def handler(name):
+        def handle(client, userdata, data):
+            with lock:
+                received[name].extend(data if options.get("columnar") else [data])
+        return handle
+
+    sub = Subscriber("127.0.0.1", port=broker.port, client_id="router", **options)
+    sub.route("home/#", handler("all"), qos=1)
+    sub.route("home/+/sensors", handler("temp"), qos=1, measurement="temp")
+    sub.route("home/#", handler("bed"), qos=1, tags={"room": "bed"})
+    if options.get("processes"):
+        # a filtered route must not turn off decoding in the process pool
+        assert sub._pipeline.decode is not None
+    start_subscriber(sub, broker, filters=2)
+    payload = b"temp,room=bed v=1i 1\nhum,room=bed v=2i 2\ntemp,room=bath v=3i 3"
+    publish(broker.port, [("home/1/sensors", payload), ("home/other", b"temp,room=bath v=4i 4")])
+    deadline = time.monotonic() + 5
+    while len(received["all"]) < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    sub.stop()
+    values = {name: sorted(point.field_set["v"] for point in points) for name, points in received.items()}
+    assert values == {"all": [1, 2, 3, 4], "temp": [1, 3], "bed": [1, 2]}
@@ -0,0 +1,76 @@
+import time
+
+import pytest
+from influx_line_protocol import Metric
+
+from influx_line_mqtt.parser import parse_line
+from influx_line_mqtt.serializer import encode_fields, render_prefix
+
+from .conftest import OfflineClient
+
+
+def _metric(measurement, tags, values, timestamp):
+    metric = Metric(measurement)
+    metric.with_timestamp(timestamp)
+    for key, value in values.items():
+        metric.add_value(key, value)
+    for key, value in tags.items():
+        metric.add_tag(key, value)
+    return f"{metric}".encode("utf-8")
+
+
+@pytest.mark.parametrize("measurement, tags, values", [
+    ("temp", {"room": "bed"}, {"n": 1}),
+    ("temp", {"room": "bed", "floor": 2}, {"n": -42, "ok": True, "off": False, "note": "hello"}),
+    ("my temp,x", {"tag key": "a,b=c", "t2": "back\\slash"}, {"field key": 7, "f=,x": "say \"hi\" \\o/"}),
+    ("m", {}, {"s": ""}),
+])
+def test_series_encode_matches_metric(measurement, tags, values):
+    client = OfflineClient("localhost", 1883, qos=0)
+    series = client.series(measurement, tags, topic="home")
+    assert series.encode(values, 1656086785126144000) == _metric(measurement, tags, values, 1656086785126144000)
+
+
+def test_floats_keep_full_precision():
+    assert encode_fields({"a": 0.1 + 0.2, "b": 1e-300, "c": 123456789.123456789}) == (
+        f"a={0.1 + 0.2!r},b=1e-300,c={123456789.123456789!r}"
+    )
+    client = OfflineClient("localhost", 1883, qos=0)
+    line = client.series("m", {}, topic="home").encode({"v": 0.1 + 0.2}, 1)
+    assert parse_line(line.decode()).field_set["v"] == 0.1 + 0.2
+
+
+def test_render_prefix_escapes_and_is_cached():
+    tags = (("room name", "bed,1"), ("a=b", "c\\d"))
+    prefix = render_prefix("my meas,x", tags)
+    assert prefix == "my\\ meas\\,x,room\\ name=bed\\,1,a\\=b=c\\\\d "
+    hits = render_prefix.cache_info().hits
+    assert render_prefix("my meas,x", tags) is prefix
+    assert render_prefix.cache_info().hits == hits + 1
+
+
+def test_timestamps_are_read_like_make_send():
+    client = OfflineClient("localhost", 1883, qos=0, precision="ms")
+    series = client.series("m", {"room": "bed"}, topic="home")
+    assert series.encode({"n": 1}, 1656086785126144000).endswith(b" 1656086785126")
+    assert series.encode({"n": 1}, 1656086785.5).endswith(b" 1656086785500")
+    before = time.time_ns() // 10**6
+    timestamp = int(series.encode({"n": 1}).rsplit(b" ", 1)[1])
+    assert before <= timestamp <= time.time_ns() // 10**6
+
+
+def test_send_batches_and_needs_a_topic():
+    client = OfflineClient("localhost", 1883, qos=0, batch=True, linger_ms=10000)
+    series = client.series(None, {"room": "bed"})
+    with pytest.raises(ValueError):
+        series.send({"n": 1}, 1)
+    assert series.dest_table == "bed"
+    assert series.send({"n": 1}, 1, topic="home") is None
+    assert series.send({"n": 2}, 2, topic="home", batch=True) is None
+    assert client.client.published == []
+    series.send({"n": 3}, 3, topic="home", batch=False)
+    client.flush()
+    assert client.client.published == [
+        ("home", b"bed,room=bed n=3i 3"), ("home", b"bed,room=bed n=1i 1\nbed,room=bed n=2i 2"),
+    ]
+    assert client.stats()["encode_seconds_count"] == 3
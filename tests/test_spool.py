@@ -0,0 +1,149 @@
+import os
+import time
+
+from benchmarks.broker import StandInBroker
+from influx_line_mqtt.client import Client
+from influx_line_mqtt.spool import Spool
+
+from .conftest import Collector, free_port
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".spool"))
+
+
+def _read_all(spool):
+    records, position = spool.read(10**6, 10**9)
+    spool.consume(position)
+    return records
+
+
+def _offline_client(port, client_id, spool_dir):
+    client = Client("127.0.0.1", port, client_id=client_id, qos=1, spool_dir=spool_dir)
+    # retry quickly instead of paho's default backoff of one second and more
+    client.client.reconnect_delay_set(0.05, 0.2)
+    return client
+
+
+def test_client_spools_during_outage_and_replays_in_order(tmp_path):
+    port = free_port()
+    client = _offline_client(port, "spooling", str(tmp_path))
+    for i in range(50):
+        client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+    assert client.stats()["messages_spooled"] == 50
+    assert client._spool.pending
+
+    broker = StandInBroker(port=port)
+    broker.start()
+    collector = Collector(port, "home/#")
+    try:
+        lines = collector.wait_lines(50, timeout=15)
+        assert lines == [f"temp,room=bed n={i}i {i + 1}".encode() for i in range(50)]
+        client.make_send("home/bed", {"room": "bed"}, {"n": 50}, 51, "temp")
+        assert collector.wait_lines(51)[-1] == b"temp,room=bed n=50i 51"
+        assert not client._spool.pending
+    finally:
+        client.close()
+        collector.stop()
+        broker.stop()
+
+
+def test_spooled_data_is_sent_by_the_next_client(tmp_path):
+    port = free_port()
+    client = _offline_client(port, "first", str(tmp_path))
+    for i in range(10):
+        client.make_send("home/bed", {"room": "bed"}, {"n": i}, i + 1, "temp")
+    client.close()
+
+    broker = StandInBroker(port=port)
+    broker.start()
+    collector = Collector(port, "home/#")
+    client = Client("127.0.0.1", port, client_id="second", qos=1, spool_dir=str(tmp_path))
+    try:
+        assert collector.wait_lines(10) == [f"temp,room=bed n={i}i {i + 1}".encode() for i in range(10)]
+    finally:
+        client.close()
+        collector.stop()
+        broker.stop()
+
+
+def test_partial_record_is_truncated_on_open(tmp_path):
+    spool = Spool(str(tmp_path))
+    for i in range(5):
+        spool.append("t", b"payload %d" % i)
+    spool.close()
+    path = os.path.join(str(tmp_path), _segments(str(tmp_path))[-1])
+    complete = os.path.getsize(path)
+    with open(path, "ab") as segment:
+        # a header and half a body, as left by a crash in the middle of a write
+        segment.write(open(path, "rb").read()[: 25])
+
+    spool = Spool(str(tmp_path))
+    assert os.path.getsize(path) == complete
+    assert _read_all(spool) == [("t", b"payload %d" % i) for i in range(5)]
+    spool.append("t", b"after")
+    assert _read_all(spool) == [("t", b"after")]
+    spool.close()
+
+
+def test_damaged_record_is_truncated_on_open(tmp_path):
+    spool = Spool(str(tmp_path))
+    for i in range(3):
+        spool.append("t", b"payload %d" % i)
+    spool.close()
+    path = os.path.join(str(tmp_path), _segments(str(tmp_path))[-1])
+    size = os.path.getsize(path)
+    with open(path, "r+b") as segment:
+        segment.seek(size - 1)
+        segment.write(b"X")
+
+    spool = Spool(str(tmp_path))
+    assert _read_all(spool) == [("t", b"payload 0"), ("t", b"payload 1")]
+    spool.close()
+
+
+def test_max_bytes_evicts_the_oldest_segments(tmp_path):
+    spool = Spool(str(tmp_path), max_bytes=4000, segment_bytes=1000)
+    for i in range(100):
+        spool.append("t", b"%04d" % i + b"x" * 96)
+    on_disk = sum(os.path.getsize(os.path.join(str(tmp_path), name)) for name in _segments(str(tmp_path)))
+    assert on_disk <= 4000
+    assert spool.dropped_bytes > 0
+    records = _read_all(spool)
+    numbers = [int(payload[:4]) for _, payload in records]
+    assert numbers == list(range(numbers[0], 100))
+    assert numbers[0] > 0
+    spool.close()
+
+
+def test_max_age_skips_expired_records(tmp_path):
+    spool = Spool(str(tmp_path), max_age=0.2)
+    spool.append("t", b"old 1")
+    spool.append("t", b"old 2")
+    time.sleep(0.3)
+    spool.append("t", b"new")
+    assert _read_all(spool) == [("t", b"new")]
+    assert spool.expired == 2
+    assert not spool.pending
+    spool.close()
+
+
+def test_replay_resumes_from_the_position_file(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    for i in range(30):
+        spool.append("t", b"payload %02d" % i)
+    records, position = spool.read(12)
+    spool.consume(position)
+    assert [payload for _, payload in records] == [b"payload %02d" % i for i in range(12)]
+    # read but not consumed, so it is read again after the restart
+    spool.read(5)
+    spool.close()
+    assert os.path.exists(os.path.join(str(tmp_path), "position"))
+
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    assert [payload for _, payload in _read_all(spool)] == [b"payload %02d" % i for i in range(12, 30)]
+    spool.close()
+
+    spool = Spool(str(tmp_path), segment_bytes=200)
+    assert not spool.pending
+    spool.close()
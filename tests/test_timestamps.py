@@ -0,0 +1,26 @@
+import datetime
+
+import pytest
+
+from influx_line_mqtt.timestamps import InvalidTimestamp, to_nanoseconds, to_precision
+
+
+def test_exact_conversions():
+    assert to_nanoseconds(1656086785126144000) == 1656086785126144000
+    assert to_nanoseconds(1.5) == 1500000000
+    assert to_nanoseconds("2022-06-24T16:06:25.126144Z") == 1656086785126144000
+    assert to_nanoseconds("2022-06-24 18:06:25.126144123+02:00") == 1656086785126144123
+    utc = datetime.datetime(2022, 6, 24, 16, 6, 25, 126144, tzinfo=datetime.timezone.utc)
+    assert to_nanoseconds(utc) == 1656086785126144000
+    assert to_precision(utc, "ms") == 1656086785126
+
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), float("-inf"), "yesterday", b"1", True])
+def test_invalid_values_raise_invalid_timestamp(value):
+    with pytest.raises(InvalidTimestamp):
+        to_nanoseconds(value)
+
+
+def test_invalid_precision():
+    with pytest.raises(InvalidTimestamp):
+        to_precision(1, "m")